@@ -0,0 +1,74 @@
+# ------------------------------------------------------------------------------
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements; and to You under the Apache License,
+# Version 2.0. "
+#
+# Forschungszentrum Jülich
+# Institute: Institute for Advanced Simulation (IAS)
+# Section: Jülich Supercomputing Centre (JSC)
+# Division: High Performance Computing in Neuroscience
+# Laboratory: Simulation Laboratory Neuroscience
+# Team: Multi-scale Simulation and Design
+# ------------------------------------------------------------------------------
+import numpy as np
+from tvb.simulator.coupling import SparseCoupling
+from tvb.simulator.history import SparseHistory
+
+
+def initial_coupling(simulator, id_proxy, time_synch_n, out):
+    """
+    coupling of the proxy nodes for the time steps of the first synchronization time,
+    in one array operation with the sparse history and coupling of TVB when it is possible,
+    otherwise one time step at a time with the coupling function of the simulator
+    :param simulator: tvb simulator
+    :param id_proxy: ids of the proxy nodes
+    :param time_synch_n: number of time steps of the synchronization time
+    :param out: array (time x coupling variable x mode, proxy node) for the result
+    """
+    history = simulator.history
+    coupling = simulator.coupling
+    id_proxy = np.asarray(id_proxy)
+    steps = np.arange(time_synch_n)
+    # rows of out: time step, coupling variable, mode
+    out = out.reshape(time_synch_n, history.n_cvar, history.n_mode, len(id_proxy))
+    if simulator.surface is not None or not isinstance(history, SparseHistory) \
+            or not isinstance(coupling, SparseCoupling) or not _is_post_by_node(coupling, history, id_proxy):
+        # generic coupling function: one time step at a time
+        for i in steps:
+            out[i] = np.swapaxes(simulator._loop_compute_node_coupling(i)[:, id_proxy, :], 1, 2)
+        return
+    # the afferent connections of the proxy nodes, with their weights in the sum by proxy node
+    to_proxy = history.nnz_row_el_idx[:, np.newaxis] == id_proxy[np.newaxis, :]
+    connections = to_proxy.any(axis=1)
+    weights = to_proxy[connections] * history.nnz_weights[connections, np.newaxis]
+    # delayed state of the connections (cvar, time, connection, mode), see SparseHistory.query_sparse
+    time_indices = (steps[:, np.newaxis] - 1 - history.nnz_idelays[connections] + history.n_time) % history.n_time
+    x_j = history.buffer.take(time_indices[np.newaxis, :, :, np.newaxis] * history.time_stride
+                              + history.const_indices[:, np.newaxis, connections, :])
+    # current state of the proxy nodes of the connections
+    x_i = history.buffer[(steps - 1) % history.n_time][:, :, history.nnz_row_el_idx[connections]]
+    pre = coupling.pre(np.swapaxes(x_i, 0, 1), x_j)
+    # the coupling variables stay the first axis for post, see SparseCoupling.__call__
+    gx = coupling.post(np.einsum('ctkm,kp->ctpm', pre, weights))
+    out[:] = gx.transpose((1, 0, 3, 2))
+
+
+def _is_post_by_node(coupling, history, id_proxy):
+    """
+    check that the post function of the coupling gives the same result for the
+    block (coupling variable, time, proxy node, mode) of the proxy nodes as for
+    each time step on all the nodes (coupling variable, node, mode) in TVB,
+    i.e. it is applied node by node
+    :param coupling: sparse coupling of TVB
+    :param history: sparse history of TVB
+    :param id_proxy: ids of the proxy nodes
+    :return: boolean
+    """
+    probe = np.random.default_rng(0).uniform(0.5, 1.5, (history.n_cvar, 2, history.n_node, history.n_mode))
+    try:
+        expected = np.stack([coupling.post(probe[:, i])[:, id_proxy] for i in range(2)], axis=1)
+        result = coupling.post(probe[:, :, id_proxy])
+    except Exception:
+        return False
+    return np.shape(result) == expected.shape and np.allclose(result, expected)
@@ -0,0 +1,154 @@
+# ------------------------------------------------------------------------------
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements; and to You under the Apache License,
+# Version 2.0. "
+#
+# Forschungszentrum Jülich
+# Institute: Institute for Advanced Simulation (IAS)
+# Section: Jülich Supercomputing Centre (JSC)
+# Division: High Performance Computing in Neuroscience
+# Laboratory: Simulation Laboratory Neuroscience
+# Team: Multi-scale Simulation and Design
+# ------------------------------------------------------------------------------
+import os
+import struct
+import numpy as np
+
+# space reserved for the npy header at the beginning of the files, it is
+# written at the end when the number of samples is known
+HEADER_SIZE = 256
+
+
+def monitor_paths(path, index_monitor):
+    """paths of the npy files of the times and of the values of a monitor"""
+    prefix = os.path.join(path, 'tvb_monitor_' + str(index_monitor))
+    return prefix + '_times.npy', prefix + '_values.npy'
+
+
+def load_monitor_results(path, nb_monitor):
+    """
+    lazy reader of the results of the monitors, the data are read from the
+    disk only when they are used
+    :param path: folder of the results
+    :param nb_monitor: number of monitors
+    :return: list of (times, values) of each monitor, memory-mapped arrays
+    """
+    results = []
+    for index_monitor in range(nb_monitor):
+        path_times, path_values = monitor_paths(path, index_monitor)
+        results.append((np.load(path_times, mmap_mode='r'), np.load(path_values, mmap_mode='r')))
+    return results
+
+
+class MonitorWriter:
+    """
+    Chunked writer of the results of the TVB monitors in npy files
+
+    The samples of the monitors are kept in memory for nb_windows
+    synchronization windows, then they are appended to the files:
+    the memory doesn't depend on the length of the simulation.
+    Each monitor has 2 files:
+        - times : (number of samples,)
+        - values : (number of samples, state variable, node, mode)
+    The files are complete after close, also used as context manager.
+    """
+
+    def __init__(self, path, nb_monitor, nb_windows=10):
+        """
+        creation of the files of the monitors
+        :param path: folder of the results
+        :param nb_monitor: number of monitors
+        :param nb_windows: number of synchronization windows between 2 writings
+        """
+        self.__path = path
+        self.__nb_windows = nb_windows
+        self.__nb_windows_pending = 0
+        self.__chunks = [[] for _ in range(nb_monitor)]  # samples waiting to be written
+        self.__dtype = [None] * nb_monitor  # datatype of the values, from the first sample
+        self.__shape = [None] * nb_monitor  # shape of one sample
+        self.__nb_samples = [0] * nb_monitor
+        self.__files = []
+        for index_monitor in range(nb_monitor):
+            files = [open(path_file, 'wb') for path_file in monitor_paths(path, index_monitor)]
+            for file in files:
+                file.write(bytes(HEADER_SIZE))
+            self.__files.append(files)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, index_monitor, result):
+        """
+        add a sample of a monitor
+        :param index_monitor: index of the monitor
+        :param result: (time, values) of the monitor
+        """
+        self.__chunks[index_monitor].append(result)
+
+    def end_window(self):
+        """end of a synchronization window, the samples are written every nb_windows windows"""
+        self.__nb_windows_pending += 1
+        if self.__nb_windows_pending >= self.__nb_windows:
+            self.flush()
+
+    def flush(self):
+        """append the samples in memory to the files"""
+        for index_monitor, chunk in enumerate(self.__chunks):
+            if len(chunk) == 0:
+                continue
+            times = np.array([time for time, _ in chunk], dtype='d')
+            values = np.stack([value for _, value in chunk])
+            if self.__dtype[index_monitor] is None:
+                self.__dtype[index_monitor] = values.dtype
+                self.__shape[index_monitor] = values.shape[1:]
+            elif values.shape[1:] != self.__shape[index_monitor]:
+                raise Exception('MonitorWriter : bad shape of values ' + str(values.shape[1:])
+                                + ' ' + str(self.__shape[index_monitor]))
+            times_file, values_file = self.__files[index_monitor]
+            times_file.write(times.tobytes())
+            values_file.write(values.astype(self.__dtype[index_monitor], copy=False).tobytes())
+            self.__nb_samples[index_monitor] += len(chunk)
+            chunk.clear()
+        self.__nb_windows_pending = 0
+
+    def close(self):
+        """
+        write the last samples and the headers of the files, the headers are
+        written even if the last samples can't be, only the first call has an effect
+        """
+        if self.__files is None:
+            return
+        try:
+            self.flush()
+        finally:
+            for index_monitor, (times_file, values_file) in enumerate(self.__files):
+                nb_samples = self.__nb_samples[index_monitor]
+                dtype = self.__dtype[index_monitor] if self.__dtype[index_monitor] is not None else np.dtype('d')
+                shape = self.__shape[index_monitor] if self.__shape[index_monitor] is not None else ()
+                self._write_header(times_file, np.dtype('d'), (nb_samples,))
+                self._write_header(values_file, dtype, (nb_samples,) + shape)
+                times_file.close()
+                values_file.close()
+            self.__files = None
+
+    @staticmethod
+    def _write_header(file, dtype, shape):
+        """
+        write the npy header (version 1.0) in the space reserved at the beginning of the file
+        :param file: file of the data
+        :param dtype: datatype of the data
+        :param shape: shape of the data
+        """
+        magic = np.lib.format.magic(1, 0)
+        size = HEADER_SIZE - len(magic) - 2  # the length of the header is in 2 bytes
+        header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape})
+        if len(header) + 1 > size:
+            raise Exception('MonitorWriter : the header is too long ' + header)
+        # padding with spaces and ending with a newline, as numpy does
+        header = header.ljust(size - 1) + '\n'
+        file.seek(0)
+        file.write(magic + struct.pack('<H', size) + header.encode('latin1'))
@@ -251,8 +251,9 @@ class TVBAdapter:
             self.__resource_usage_monitor.stop_monitoring()
         self.__logger.info("plotting the result")
         try:
+            # the results are memory-mapped, only the plotted values are read
             plt.figure(1)
-            plt.plot(p_raw_results[0], raw_results[1][:, 0, :, 0] + 3.0)
+            plt.plot(p_raw_results[0], p_raw_results[1][:, 0, :, 0] + 3.0)
             plt.title("Raw -- State variable 0")
             plt.savefig(self.__parameters.path + "/figures/plot_tvb.png")
         except Exception as e:
@@ -17,12 +17,16 @@ from mpi4py import MPI
 
 from EBRAINS_ConfigManager.global_configurations_manager.xml_parsers.default_directories_enum import DefaultDirectories
 from EBRAINS_RichEndpoint.application_companion.common_enums import Response
+from action_adapters_alphabrunel.tvb_simulator.monitor_storage import MonitorWriter, load_monitor_results
+from action_adapters_alphabrunel.tvb_simulator.coupling import initial_coupling
 
 
 class TVBMpiWrapper:
     def __init__(self, log_settings, configurations_manager, simulator_tvb,
                  intercalehub_nest_to_tvb=None,
-                 intercalehub_tvb_to_nest=None) -> None:
+                 intercalehub_tvb_to_nest=None,
+                 is_pipelined=True,
+                 nb_windows_per_writing=10) -> None:
         self.__logger = configurations_manager.load_log_configurations(
                 name="TVB_MPI_Wrapper",
                 log_configurations=log_settings,
@@ -35,22 +39,49 @@ class TVBMpiWrapper:
         self.__time_synch = self.__simulator_tvb.synchronization_time
         self.__time_synch_n = int(np.around(self.__time_synch / self.__dt))
         self.__nb_monitor = len(self.__simulator_tvb.monitors)
-        self.__id_proxy = self.__simulator_tvb.proxy_inds
+        self.__id_proxy = np.asarray(self.__simulator_tvb.proxy_inds)
+        self.__nb_proxy = len(self.__id_proxy)
         # self.__interscalehub_address = interscalehub_address
         self.__intercalehub_nest_to_tvb = intercalehub_nest_to_tvb
         self.__intercalehub_tvb_to_nest = intercalehub_tvb_to_nest
+        # overlap the exchanges with the InterscaleHub and the TVB simulation:
+        # the sends are not blocking and the next receives are posted before the simulation
+        self.__is_pipelined = is_pipelined
         # receiver communicator
         self.__comm_receiver = []
         # sender communicator
         self.__comm_sender = []
-        # initialise the variable for the saving the results
-        self.__simulation_results = []
-        for _ in range(self.__nb_monitor):  # the input output monitor
-            self.__simulation_results.append([])
+        # buffers of the messages (times, size, rates) of the exchanges,
+        # one row by communicator, allocated once in init_mpi
+        self.__receive_times = None
+        self.__receive_sizes = None
+        self.__receive_rates = None
+        self.__send_times = None
+        self.__send_sizes = None
+        self.__send_rates = None
+        # pending requests of the pipelined exchanges
+        self.__receive_requests = []  # ask for the next part, times and size by communicator
+        self.__send_requests = []  # times, size and rates by communicator
+        self.__accept_requests = []  # accept of the next send by communicator
+        # staging arrays of the exchanges, allocated once in init_mpi
+        self.__time_steps = None  # time steps of a synchronization time, from 0
+        self.__cosim_updates = None  # input of TVB: [times, rates (time, 1, proxy node, 1)]
+        # the results of the monitors are written in the results directory
+        # every nb_windows_per_writing synchronization windows, see MonitorWriter
+        self.__path_results = configurations_manager.get_directory(
+                directory=DefaultDirectories.SIMULATION_RESULTS)
+        self.__nb_windows_per_writing = nb_windows_per_writing
+        self.__results_writer = None
 
     def init_mpi(self):
         """sets up MPI communicators"""
-        # create receiver communicator
+        # the ids of the proxy nodes index the nodes of TVB in the exchanges, checked once
+        nb_nodes = self.__simulator_tvb.number_of_nodes
+        if self.__id_proxy.ndim != 1 or not np.issubdtype(self.__id_proxy.dtype, np.integer) \
+                or np.any(self.__id_proxy < 0) or np.any(self.__id_proxy >= nb_nodes):
+            raise (Exception('Bad ids of the proxy nodes ' + str(self.__id_proxy) + " for "
+                             + str(nb_nodes) + " nodes"))
+        # create receiver communicator, one by proxy node as the InterscaleHub expects
         for _ in self.__id_proxy:
             self.__comm_receiver.append(
                 self.__create_mpi_communicator(self.__intercalehub_nest_to_tvb))
@@ -60,6 +91,20 @@ class TVBMpiWrapper:
             self.__comm_sender.append(
                 self.__create_mpi_communicator(self.__intercalehub_tvb_to_nest))
         self.__logger.debug(f"sender communicators: {self.__comm_sender}")
+        # buffers of the exchanges, the rates of the time steps of a synchronization time
+        nb_values = self.__time_synch_n
+        self.__receive_times = np.empty((len(self.__comm_receiver), 2), dtype='d')
+        self.__receive_sizes = np.empty((len(self.__comm_receiver), 1), dtype='i')
+        self.__receive_rates = np.empty((len(self.__comm_receiver), nb_values), dtype='d')
+        self.__send_times = np.empty(2, dtype='d')
+        self.__send_sizes = np.empty(1, dtype='i')
+        self.__send_rates = np.empty((len(self.__comm_sender), nb_values), dtype='d')
+        self.__accept_requests = [None] * len(self.__comm_sender)
+        # the same input structure of TVB for all the runs, filled in place
+        self.__time_steps = np.arange(self.__time_synch_n)
+        self.__cosim_updates = np.empty((2,), dtype=object)
+        self.__cosim_updates[:] = [np.empty(self.__time_synch_n, dtype='d'),
+                                   np.empty((self.__time_synch_n, 1, self.__nb_proxy, 1), dtype='d')]
         # TODO error handling
 
     def __create_mpi_communicator(self, interscalehub_address):
@@ -69,52 +114,88 @@ class TVBMpiWrapper:
         self.__logger.info(f"connected to {interscalehub_address}")
         return comm
 
-    def __send_mpi(self, comm, times, data):
+    def __wait_accept(self, index, comm):
+        """
+        wait until the transformer accept the connections
+        :param index: index of the MPI communicator
+        :param comm: MPI communicator
+        :return: the id of the excepted source
+        """
+        status_ = MPI.Status()
+        accept = False
+        req = self.__accept_requests[index]
+        self.__accept_requests[index] = None
+        while not accept:
+            if req is None:
+                req = comm.irecv(source=0, tag=0)
+            accept = req.wait(status_)
+            req = None
+        return status_.Get_source()
+
+    def __send_mpi(self, index, comm, times, data):
         """
         send mpi data
+        :param index: index of the MPI communicator
         :param comm: MPI communicator
         :param times: times of values
-        :param data: rates inputs
+        :param data: rates inputs, contiguous array of doubles
         :param logger: logger of the modules
         :return:nothing
         """
         self.__logger.info("start send")
-        status_ = MPI.Status()
         # wait until the transformer accept the connections
-        accept = False
-        while not accept:
-            req = comm.irecv(source=0, tag=0)
-            accept = req.wait(status_)
-            self.__logger.info("send accept")
-        source = status_.Get_source()  # the id of the excepted source
-        self.__logger.info("get source")
-        data = np.ascontiguousarray(data, dtype='d')  # format the rate for sending
-        shape = np.array(data.shape[0], dtype='i')  # size of data
-        times = np.array(times, dtype='d')  # time of starting and ending step
-        comm.Send([times, MPI.DOUBLE], dest=source, tag=0)
-        comm.Send([shape, MPI.INT], dest=source, tag=0)
-        comm.Send([data, MPI.DOUBLE], dest=source, tag=0)
+        source = self.__wait_accept(index, comm)
+        self.__logger.info("send accept")
+        self.__send_times[:] = times  # time of starting and ending step
+        self.__send_sizes[0] = data.shape[0]  # size of data
+        if self.__is_pipelined:
+            # completed before the buffers are reused, wait the next accept during the simulation
+            self.__send_requests.extend(
+                [comm.Isend([self.__send_times, MPI.DOUBLE], dest=source, tag=0),
+                 comm.Isend([self.__send_sizes, MPI.INT], dest=source, tag=0),
+                 comm.Isend([data, MPI.DOUBLE], dest=source, tag=0)])
+            self.__accept_requests[index] = comm.irecv(source=0, tag=0)
+        else:
+            comm.Send([self.__send_times, MPI.DOUBLE], dest=source, tag=0)
+            comm.Send([self.__send_sizes, MPI.INT], dest=source, tag=0)
+            comm.Send([data, MPI.DOUBLE], dest=source, tag=0)
         self.__logger.info("end send")
 
-    def __mpi_receive(self, comm):
+    def __wait_send(self):
+        """complete the pending sends, before the reuse of the send buffers"""
+        MPI.Request.Waitall(self.__send_requests)
+        self.__send_requests = []
+
+    def __post_receive(self):
+        """
+        ask the next part of all the communicators, and post the receives of the times and the size
+        """
+        for index, comm in enumerate(self.__comm_receiver):
+            # send to the transformer : I want the next part
+            self.__receive_requests.append(
+                [comm.isend(True, dest=0, tag=0),
+                 comm.Irecv([self.__receive_times[index], MPI.DOUBLE], source=0, tag=MPI.ANY_TAG),
+                 comm.Irecv([self.__receive_sizes[index], MPI.INT], source=0, tag=0)])
+
+    def __mpi_receive(self, index, comm, requests):
         """ 
             receive proxy values the
+        :param index: index of the MPI communicator
         :param comm: MPI communicator
+        :param requests: requests posted by __post_receive for this communicator
         :param logger: logger of the modules
-        :return: rate of all proxy
+        :return: times and rates of the communicator
         """
         self.__logger.info("start receive")
         status_ = MPI.Status()
-        # send to the transformer : I want the next part
-        req = comm.isend(True, dest=0, tag=0)
-        req.wait()
-        time_step = np.empty(2, dtype='d')
-        comm.Recv([time_step, 2, MPI.DOUBLE], source=0, tag=MPI.ANY_TAG, status=status_)
-        # get the size of the rate
-        size = np.empty(1, dtype='i')
-        comm.Recv([size, MPI.INT], source=0, tag=0)
-        # get the rate
-        rates = np.empty(size, dtype='d')
+        MPI.Request.Waitall(requests)
+        time_step = self.__receive_times[index]
+        # get the rate, in the buffer of the communicator when it fits
+        size = int(self.__receive_sizes[index, 0])
+        if size <= self.__receive_rates.shape[1]:
+            rates = self.__receive_rates[index, :size]
+        else:
+            rates = np.empty(size, dtype='d')
         comm.Recv([rates, size, MPI.DOUBLE], source=0, tag=MPI.ANY_TAG, status=status_)
         self.__logger.info("end receive " + str(time_step))
         # print the summary of the data
@@ -123,9 +204,10 @@ class TVBMpiWrapper:
         else:
             return None
 
-    def __end_mpi(self, comm, is_mode_sending):
+    def __end_mpi(self, index, comm, is_mode_sending):
         """
         ending the communication
+        :param index: index of the MPI communicator
         :param comm: MPI communicator
         :param path: for the close the port
         :param sending: if the transformer is for sending or receiving data
@@ -136,15 +218,10 @@ class TVBMpiWrapper:
         if is_mode_sending:
             self.__logger.info(f"TVB close connection send {self.__intercalehub_tvb_to_nest}")
             sys.stdout.flush()
-            status_ = MPI.Status()
             # wait until the transformer accept the connections
             self.__logger.info("TVB send check")
-            accept = False
-            while not accept:
-                req = comm.irecv(source=0, tag=0)
-                accept = req.wait(status_)
+            source = self.__wait_accept(index, comm)
             self.__logger.info("TVB send end simulation")
-            source = status_.Get_source()  # the id of the excepted source
             times = np.array([0., 0.], dtype='d')  # time of starting and ending step
             comm.Send([times, MPI.DOUBLE], dest=source, tag=1)
             self.__close_connection(comm, self.__intercalehub_tvb_to_nest)
@@ -171,18 +248,21 @@ class TVBMpiWrapper:
         self.__logger.info("TVB close connection " + address)
     
     def __prepare_and_send_initialization_date(self):
-        # prepare initialization data
+        # prepare initialization data, block (time x proxy node)
         self.__logger.info("send initialization of TVB: prepare data")
-        initialization_data = []
-        for i in np.arange(0, self.__time_synch_n, 1, dtype=np.int):
-            initialization_data.append(self.__simulator_tvb._loop_compute_node_coupling(i)[:, self.__id_proxy, :])
-        initialization_data = np.concatenate(initialization_data)
+        history = self.__simulator_tvb.history
+        initialization_data = np.empty((self.__time_synch_n * history.n_cvar * history.n_mode,
+                                        self.__nb_proxy), dtype='d')
+        initial_coupling(self.__simulator_tvb, self.__id_proxy, self.__time_synch_n, initialization_data)
+        initialization_data *= 1e3
+        # the values of each proxy node are contiguous
+        initialization_data = np.ascontiguousarray(initialization_data.T)
         time_init = [0, self.__time_synch]
 
         # send initialization data
         self.__logger.info("send initialization of TVB: send data")
         for index, comm in enumerate(self.__comm_sender):
-            self.__send_mpi(comm, time_init, initialization_data[:, index] * 1e3)
+            self.__send_mpi(index, comm, time_init, initialization_data[index])
 
     def __receive_data(self):
         """
@@ -191,32 +271,43 @@ class TVBMpiWrapper:
         """
         data_value = []
         self.__logger.debug("start receiving data")
-        for comm in self.__comm_receiver:
-            receive = self.__mpi_receive(comm)
+        if not self.__receive_requests:
+            self.__post_receive()
+        for index, comm in enumerate(self.__comm_receiver):
+            receive = self.__mpi_receive(index, comm, self.__receive_requests[index])
             time_data = receive[0]
             data_value.append(receive[1])
-        self.__logger.debug(f"time received: {time_data}, data received: {data_value}")
+        self.__receive_requests = []
+        self.__logger.debug("time received: %s, data received: %s", time_data, data_value)
         return data_value, time_data, receive  # spikes
 
     def __format_and_reshape_simulation_data(self, data_value, time_data, receive):
-        """helper function to format and reshape simulation data"""
-        data = np.empty((2,), dtype=object)
-        nb_step = np.rint((time_data[1] - time_data[0]) / self.__dt)
-        nb_step_0 = np.rint(time_data[0] / self.__dt) + 1  # start at the first time step not at 0.0
-        time_data = np.arange(nb_step_0, nb_step_0 + nb_step, 1) * self.__dt
-        data_value = np.swapaxes(np.array(data_value), 0, 1)[:, :]
-        data_value = np.expand_dims(data_value, axis=(1, 3))
-        # check time and data shapes
-        if data_value.shape[0] != time_data.shape[0]:
-            self.__logger.critical(nb_step)
-            self.__logger.critical(self.__dt, time_data, receive)
-            self.__logger.critical(f"Bad shape of data:{data_value.shape[0]}, time shape: {time_data.shape[0]}")
+        """
+        helper function to format and reshape simulation data,
+        in the input of TVB allocated in init_mpi
+        """
+        data = self.__cosim_updates
+        times = data[0]
+        # integer time steps of the step, converted once from the starting time,
+        # the time in ms only for TVB
+        nb_step_0 = int(np.rint(time_data[0] / self.__dt)) + 1  # start at the first time step not at 0.0
+        np.add(self.__time_steps, nb_step_0, out=times)
+        times *= self.__dt
+        # check time and data shapes, one rate per time step and proxy node
+        nb_values = sum(value.shape[0] for value in data_value)
+        if any(value.shape[0] != times.shape[0] for value in data_value):
+            self.__logger.critical(f"time: {time_data}, received: {receive}")
+            self.__logger.critical(f"Bad shape of data:{nb_values}, "
+                                   f"time shape: {times.shape[0]}, proxy nodes: {self.__nb_proxy}")
             # TODO handle exception
-            raise (Exception('Bad shape of data ' + str(data_value.shape[0]) + " " + str(time_data.shape[0])))
+            raise (Exception('Bad shape of data ' + str(nb_values) + " "
+                             + str(times.shape[0] * self.__nb_proxy)))
+        # copy of the rates of each proxy node, the buffers of the receive are reused
+        for index, value in enumerate(data_value):
+            data[1][:, 0, index, 0] = value
         
         # all is fine
-        self.__logger.debug(f"after formatting, time:{time_data}, data:{data_value}")
-        data[:] = [time_data, data_value]
+        self.__logger.debug("after formatting, time:%s, data:%s", time_data, data[1])
         return data
     
     def __run_tvb_simulation(self, data):
@@ -228,7 +319,8 @@ class TVBMpiWrapper:
             for i in range(self.__nb_monitor):
                 if result[i] is not None:
                     # save results of current simulation run
-                    self.__simulation_results[i].append(result[i])
+                    self.__results_writer.append(i, result[i])
+        self.__results_writer.end_window()
         self.__logger.info(" TVB end simulation")
     
     def __send_data(self):
@@ -238,40 +330,51 @@ class TVBMpiWrapper:
         # get TVB output (rates) for NEST
         data_for_nest = self.__simulator_tvb.loop_cosim_monitor_output(n_steps=self.__time_synch_n)[0]
         times = [data_for_nest[0][0], data_for_nest[0][-1]]
-        rate = np.concatenate(data_for_nest[1][:, 0, [self.__id_proxy], 0])
+        # rates of each proxy node (proxy node x time), written in the buffers of the send when it fits
+        values = data_for_nest[1][:, 0, :, 0]
+        self.__wait_send()
+        if values.shape[0] == self.__send_rates.shape[1]:
+            rate = self.__send_rates
+        else:
+            rate = np.empty((self.__nb_proxy, values.shape[0]), dtype='d')
+        if values.dtype == rate.dtype:
+            np.take(values.T, self.__id_proxy, axis=0, out=rate)
+        else:
+            rate[:] = values.T[self.__id_proxy]
+        rate *= 1e3
         for index, comm in enumerate(self.__comm_sender):
-            self.__send_mpi(comm, times, rate[:, index] * 1e3)
+            self.__send_mpi(index, comm, times, rate[index])
         self.__logger.debug("data is send")
 
     def __finalize(self):
         """helper function to end communications and finalize MPI"""
         # close ports and send signal to end communications by
         # Inter-communicator for sending MPI data
+        self.__wait_send()
         for index, comm in enumerate(self.__comm_sender):
             self.__logger.info('end comm send')
-            self.__end_mpi(comm, is_mode_sending=True)
+            self.__end_mpi(index, comm, is_mode_sending=True)
         
         # close ports and send signal to end communications by
         # Inter-communicator for receiving MPI data
         for index, comm in enumerate(self.__comm_receiver):
             self.__logger.info('end comm receive')
-            self.__end_mpi(comm, is_mode_sending=False)
+            self.__end_mpi(index, comm, is_mode_sending=False)
         
         # ending with MPI
         MPI.Finalize()
 
     def __reshape_result(self):
-        """reshapes the output of TVB for the"""
-        times = []
-        values = []
+        """
+        reshapes the output of TVB for the post-processing, the results
+        are memory-mapped from the files of the first monitor
+        """
         result = []
         try:
-            for (running_time, running_value) in self.__simulation_results[0]:
-                if running_time > 0.0:
-                    times.append(running_time)
-                    values.append(running_value)
-
-            result = ([np.array(times), np.expand_dims(np.concatenate(values), 1)],)
+            times, values = load_monitor_results(self.__path_results, self.__nb_monitor)[0]
+            # the samples are in order of time: skip the initial time
+            start = np.searchsorted(times, 0.0, side='right')
+            result = ([times[start:], values[start:]],)
         except Exception as e:
             # log the exception with traceback and continue
             self.__logger.exception("could not reshaped the result because"
@@ -287,28 +390,39 @@ class TVBMpiWrapper:
         :param path: the folder of the simulation
         :param logger: logger of the run
         """
-        # prepare and send initialization data, required by protocol to signal
-        # ready to receive
-        self.__prepare_and_send_initialization_date()
-        self.__simulation_run_counter = 0  # NOTE initial simulaiton step is alreay done ??
-        # the main loop of the simulation and data exchange
-        self.__logger.debug(f'global_minimum_step_size: {global_minimum_step_size}')
-        while self.__simulation_run_counter * self.__time_synch < self.__simulation_length:
-        # while self.__simulation_run_counter * global_minimum_step_size < self.__simulation_length:
-            # 1. increment of the loop
-            self.__simulation_run_counter += 1
-            # 2. receive data from InterscaleHub_NEST_to_TVB
-            data_value, time_data, receive = self.__receive_data()
-            # 3. format time and data for input to TVB simulation
-            data = self.__format_and_reshape_simulation_data(data_value, time_data, receive)
-            # 4. run TVB simulation until next synchronization time check with
-            # data received from NEST
-            self.__run_tvb_simulation(data)
-            # 5. send data to InterscaleHub_TVB_to_NEST
-            self.__send_data()
+        # the files of the results of the monitors
+        self.__results_writer = MonitorWriter(self.__path_results, self.__nb_monitor,
+                                              nb_windows=self.__nb_windows_per_writing)
+        try:
+            # prepare and send initialization data, required by protocol to signal
+            # ready to receive
+            self.__prepare_and_send_initialization_date()
+            self.__simulation_run_counter = 0  # NOTE initial simulaiton step is alreay done ??
+            # the main loop of the simulation and data exchange
+            self.__logger.debug(f'global_minimum_step_size: {global_minimum_step_size}')
+            while self.__simulation_run_counter * self.__time_synch < self.__simulation_length:
+            # while self.__simulation_run_counter * global_minimum_step_size < self.__simulation_length:
+                # 1. increment of the loop
+                self.__simulation_run_counter += 1
+                # 2. receive data from InterscaleHub_NEST_to_TVB
+                data_value, time_data, receive = self.__receive_data()
+                # 3. format time and data for input to TVB simulation
+                data = self.__format_and_reshape_simulation_data(data_value, time_data, receive)
+                # the data are copied, ask the data of the next run before the simulation
+                if self.__is_pipelined and \
+                        self.__simulation_run_counter * self.__time_synch < self.__simulation_length:
+                    self.__post_receive()
+                # 4. run TVB simulation until next synchronization time check with
+                # data received from NEST
+                self.__run_tvb_simulation(data)
+                # 5. send data to InterscaleHub_TVB_to_NEST
+                self.__send_data()
            
-            # 6. continue simulation and data exchange
-            continue
+                # 6. continue simulation and data exchange
+                continue
+        finally:
+            # the files of the results are complete, also when the simulation fails
+            self.__results_writer.close()
 
         # finishes simulation and data exchange
         # now save the last part
@@ -0,0 +1,351 @@
+# ------------------------------------------------------------------------------
+#  Copyright 2020 Forschungszentrum Jülich GmbH
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor
+#  license agreements; and to You under the Apache License, Version 2.0. "
+#
+# Forschungszentrum Jülich
+#  Institute: Institute for Advanced Simulation (IAS)
+#    Section: Jülich Supercomputing Centre (JSC)
+#   Division: High Performance Computing in Neuroscience
+# Laboratory: Simulation Laboratory Neuroscience
+#       Team: Multi-scale Simulation and Design
+#
+# ------------------------------------------------------------------------------
+
+from mpi4py import MPI
+from enum import IntEnum
+import numpy as np
+import logging
+import sys
+
+
+class RingIndex(IntEnum):
+    '''
+    Layout of the ring entries at the beginning of the control block.
+    '''
+    HEAD = 0  # number of slots filled by the writer since the start
+    TAIL = 1  # number of slots cleared by the reader since the start
+    SIZE = 2  # number of ring entries, the entries of the slots follow
+
+
+class SlotIndex(IntEnum):
+    '''
+    Layout of the entries of one slot in the control block.
+    '''
+    STATE = 0  # BufferState of the slot
+    HEAD = 1  # first index of the slot WITHOUT data
+    SIZE = 2  # number of entries per slot
+
+
+class BufferState(IntEnum):
+    '''
+    State of a slot of the data buffer, the values are the ones of the former
+    status entry at the tail of the data buffer.
+    '''
+    READY_TO_READ = 0  # filled by the writer, ready to do the analysis
+    READY_TO_WRITE = 1  # cleared by the reader, ready to receive new data
+
+
+class HandoffTag(IntEnum):
+    '''
+    Tags of the wakeup messages on the INTRA communicator.
+    '''
+    DATA_READY = 100  # writer -> readers: the slot at the tail is filled
+    BUFFER_FREE = 101  # lead reader -> writer: one more slot can be overwritten
+    RESIZE = 102  # writer -> readers: the slots grow, payload is the new slot size
+
+
+class BufferManager:
+    '''
+    Shared memory buffer of the InterscaleHub and the handoff of this buffer
+    between the rank which writes it (receiver of the input simulation) and
+    the ranks which read it (transformation and sender to the output simulation).
+
+    All readers transform their part of each slot. The lead reader (first of
+    reader_ranks, the sender) clears the slot once the partial results of
+    all readers are collected, i.e. after the reduction in the pivot.
+
+    The buffer is a ring of nb_slots slots, one simulation step per slot.
+    The writer fills the slot at the head of the ring while the reader still
+    transforms the slot at the tail, so receiving step k+1 and transforming
+    step k run concurrently. The writer only blocks if all slots are filled,
+    the reader only blocks if all slots are cleared.
+
+    Two MPI shared windows are allocated on the root rank:
+    - the data buffer (doubles), nb_slots consecutive slots of slot_size
+    - the control block (integers), head and tail of the ring followed by
+      the state and the head of each slot
+
+    No rank polls the control block. Each change of state is followed by a
+    wakeup message on the INTRA communicator, on which the other rank blocks
+    with a plain MPI receive.
+
+    The slot size is an estimate of the largest simulation step. If a step
+    does not fit, the writer grows the data buffer (see reserve), the data
+    already received in the slot is kept. The peak usage is tracked to tune
+    the estimate, see log_usage.
+    '''
+    def __init__(self, intracomm, slot_size, writer_rank, reader_ranks, nb_slots=2, root=0):
+        '''
+        Allocate the shared windows, collective over the INTRA communicator.
+
+        :param intracomm: INTRA communicator of the InterscaleHub
+        :param slot_size: number of doubles of one slot of the data buffer
+        :param writer_rank: rank which receives the data and fills the slots
+        :param reader_ranks: ranks which transform the data, the first one clears the slots
+        :param nb_slots: number of slots of the ring
+        :param root: rank which holds the shared memory
+        '''
+        self.__logger = logging.getLogger("BufferManager")
+        handler = logging.StreamHandler(sys.stdout)
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        handler.setFormatter(formatter)
+        self.__logger.addHandler(handler)
+        self.__logger.setLevel(logging.DEBUG)
+
+        if nb_slots < 1:
+            raise Exception('the buffer needs at least one slot, got ' + str(nb_slots))
+        self.__comm = intracomm
+        self.__writer_rank = writer_rank
+        self.__reader_ranks = list(reader_ranks)
+        self.__lead_reader = self.__reader_ranks[0]
+        self.__root = root
+        self.__nb_slots = nb_slots
+        self.__slot_size = slot_size
+        # payload of the wakeup messages, only used by RESIZE (new slot size)
+        self.__wakeup = np.zeros(1, dtype='q')
+        # writer only: number of BUFFER_FREE messages received so far
+        self.__nb_freed = 0
+        # writer only: largest head of a slot so far and number of resize
+        self.__peak_usage = 0
+        self.__nb_resize = 0
+        # readers only: number of slots read so far, each reader keeps its own
+        # count since only the lead reader moves the tail of the ring
+        self.__nb_read = 0
+
+        self.__data_win, self.databuffer = self._allocate(
+            nb_slots * slot_size, MPI.DOUBLE, 'd')
+        self.__control_win, self.__control = self._allocate(
+            RingIndex.SIZE + nb_slots * SlotIndex.SIZE, MPI.INT, 'i')
+        # one row of entries per slot
+        self.__slots_control = self.__control[RingIndex.SIZE:].reshape(nb_slots, SlotIndex.SIZE)
+        if self.__comm.Get_rank() == self.__root:
+            self.__control[RingIndex.HEAD] = 0
+            self.__control[RingIndex.TAIL] = 0
+            self.__slots_control[:, SlotIndex.STATE] = BufferState.READY_TO_WRITE
+            self.__slots_control[:, SlotIndex.HEAD] = 0
+        # the initial state must be visible before any rank uses the buffer
+        self.__control_win.Sync()
+        self.__comm.Barrier()
+        self.__control_win.Sync()
+
+    def _allocate(self, size, mpi_type, dtype):
+        '''
+        Create one shared memory window. MPI One-sided-Communication.
+
+        :param size: number of elements of the window
+        :param mpi_type: MPI datatype of the elements
+        :param dtype: numpy datatype of the elements
+        :return win, array: the window and a numpy array pointing to the shared mem
+        '''
+        datasize = mpi_type.Get_size()
+        if self.__comm.Get_rank() == self.__root:
+            bufbytes = datasize * size
+        else:
+            bufbytes = 0
+        # root: create the shared block
+        # rank 1-x: get a handle to it
+        win = MPI.Win.Allocate_shared(bufbytes, datasize, comm=self.__comm)
+        buf, itemsize = win.Shared_query(self.__root)
+        if itemsize != datasize:
+            raise Exception('bad item size of the shared window : ' + str(itemsize) + ' instead of ' + str(datasize))
+        # passive target epoch for the whole run, Sync() acts as memory barrier
+        win.Lock_all(MPI.MODE_NOCHECK)
+        return win, np.ndarray(buffer=buf, dtype=dtype, shape=(size,))
+
+    def _resize(self, slot_size, ring_head, keep):
+        '''
+        Grow the slots of the data buffer, collective over the INTRA communicator.
+        The readers join when they receive the RESIZE message. All the slots
+        filled before are cleared at this point (the DATA_READY messages are
+        received in order), only the slot at the head holds data.
+
+        :param slot_size: new number of doubles of one slot
+        :param ring_head: position of the slot which is filled by the writer
+        :param keep: number of doubles of this slot copied to the new buffer
+        '''
+        old_win = self.__data_win
+        old_slot, _ = self._slot(ring_head)
+        self.__data_win, self.databuffer = self._allocate(
+            self.__nb_slots * slot_size, MPI.DOUBLE, 'd')
+        self.__slot_size = slot_size
+        if self.__comm.Get_rank() == self.__writer_rank and keep > 0:
+            new_slot, _ = self._slot(ring_head)
+            new_slot[:keep] = old_slot[:keep]
+        self.__data_win.Sync()
+        del old_slot
+        old_win.Unlock_all()
+        old_win.Free()
+
+    @property
+    def nb_slots(self):
+        return self.__nb_slots
+
+    @property
+    def slot_size(self):
+        return self.__slot_size
+
+    def _slot(self, index):
+        '''
+        :param index: position in the ring (head or tail)
+        :return slot, control: data of the slot and its entries in the control block
+        '''
+        position = index % self.__nb_slots
+        begin = position * self.__slot_size
+        return (self.databuffer[begin:begin + self.__slot_size],
+                self.__slots_control[position])
+
+    @staticmethod
+    def _check_state(slot_control, state):
+        '''
+        :param slot_control: entries of the slot in the control block
+        :param state: state expected for the slot
+        '''
+        if slot_control[SlotIndex.STATE] != state:
+            raise Exception('bad state of the buffer slot : ' + str(int(slot_control[SlotIndex.STATE]))
+                            + ' expected ' + str(int(state)))
+
+    def wait_for_writing(self):
+        '''
+        Writer: block until the slot at the head of the ring is cleared.
+
+        :return slot: data buffer of the slot to fill
+        '''
+        ring_head = int(self.__control[RingIndex.HEAD])
+        # all slots are filled: wait for the reader to clear the oldest one
+        while ring_head - self.__nb_freed >= self.__nb_slots:
+            self.__comm.Recv([self.__wakeup, MPI.INT64_T], source=self.__lead_reader,
+                             tag=HandoffTag.BUFFER_FREE)
+            self.__nb_freed += 1
+        self.__control_win.Sync()
+        slot, slot_control = self._slot(ring_head)
+        self._check_state(slot_control, BufferState.READY_TO_WRITE)
+        return slot
+
+    def reserve(self, size, head):
+        '''
+        Writer: make sure the slot at the head of the ring can hold size doubles.
+        If it can not, the slots grow at least by a factor 2 and the readers are
+        woken up to take part in the reallocation.
+
+        :param size: number of doubles the slot has to hold
+        :param head: first index of the slot WITHOUT data, the data is kept
+        :return slot: data buffer of the slot to fill, a new one if it has grown
+        '''
+        ring_head = int(self.__control[RingIndex.HEAD])
+        if size > self.__slot_size:
+            slot_size = max(int(size), 2 * self.__slot_size)
+            self.__logger.info("overflow of the buffer slot: " + str(size) + " doubles, slot of "
+                               + str(self.__slot_size) + ", grow to " + str(slot_size))
+            self.__wakeup[0] = slot_size
+            for reader in self.__reader_ranks:
+                self.__comm.Send([self.__wakeup, MPI.INT64_T], dest=reader,
+                                 tag=HandoffTag.RESIZE)
+            self._resize(slot_size, ring_head, head)
+            self.__nb_resize += 1
+        slot, _ = self._slot(ring_head)
+        return slot
+
+    def end_writing(self, head):
+        '''
+        Writer: mark the slot at the head as 'ready to do analysis',
+        move the head of the ring and wake up the reader.
+
+        :param head: first index of the slot WITHOUT data
+        '''
+        ring_head = int(self.__control[RingIndex.HEAD])
+        _, slot_control = self._slot(ring_head)
+        self._check_state(slot_control, BufferState.READY_TO_WRITE)
+        slot_control[SlotIndex.HEAD] = head
+        slot_control[SlotIndex.STATE] = BufferState.READY_TO_READ
+        self.__control[RingIndex.HEAD] = ring_head + 1
+        self.__data_win.Sync()
+        self.__control_win.Sync()
+        self.__peak_usage = max(self.__peak_usage, head)
+        for reader in self.__reader_ranks:
+            self.__comm.Send([self.__wakeup, MPI.INT64_T], dest=reader,
+                             tag=HandoffTag.DATA_READY)
+
+    def wait_for_reading(self):
+        '''
+        Reader: block until the slot at the tail of the ring is filled.
+
+        :return slot, head: data buffer of the slot to read and
+            first index of the slot WITHOUT data
+        '''
+        status_ = MPI.Status()
+        while True:
+            self.__comm.Recv([self.__wakeup, MPI.INT64_T], source=self.__writer_rank,
+                             tag=MPI.ANY_TAG, status=status_)
+            if status_.Get_tag() == HandoffTag.DATA_READY:
+                break
+            elif status_.Get_tag() == HandoffTag.RESIZE:
+                self._resize(int(self.__wakeup[0]), self.__nb_read, 0)
+            else:
+                raise Exception("bad handoff tag : " + str(status_.Get_tag()))
+        self.__control_win.Sync()
+        self.__data_win.Sync()
+        slot, slot_control = self._slot(self.__nb_read)
+        self._check_state(slot_control, BufferState.READY_TO_READ)
+        return slot, int(slot_control[SlotIndex.HEAD])
+
+    def end_reading(self):
+        '''
+        Reader: done with the slot at the tail.
+        The lead reader marks it as 'ready to receive', moves the tail of the
+        ring and wakes up the writer. It has to be called by the lead reader
+        only when all readers are done with the slot.
+        '''
+        self.__nb_read += 1
+        if self.__comm.Get_rank() != self.__lead_reader:
+            return
+        ring_tail = int(self.__control[RingIndex.TAIL])
+        _, slot_control = self._slot(ring_tail)
+        self._check_state(slot_control, BufferState.READY_TO_READ)
+        slot_control[SlotIndex.STATE] = BufferState.READY_TO_WRITE
+        self.__control[RingIndex.TAIL] = ring_tail + 1
+        self.__control_win.Sync()
+        self.__comm.Send([self.__wakeup, MPI.INT64_T], dest=self.__writer_rank,
+                         tag=HandoffTag.BUFFER_FREE)
+
+    def close(self):
+        '''
+        End of the handoff, collective over the INTRA communicator.
+        The writer only waits for BUFFER_FREE when all slots are filled, so the
+        last ones are still pending at the end of the simulation. The lead reader
+        gives the number of slots it has cleared and the writer receives the
+        pending messages before the shared windows are freed.
+        '''
+        rank = self.__comm.Get_rank()
+        nb_cleared = self.__comm.bcast(int(self.__control[RingIndex.TAIL]) if rank == self.__lead_reader else None,
+                                       root=self.__lead_reader)
+        if rank == self.__writer_rank:
+            while self.__nb_freed < nb_cleared:
+                self.__comm.Recv([self.__wakeup, MPI.INT64_T], source=self.__lead_reader,
+                                 tag=HandoffTag.BUFFER_FREE)
+                self.__nb_freed += 1
+        for win in (self.__data_win, self.__control_win):
+            win.Unlock_all()
+            win.Free()
+
+    def log_usage(self):
+        '''
+        Writer: report the peak usage of the slots, used to tune the
+        estimate of the slot size.
+        '''
+        if self.__comm.Get_rank() != self.__writer_rank:
+            return
+        self.__logger.info("peak usage of the buffer slots: " + str(self.__peak_usage)
+                           + " of " + str(self.__slot_size) + " doubles ("
+                           + str(round(100.0 * self.__peak_usage / self.__slot_size, 1))
+                           + "%), " + str(self.__nb_resize) + " resize(s)")
@@ -22,6 +22,8 @@ import time
 from Interscale_hub.parameter import Parameter
 import Interscale_hub.pivot as piv
 import Interscale_hub.IntercommManager as icm
+from Interscale_hub.BufferManager import BufferManager
+from Interscale_hub.protocol import Header
 
 
 class InterscaleHub:
@@ -32,6 +34,8 @@ class InterscaleHub:
     Init:
     - Parameter reading and initialisation
     - Buffer creation, MPI shared memory, layout depending on the parameter
+    - Ring of buffer slots, receive and transform of consecutive steps overlap
+    - Integer control block and wakeup messages for the buffer handoff between ranks
     - Open MPi ports (write to file) and accept connections
     - create (two) MPI intercommunicators, one for each applications
     
@@ -39,10 +43,11 @@ class InterscaleHub:
     - initialise the pivot operation
     - start receive and send (data channels)
     - TODO: multiplexing 
-    - proper M:N mapping of MPI ranks in the Pivot-operation
+    - M:N mapping of MPI ranks in the Pivot-operation
         - How many MPI ranks on the sending simulation (M ranks)
         - How many MPI ranks on the InterscaleHub (N ranks)
-        -> This contains: parallel buffer access, transformation, analysis and sending
+        -> one receiver rank, the other N-1 ranks (workers) transform in parallel,
+           the first worker (sender) collects the results and sends them
     - M:N:O mapping -> How many MPI ranks on the receiving simulation (O ranks)
     - multiple transformers, second pivot?
     
@@ -71,7 +76,7 @@ class InterscaleHub:
         self.__logger.debug("Init Params...")
         self._init_params(param,direction)
         
-        # 2) create buffer in self.__databuffer
+        # 2) create buffer in self.__buffer
         self.__logger.debug("Creating Buffer...")
         self._create_buffer()
         self.__logger.info("Buffer created...")
@@ -94,14 +99,16 @@ class InterscaleHub:
                 self.__param,
                 self.__input_comm, 
                 self.__output_comm, 
-                self.__databuffer)
+                self.__buffer,
+                self.__worker_comm)
         elif self.__direction == 2:
             self.__pivot = piv.TvbNestPivot(
                 self.__comm,
                 self.__param, 
                 self.__input_comm, 
                 self.__output_comm, 
-                self.__databuffer)
+                self.__buffer,
+                self.__worker_comm)
         self.__pivot.start(self.__comm)
         
 
@@ -114,18 +121,14 @@ class InterscaleHub:
         '''
         self.__logger.info("Stop InterscaleHub and disconnect...")
         self.__pivot.stop()
+        self.__buffer.log_usage()
+        self.__buffer.close()
         # time.sleep(5)
-        if self.__direction == 1:
-                if self.__comm.Get_rank() == 0:
-                    self.__ic.close_and_finalize(self.__input_comm, self.__input_port)
-                else:
-                    self.__ic.close_and_finalize(self.__output_comm, self.__output_port)
-
-        elif self.__direction == 2:
-                if self.__comm.Get_rank() == 0:
-                    self.__ic.close_and_finalize(self.__output_comm, self.__output_port)
-                else:
-                    self.__ic.close_and_finalize(self.__input_comm, self.__input_port)
+        # only the receiver and the sender rank are connected
+        if self.__comm.Get_rank() == self.__receiver_rank:
+            self.__ic.close_and_finalize(self.__input_comm, self.__input_port)
+        elif self.__comm.Get_rank() == self.__sender_rank:
+            self.__ic.close_and_finalize(self.__output_comm, self.__output_port)
 
         
 
@@ -135,21 +138,21 @@ class InterscaleHub:
         '''
         Create shared memory buffer. MPI One-sided-Communication.
         MVP: datasize ist MPI.Double, buffersize is set with param init
+        
+        The buffer is a ring of 'nb_buffer_slots' slots of buffersize doubles.
+        The state of the slots is held in a separate integer control block,
+        see BufferManager. The data buffer only contains simulation data.
         '''
-        if self.__comm.Get_rank() == 0:
-            bufbytes = self.__datasize * self.__buffersize
-        else: 
-            bufbytes= 0
-        # rank 0: create the shared block
-        # rank 1-x: get a handle to it
+        # the receiver writes, all workers read, the sender clears the slots
+        reader_ranks = [self.__sender_rank] + [
+            rank for rank in range(self.__comm.Get_size())
+            if rank not in (self.__receiver_rank, self.__sender_rank)]
+        # rank 0: create the shared blocks
+        # rank 1-x: get a handle to them
         self.__logger.debug("allocating shared...")
-        win = MPI.Win.Allocate_shared(bufbytes, self.__datasize, comm=self.__comm)
-        self.__logger.debug("buf, and datasize...")
-        buf, self.__datasize = win.Shared_query(0)
-        # TODO: add error handling and fail checks
-        assert self.__datasize == MPI.DOUBLE.Get_size()
-        # create a 1D numpy array (buffer) whose data points to the shared mem
-        self.__databuffer = np.ndarray(buffer=buf, dtype='d', shape=(self.__buffersize,))
+        self.__buffer = BufferManager(self.__comm, self.__buffersize,
+                                      self.__receiver_rank, reader_ranks,
+                                      nb_slots=self.__nb_slots, root=self.__root)
         
     
     def _data_channel_setup(self, direction):
@@ -162,27 +165,17 @@ class InterscaleHub:
             - input = incoming simulation data
             - output = outgoing simulation data
         '''
-        # NEST-to-TVB
-        if self.__direction == 1:
-                if self.__comm.Get_rank() == 0:
-                    self.__input_comm, self.__input_port = self.__ic.open_port_accept_connection(self.__input_path)
-                    self.__output_comm = None
-                else:
-                    self.__output_comm, self.__output_port = self.__ic.open_port_accept_connection(self.__output_path)
-                    self.__input_comm = None
-
-        # TVB-to-NEST
-        elif self.__direction == 2:
-                if self.__comm.Get_rank() == 0:
-                    self.__output_comm, self.__output_port = self.__ic.open_port_accept_connection(self.__output_path)
-                    self.__input_comm = None
-                else:
-                    self.__input_comm, self.__input_port = self.__ic.open_port_accept_connection(self.__input_path)
-                    self.__output_comm = None
+        # only the receiver and the sender rank are connected,
+        # the other workers only take part in the transformation
+        self.__input_comm = None
+        self.__output_comm = None
+        if self.__comm.Get_rank() == self.__receiver_rank:
+            self.__input_comm, self.__input_port = self.__ic.open_port_accept_connection(self.__input_path)
+        elif self.__comm.Get_rank() == self.__sender_rank:
+            self.__output_comm, self.__output_port = self.__ic.open_port_accept_connection(self.__output_path)
     
     def get_ids_of_nodes_to_be_connected(self, path, direction):
         
-        id_transformer = 0
         if self.__direction  == 1:    
             # get information from NEST
             while not os.path.exists(path + 'nest/spike_detector.txt.unlock'):
@@ -196,8 +189,9 @@ class InterscaleHub:
             except:
                 pass
 
-            id_spike_detector = spike_detector[id_transformer]
-            path_to_spike_detector = [path + "transformation/spike_detector/" + str(id_spike_detector) + ".txt"]
+            # the spike detectors of all the regions are connected to the same port
+            path_to_spike_detector = [path + "transformation/spike_detector/" + str(id_spike_detector) + ".txt"
+                                      for id_spike_detector in spike_detector]
             # TVB_recev_file = "/transformation/send_to_tvb/" + str(id_proxy[id_transformer]) + ".txt"
             # id_spike_detector = os.path.splitext(os.path.basename(path + file_spike_detector))[0]
             return path_to_spike_detector
@@ -217,15 +211,17 @@ class InterscaleHub:
                 pass
 
             self.__logger.info("spike_generator : " + str(spike_generator))
-            print(spike_generator[id_transformer])
-            id_first_spike_generator = spike_generator[id_transformer][0]
-            nb_spike_generator = len(spike_generator[id_transformer])
+            # the spike generators of all the regions, one row per region, are connected to the same port
+            # number of spike generators of each region, for the rate of the region
+            self.__param['nb_spike_generator_region'] = [len(row) for row in spike_generator]
             path_to_spike_generators = []
-            for i in range(nb_spike_generator):
-                # write file with port and unlock
-                running_path = os.path.join(path + "transformation/spike_generator/",
-                                                str(id_first_spike_generator + i) + ".txt")
-                path_to_spike_generators.append(running_path)
+            for row in spike_generator:
+                id_first_spike_generator = row[0]
+                for i in range(len(row)):
+                    # write file with port and unlock
+                    running_path = os.path.join(path + "transformation/spike_generator/",
+                                                    str(id_first_spike_generator + i) + ".txt")
+                    path_to_spike_generators.append(running_path)
             # create path for receive from TVB
             return path_to_spike_generators
     
@@ -249,11 +245,21 @@ class InterscaleHub:
         self.__comm = MPI.COMM_WORLD  # INTRA communicator
         self.__root = 0 # hardcoded!
         self.__ic = icm.IntercommManager(self.__comm, self.__root)
-        
-        # Buffer
-        # TODO: needs to be a global cosim setting. more information needed!
-        max_events = 1000000 # max. expected number of events per step
-        self.__datasize = MPI.DOUBLE.Get_size()
+        if self.__comm.Get_size() < 2:
+            raise Exception('the InterscaleHub needs at least 2 ranks, got ' + str(self.__comm.Get_size()))
+        # NEST-to-TVB: rank 0 receives, rank 1 sends
+        # TVB-to-NEST: rank 1 receives, rank 0 sends
+        # all ranks except the receiver transform (workers), the sender is the root of the workers
+        if direction == 1:
+            self.__receiver_rank, self.__sender_rank = 0, 1
+        else:
+            self.__receiver_rank, self.__sender_rank = 1, 0
+        if self.__comm.Get_rank() == self.__receiver_rank:
+            self.__worker_comm = self.__comm.Split(MPI.UNDEFINED, self.__comm.Get_rank())
+        else:
+            # the sender has the lowest key, i.e. it is rank 0 of the workers
+            key = 0 if self.__comm.Get_rank() == self.__sender_rank else self.__comm.Get_rank()
+            self.__worker_comm = self.__comm.Split(0, key)
         
         # USECASE parameter
         # TODO: self.__param used as global dict for now and passed all the way to pivot._analyse()
@@ -261,11 +267,22 @@ class InterscaleHub:
         self.__direction = direction
         self.__param = p.get_param(direction)
         path = self.__param['path']
+        # number of simulation steps which can be buffered between receiver and sender
+        self.__nb_slots = self.__param['nb_buffer_slots']
+        # NOTE: the buffer size is an estimate, the BufferManager grows the
+        # slots if a simulation step does not fit.
         id_transformer = 0
         id_proxy = self.__param['id_nest_region']
+        # one connection by direction for all the regions: the rates of all the regions
+        # are exchanged with TVB in one message, the first proxy gives the name of the port file
+        nb_regions = len(id_proxy)
         # nest to tvb
         if self.__direction == 1:
-            self.__buffersize = max_events * 3 # 3 doubles per event
+            if len(self.__param['id_first_neurons']) != nb_regions or len(self.__param['nb_neurons']) != nb_regions:
+                raise Exception('the number of regions of the neurons is not the number of regions '
+                                + str(nb_regions))
+            # compact layout: neuron id and time step (2 int32) in 1 double per event
+            self.__buffersize = self._max_events()
             # NOTE input and output are connected to the same port
             # self.__input_path = p.get_nest_to_tvb_port()
             # self.__output_path = p.get_nest_to_tvb_port()
@@ -283,9 +300,10 @@ class InterscaleHub:
 
         # tvb to nest
         elif self.__direction == 2:
-            self.__buffersize = 2 + max_events # 2 doubles: [start_time,end_time] of simulation step
+            # header of the message of TVB (step, times, status, size), then one rate per time step and region
+            nb_rates = int(np.ceil(self.__param['time_synchronization'] / self.__param['resolution'])) * nb_regions
+            self.__buffersize = Header.SIZE + int(np.ceil(nb_rates * self.__param['buffer_safety_factor']))
             # self.__buffersize = (2, 2)
-            # self.percentage_shared = self.__param['percentage_shared']  # percentage of shared rate between neurons
             # self.nb_spike_generator = self.__param['nb_spike_generator']         # number of spike generator
             self.nb_synapse = self.__param['nb_brain_synapses']               # number of synapses by neurons
             # self.function_translat
@@ -294,6 +312,11 @@ class InterscaleHub:
                 path + "transformation/receive_from_tvb/" + str(id_proxy[id_transformer]) + ".txt"]  # NOTE id_transformer is 0
             # path to spike_gernerators
             self.__output_path = self.get_ids_of_nodes_to_be_connected(path, direction)
+            # one spike train per spike generator, partitioned between the workers
+            self.__param['nb_spike_generator'] = len(self.__output_path)
+            if len(self.__param['nb_spike_generator_region']) != nb_regions:
+                raise Exception('the number of regions of the spike generators is not the number of regions '
+                                + str(nb_regions))
 
      
         # NOTE: create port files and make connection
@@ -333,6 +356,21 @@ class InterscaleHub:
     
     
     
+    def _max_events(self):
+        '''
+        Expected maximum number of spike events of one synchronization step:
+        number of neurons * expected firing rate * time of synchronization,
+        multiplied by a safety factor for the fluctuations of the activity.
+        
+        :return: number of events which fit in one buffer slot
+        '''
+        nb_neurons = np.sum(self.__param['nb_neurons'])
+        rate = self.__param['expected_firing_rate'] * 1e-3 # spikes per ms
+        expected = nb_neurons * rate * self.__param['time_synchronization']
+        max_events = int(np.ceil(expected * self.__param['buffer_safety_factor']))
+        return max(max_events, self.__param['buffer_min_events'])
+    
+    
     def _temp_protocol_translation():
         '''
         TODO: temporary translation of protocol behaviour
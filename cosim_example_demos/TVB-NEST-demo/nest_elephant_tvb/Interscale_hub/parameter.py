@@ -20,7 +20,6 @@ class Parameter:
     Hardcoded, without any error and safety handling.
     NOTE: 
     List of hardcoded parameter in the InterscaleHub (to be completed)
-    - max_events set in InterscaleHub.py
     - min_delay set in Simulation_mock.py
     - simulation params (ids, size) set in Simulation_mock.py
     - tvb to nest params (size_list, list_id) set in pivot.py
@@ -47,6 +46,22 @@ class Parameter:
                 "save_spikes": True,
                 "save_rate": True,
                 "width": 20.0,
+                # root seed of the random streams of the spike generators
+                "seed": 125,
+                # shared input of the spike generators (multiple interaction process), 0.0 for independent
+                # spike trains: percentage of shared rate and probability to keep a spike of the mother train
+                "percentage_shared": 0.0,
+                "copy_probability": 0.5,
+                # data sent to NEST: 'spikes' for the spike generators, 'rates' for the
+                # inhomogeneous Poisson generators, the same as in the configuration of NEST
+                "transport_to_nest": 'spikes',
+                # number of slots of the InterscaleHub buffer, i.e. simulation steps
+                # which can be received ahead of the transformation
+                "nb_buffer_slots": 2,
+                # estimate of the size of a buffer slot, the slots grow if a step does not fit
+                "expected_firing_rate": 50.0,  # in Hz, upper estimate for the recorded neurons
+                "buffer_safety_factor": 4.0,
+                "buffer_min_events": 1000,
                 "id_first_spike_detector": 229
         }
         # path to files containing the MPI port info
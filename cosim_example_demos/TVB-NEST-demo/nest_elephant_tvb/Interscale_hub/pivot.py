@@ -13,13 +13,13 @@
 # ------------------------------------------------------------------------------ 
 # 
 from mpi4py import MPI
-import time
 import numpy as np
 import logging
 import sys
 
+from Interscale_hub.protocol import Header, MessageStatus, MessageSender
 #nest to tvb
-from Interscale_hub.transformer import store_data, analyse_data, spiketorate
+from Interscale_hub.transformer import spiketorate, neuron_regions
 #tvb to nest
 from Interscale_hub.transformer import generate_data
 
@@ -36,8 +36,11 @@ from Interscale_hub.transformer import generate_data
 # TODO: rework on the receive and send loops (both, general coding style and usecase specifics)
 
 class NestTvbPivot:
-    def __init__(self, intracomm, param, comm_receiver, comm_sender, databuffer):
+    def __init__(self, intracomm, param, comm_receiver, comm_sender, buffer, worker_comm):
         '''
+        :param buffer: BufferManager, shared data buffer and its handoff between ranks
+        :param worker_comm: INTRA communicator of the ranks which transform the data,
+            its rank 0 is the sender, MPI.COMM_NULL on the receiver rank
         '''
         
         # TODO: logger placeholder for testing
@@ -50,16 +53,28 @@ class NestTvbPivot:
         
         # Parameter for transformation and analysis
         self.__param = param
+        self.__worker_comm = worker_comm
         # INTERcommunicator
         if intracomm.Get_rank() == 0:
             self.__comm_receiver = comm_receiver
             self.__num_sending = self.__comm_receiver.Get_remote_size()
-        else:
+        elif self.__worker_comm.Get_rank() == 0:
             self.__comm_sender = comm_sender
             self.__num_receiving = self.__comm_sender.Get_remote_size()
 
         # How many Nest ranks are sending, how many Tvb ranks are receiving
-        self.__databuffer = databuffer
+        self.__buffer = buffer
+        if self.__worker_comm != MPI.COMM_NULL:
+            # each worker transforms the spikes of a part of each region: the ids
+            # [id_first_neurons[r], id_first_neurons[r] + nb_neurons[r]) of the region r
+            # are split in contiguous ranges between the workers
+            self.__first_neurons = np.asarray(param['id_first_neurons'], dtype=np.int64)
+            self.__nb_neurons = np.asarray(param['nb_neurons'], dtype=np.int64)
+            # transformation created once, it keeps the sliding window between the steps
+            self.__spikerate = spiketorate(param, self.__logger)
+            # partial rates of this worker (time step x region), before the reduction on the sender
+            nb_rates = int(np.rint(param['time_synchronization'] / param['resolution']))
+            self.__rates = np.empty(nb_rates * len(param['id_nest_region']), dtype='d')
     
     
     def start(self, intracomm):
@@ -67,12 +82,14 @@ class NestTvbPivot:
         Start the pivot operation.
         M:N mapping of MPI ranks, receive data, further process data.
         
-        MVP: receive on rank 0, do the rest on rank 1.
+        Receive on rank 0, transform on rank 1-x, send on rank 1.
         '''
         if intracomm.Get_rank() == 0: # Receiver from input sim, rank 0
             self._receive()
-        else: #  Science/analyse and sender to TVB, rank 1-x
+        elif self.__worker_comm.Get_rank() == 0: # Science/analyse and sender to TVB, rank 1
             self._send()
+        else: # Science/analyse, rank 2-x
+            self._work()
 
 
     def stop(self):
@@ -82,62 +99,95 @@ class NestTvbPivot:
         self.__stop = True
 
 
+    def _compact_events(self, raw, slot):
+        '''
+        Write the events of NEST in the compact layout of the buffer: one double per
+        event, which holds the neuron ids (int32) followed by the times in number of
+        time steps of NEST (int32). The id of the device is not kept, the spikes of
+        all the devices are transformed together.
+        :param raw: [id_device, id_neuron, time] of each event, flat
+        :param slot: buffer slot, one double per event
+        '''
+        nb_events = slot.shape[0]
+        compact = slot.view(np.int32)
+        compact[:nb_events] = raw[1::3]
+        np.rint(raw[2::3] / self.__param['resolution'], out=raw[2::3])
+        compact[nb_events:] = raw[2::3]
+
+
+    def _events(self, slot, head_):
+        '''
+        Events of a buffer slot in the compact layout.
+        :param slot: buffer slot which contains the data of the step
+        :param head_: first slot index WITHOUT data, i.e. the number of events
+        :return ids, ticks: neuron ids and spike times in time steps of NEST (views of the slot)
+        '''
+        compact = slot[:head_].view(np.int32)
+        return compact[:head_], compact[head_:]
+
+
     def _receive(self):
         '''
         Receive data on rank 0. Put it into the shared mem buffer.
         Replaces the former 'receive' function.
         NOTE: First refactored version -> not pretty, not final. 
         '''
-        # The last two buffer entries are used for shared information
-        # --> they replace the status_data variable from previous version
-        # --> find more elegant solution?
-        self.__logger.info("setting up buffers")
-        self.__databuffer[-1] = 1 # set buffer to 'ready to receive from nest'
-        self.__databuffer[-2] = 0 # marks the 'head' of the buffer
+        # The state and the head of the buffer slots are held in the control block
+        # of the BufferManager, the handoff to the sender rank is event-driven.
         # It seems the 'check' variable is used to receive tags from NEST, i.e. ready for send...
         # change this in the future, also mentioned in the FatEndPoint solution from Wouter.
-        check = np.empty(1,dtype='b')
-        shape = np.empty(1, dtype='i')    
+        checks = np.empty(self.__num_sending, dtype='b')
+        ready = np.array(True, dtype='b')
+        shapes = np.empty(self.__num_sending, dtype='i') # package size of each nest rank
         count = 0
-        status_ = MPI.Status()
+        statuses = [MPI.Status() for _ in range(self.__num_sending)]
+        # the events of NEST are received in this array, then compacted in the buffer
+        raw = np.empty(3 * self.__buffer.slot_size, dtype='d')
+        # the partners and shapes of these messages are the same every step:
+        # persistent requests, set up once and restarted each step
+        check_requests = [self.__comm_receiver.Recv_init([checks[source:source + 1], MPI.CXX_BOOL],
+                                                         source=source, tag=MPI.ANY_TAG)
+                          for source in range(self.__num_sending)]
+        shape_requests = []
+        for source in range(self.__num_sending):
+            shape_requests.append(self.__comm_receiver.Send_init([ready, MPI.BOOL], dest=source, tag=0))
+            shape_requests.append(self.__comm_receiver.Recv_init([shapes[source:source + 1], MPI.INT], source=source, tag=0))
         self.__logger.info("reading from buffer")
         # self.__logger.info("NESTtoTVB -- consumer/receiver -- Rank:"+str(self.__comm_receiver.Get_rank()))
         while True:
-            head_ = 0 # head of the buffer, reset after each iteration            
-            # TODO: This is still not correct. We only check for the Tag of the last rank.
-            # IF all ranks send always the same tag in one iteration (simulation step)
-            # then this works. But it should be handled differently!!!!
-            self.__comm_receiver.Recv([check, 1, MPI.CXX_BOOL], source=0, tag=MPI.ANY_TAG, status=status_)
-            
-            status_rank_0 = status_.Get_tag()
-            for i in range(1, self.__num_sending):
-                # new: We do not care which source sends first, give MPI the freedom to send in whichever order.
-                # self.__comm_receiver.Recv([check, 1, MPI.CXX_BOOL], source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status_)
-                # self.__logger.info("checking status")
-                self.__comm_receiver.Recv([check, 1, MPI.CXX_BOOL], source=i, tag=MPI.ANY_TAG, status=status_)
-                if status_rank_0 != status_.Get_tag():
+            # We do not care which source sends first, give MPI the freedom to send in whichever order.
+            MPI.Prequest.Startall(check_requests)
+            MPI.Request.Waitall(check_requests, statuses)
+            status_ = statuses[0]
+            for status_rank in statuses[1:]:
+                if status_.Get_tag() != status_rank.Get_tag():
                     raise Exception('Abnormal state : the state of Nest is different between rank')
 
             if status_.Get_tag() == 0:
-                # wait until ready to receive new data (i.e. the sender has cleared the buffer)
-                while self.__databuffer[-1] != 1: # TODO: use MPI, remove the sleep
-                    time.sleep(0.001)
-                    pass
+                # wait until ready to receive new data (i.e. the sender has cleared a slot)
+                self.__buffer.wait_for_writing()
+                # send 'ready' to all nest ranks and receive the package sizes at once,
+                # MPI completes them in whichever order the nest ranks answer
+                MPI.Prequest.Startall(shape_requests)
+                MPI.Request.Waitall(shape_requests)
+                # offset of the package of each nest rank in the staging array
+                offsets = np.concatenate(([0], np.cumsum(shapes)))
+                if offsets[-1] > raw.shape[0]:
+                    raw = np.empty(max(offsets[-1], 2 * raw.shape[0]), dtype='d')
+                # receive the [id_device, id_neuron, time] triplets of all nest ranks concurrently
+                requests = []
                 for source in range(self.__num_sending):
-                    # send 'ready' to the nest rank
-                    # self.__logger.info("send ready")
-                    self.__comm_receiver.Send([np.array(True,dtype='b'),MPI.BOOL],dest=source,tag=0)
-                    # receive package size info
-                    # self.__logger.info("DEBUG 121 ====> receiving size in NEST_TVB_PIVOT")
-                    self.__comm_receiver.Recv([shape, 1, MPI.INT], source=source, tag=0, status=status_)
-                    # self.__comm_receiver.Recv([shape, 1, MPI.INT], source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status_)
-                    # NEW: receive directly into the buffer
-                    self.__comm_receiver.Recv([self.__databuffer[head_:], MPI.DOUBLE], source=source, tag=0, status=status_)
-                    head_ += shape[0] # move head 
-                # Mark as 'ready to do analysis'
-                self.__databuffer[-1] = 0
+                    requests.append(self.__comm_receiver.Irecv(
+                        [raw[offsets[source]:offsets[source + 1]], MPI.DOUBLE], source=source, tag=0))
+                MPI.Request.Waitall(requests)
+                # compact layout in the buffer: one double per event
+                head_ = int(offsets[-1]) // 3
+                # grow the slot if the step has more spikes than expected
+                slot = self.__buffer.reserve(head_, 0)
+                self._compact_events(raw[:offsets[-1]], slot[:head_])
+                # Mark as 'ready to do analysis' and wake up the sender
                 # important: head_ is first buffer index WITHOUT data.
-                self.__databuffer[-2] = head_
+                self.__buffer.end_writing(head_)
             elif status_.Get_tag() == 1:
                 count += 1
             elif status_.Get_tag() == 2:
@@ -145,6 +195,8 @@ class NestTvbPivot:
                 break
             else:
                 raise Exception("bad mpi tag"+str(status_.Get_tag()))
+        for request in check_requests + shape_requests:
+            request.Free()
     
     
     def _send(self):
@@ -154,78 +206,104 @@ class NestTvbPivot:
         NOTE: First refactored version -> not pretty, not final. 
         '''
         count=0 # simulation/iteration step
-        status_ = MPI.Status()
+        # one rate per time step of the synchronization and region, all the regions in one message
+        nb_rates = int(np.rint(self.__param['time_synchronization'] / self.__param['resolution'])) \
+                   * len(self.__param['id_nest_region'])
+        # persistent requests and message buffer, set up once
+        sender = MessageSender(self.__comm_sender, nb_rates)
         # self.__logger.info("NESTtoTVB -- producer/sender -- Rank:"+str(self.__comm_sender.Get_rank()))
         while True:
             # TODO: this communication has the 'rank 0' problem described in the beginning
-            accept = False
             #logger.info("Nest to TVB : wait to send " )
-            while not accept:
-                req = self.__comm_sender.irecv(source=MPI.ANY_SOURCE,tag=MPI.ANY_TAG)
-                accept = req.wait(status_)
-            #logger.info(" Nest to TVB : send data status : " +str(status_.Get_tag()))
-            if status_.Get_tag() == 0:
-                # wait until the receiver has cleared the buffer, i.e. filled with new data
-                while self.__databuffer[-1] != 0: # TODO: use MPI, remove the sleep
-                    time.sleep(0.001)
-                    pass
+            status = sender.wait_request()
+            #logger.info(" Nest to TVB : send data status : " +str(status))
+            if status == MessageStatus.DATA:
+                # start the transformation of the step on the other workers
+                self.__worker_comm.bcast(True, root=0)
+                # wait until the receiver has filled a slot with new data
+                slot, head_ = self.__buffer.wait_for_reading()
                 # TODO: All science/analysis here. Move to a proper place.
-                times,data = self._transform(count)
+                # the rates are written in the payload of the message
+                times,data = self._transform(count, slot, head_, sender.payload(nb_rates))
                 # Mark as 'ready to receive next simulation step'
-                self.__databuffer[-1] = 1
+                self.__buffer.end_reading()
                 
-                ### OLD Code
                 #logger.info("Nest to TVB : send data :"+str(np.sum(data)) )
-                # time of sim step
-                self.__comm_sender.Send([times, MPI.DOUBLE], dest=status_.Get_source(), tag=0)
-                # send the size of the rate
-                size = np.array(int(data.shape[0]),dtype='i')
-                self.__comm_sender.Send([size,MPI.INT], dest=status_.Get_source(), tag=0)
-                # send the rates
-                self.__comm_sender.Send([data,MPI.DOUBLE], dest=status_.Get_source(), tag=0)
-                ### OLD Code end
-            elif status_.Get_tag() == 1:
+                # one message: header (step, times, status, size) and the rates
+                sender.send(count, times, data)
+            elif status == MessageStatus.END:
                 # NOTE: simulation ended
+                self.__worker_comm.bcast(False, root=0)
                 break
             else:
-                raise Exception("bad mpi tag"+str(status_.Get_tag()))
+                raise Exception("bad mpi tag"+str(status))
+            count+=1
+        sender.free()
+
+
+    def _work(self):
+        '''
+        Transform the spikes of the neurons of this worker, rank 2-x.
+        The partial rates are reduced on the sender, which sends them to TVB.
+        '''
+        count=0 # simulation/iteration step
+        # the sender starts each step, False at the end of the simulation
+        while self.__worker_comm.bcast(None, root=0):
+            slot, head_ = self.__buffer.wait_for_reading()
+            self._transform(count, slot, head_)
+            self.__buffer.end_reading()
             count+=1
 
     
-    def _transform(self, count):
+    def _transform(self, count, slot, head_, out=None):
         '''
         This step contains some pivoting, transformation and analysis.
         TODO: encapsulate
+        Each worker transforms the spikes of its neurons, the rates are
+        normalised by the total number of neurons, so the sum of the partial
+        rates of all workers is the rate of the population.
         :param count: Simulation iteration/step
-        :return times, data: simulation times and the calculated rates
+        :param slot: buffer slot which contains the data of the step
+        :param head_: first slot index WITHOUT data
+        :param out: array for the rates on the sender, e.g. the payload of the message
+        :return times, data: simulation times and the calculated rates (on the sender)
         '''
-        #store: Python object, create the histogram 
-        #analyse: Python object, calculate rates
-        spikerate = spiketorate(self.__param)
-        times, data = spikerate.spike_to_rate(count, self.__databuffer[-2], self.__databuffer)
+        ids, ticks = self._events(slot, head_)
+        nb_workers = self.__worker_comm.Get_size()
+        if nb_workers == 1:
+            # store: create the histogram, analyse: calculate rates
+            return self.__spikerate.spike_to_rate(count, ticks, ids, out)
+        # spikes of the neurons of this worker
+        mine = self._workers(ids) == self.__worker_comm.Get_rank()
+        times, data = self.__spikerate.spike_to_rate(count, ticks[mine], ids[mine], self.__rates)
+        if self.__worker_comm.Get_rank() == 0:
+            if out is None:
+                out = np.empty_like(data)
+            self.__worker_comm.Reduce([data, MPI.DOUBLE], [out, MPI.DOUBLE], op=MPI.SUM, root=0)
+            data = out
+        else:
+            self.__worker_comm.Reduce([data, MPI.DOUBLE], None, op=MPI.SUM, root=0)
+        return times, data
 
+    def _workers(self, ids):
         '''
-        store = store_data(self.__param)
-        analyse = analyse_data(self.__param)
-        
-        # TODO: Step 1 and 2 can be merged into one step. Buffer is no longer filled rank by rank.
-        # Make this parallel with the INTRA communicator (should be embarrassingly parallel).
-        # Step 1) take all data from buffer and create histogram
-        # second to last index in databuffer denotes how much data there is
-        self.__logger.info("NESTtoTVBPivot -- transform -- buffer head:"+str(self.__databuffer[-2]))
-        store.add_spikes(count, self.__databuffer[:int(self.__databuffer[-2])])
-        # Step 2) take the resulting histogram
-        data_to_analyse = store.return_data()
-        # Step 3) Analyse this data, i.e. calculate rates?
-        times,data = analyse.analyse(count, data_to_analyse)
+        Worker which transforms the spike of each neuron id.
+        :param ids: neuron id of each spike
+        :return: rank of the worker of each spike, -1 for the ids outside of the regions
         '''
-        return times, data
+        region, offset = neuron_regions(ids, self.__first_neurons, self.__nb_neurons)
+        workers = offset * self.__worker_comm.Get_size() // self.__nb_neurons[region]
+        workers[region < 0] = -1
+        return workers
     
 
 
 class TvbNestPivot: 
-    def __init__(self, intracomm, param, comm_receiver, comm_sender, databuffer):
+    def __init__(self, intracomm, param, comm_receiver, comm_sender, buffer, worker_comm):
         '''
+        :param buffer: BufferManager, shared data buffer and its handoff between ranks
+        :param worker_comm: INTRA communicator of the ranks which transform the data,
+            its rank 0 is the sender, MPI.COMM_NULL on the receiver rank
         '''
         
         # TODO: logger placeholder for testing
@@ -239,15 +317,41 @@ class TvbNestPivot:
         
         # Parameter for transformation and analysis
         self.__param = param
+        self.__worker_comm = worker_comm
         # INTERcommunicator
         if intracomm.Get_rank() == 1:
             self.__comm_receiver = comm_receiver
             self.__num_sending = self.__comm_receiver.Get_remote_size()
-        else:    
+        elif self.__worker_comm.Get_rank() == 0:
             self.__comm_sender = comm_sender
             self.__num_receiving = self.__comm_sender.Get_remote_size()
         # How many TVB ranks are sending, how many NEST ranks are receiving
-        self.__databuffer = databuffer
+        self.__buffer = buffer
+        if self.__worker_comm != MPI.COMM_NULL:
+            # each worker generates the spike trains of a contiguous range of spike generators
+            nb_workers = self.__worker_comm.Get_size()
+            nb_generators = param['nb_spike_generator']
+            bounds = np.array([i * nb_generators // nb_workers for i in range(nb_workers + 1)], dtype='i')
+            self.__generators = (bounds[self.__worker_comm.Get_rank()], bounds[self.__worker_comm.Get_rank() + 1])
+            # number of spike generators and first spike generator of each worker, for the gather
+            self.__nb_generators_worker = np.diff(bounds)
+            self.__first_generator_worker = bounds[:-1]
+            # transformation created once, for the spike generators of this worker
+            first, last = self.__generators
+            self.__generator = generate_data(dict(param,
+                                                  nb_spike_generator=int(last - first),
+                                                  id_first_spike_generator=int(first)))
+            # spike trains for the spike generators, or rates for the inhomogeneous Poisson
+            # generators which generate the spikes in NEST
+            # the spike times are in time steps of NEST, converted in ms when they are sent
+            if param['transport_to_nest'] == 'spikes':
+                self.__generate = self.__generator.generate_spike
+                self.__to_nest = param['resolution']
+            elif param['transport_to_nest'] == 'rates':
+                self.__generate = self.__generator.generate_rate
+                self.__to_nest = 1.0
+            else:
+                raise Exception('bad transport to NEST : ' + str(param['transport_to_nest']))
 
 
     def start(self, intracomm):
@@ -255,12 +359,14 @@ class TvbNestPivot:
         Start the pivot operation.
         M:N mapping of MPI ranks, receive data, further process data.
         
-        MVP: receive on rank 0, do the rest on rank 1.
+        Receive on rank 1, transform on rank 0 and 2-x, send on rank 0.
         '''
-        if intracomm.Get_rank() == 0: # Receiver from input sim, rank 0
-            self._send()
-        else: #  Science/analyse and sender to TVB, rank 1-x
+        if intracomm.Get_rank() == 1: # Receiver from input sim, rank 1
             self._receive()
+        elif self.__worker_comm.Get_rank() == 0: # Science/generate and sender to NEST, rank 0
+            self._send()
+        else: # Science/generate, rank 2-x
+            self._work()
 
 
     def stop(self):
@@ -276,44 +382,53 @@ class TvbNestPivot:
         Replaces the former 'receive' function.
         NOTE: First refactored version -> not pretty, not final. 
         '''
-        # The last two buffer entries are used for shared information
-        # --> they replace the status_data variable from previous version
-        # --> find more elegant solution?
-        self.__databuffer[-1] = 1 # set buffer to 'ready to receive from tvb'
-        self.__databuffer[-2] = 0 # marks the 'head' of the buffer
-        # init placeholder for incoming data
-        size = np.empty(1, dtype='i') # size of the rate-array
+        # The state and the head of the buffer are held in the control block
+        # of the BufferManager, the handoff to the sender rank is event-driven.
+        # The slot holds the whole message of TVB: header (step, times, status, size) and rates.
+        header = np.empty(Header.SIZE, dtype='d') # placeholder for the end and oversize messages
         status_ = MPI.Status()
+        # request for the next message, it contains the capacity of the slots,
+        # persistent requests set up once and restarted each step
+        capacity = np.empty(1, dtype='i')
+        requests = [self.__comm_receiver.Send_init([capacity, MPI.INT], dest=rank, tag=MessageStatus.DATA)
+                    for rank in range(self.__num_sending)]
         # self.__logger.info("TVBtoNEST -- consumer/receiver -- Rank:"+str(self.__comm_receiver.Get_rank()))
         while True:
             # NOTE: Check communication protocol between simulators and transformers!
-            requests=[]
-            for rank in range(self.__num_sending):
-                requests.append(self.__comm_receiver.isend(True,dest=rank,tag=0))
+            capacity[0] = self.__buffer.slot_size
+            MPI.Prequest.Startall(requests)
             MPI.Request.Waitall(requests)
             # NOTE: works for now, needs rework if multiple ranks are used on TVB side
             # we receive from "ANY_SOURCE", but only check the status_ of the last receive...
-            # get the starting and ending time of the simulation step
-            # NEW: receive directly into the buffer
-            self.__comm_receiver.Recv([self.__databuffer[0:], MPI.DOUBLE], source=0, tag=MPI.ANY_TAG, status=status_)
-            if status_.Get_tag() == 0:
-                # wait until ready to receive new data (i.e. the sender has cleared the buffer)
-                while self.__databuffer[-1] != 1: # TODO: use MPI, remove the sleep
-                    time.sleep(0.001)
-                    pass
-                # Get the size of the data
-                self.__comm_receiver.Recv([size, 1, MPI.INT], source=status_.Get_source(), tag=0, status=status_)
+            # the size of the message is given by the MPI status, no size message
+            self.__comm_receiver.Probe(source=0, tag=MPI.ANY_TAG, status=status_)
+            if status_.Get_tag() == MessageStatus.DATA:
+                size = status_.Get_count(MPI.DOUBLE)
+                # wait until ready to receive new data (i.e. the sender has cleared a slot)
+                self.__buffer.wait_for_writing()
+                # grow the slot if the message does not fit
+                slot = self.__buffer.reserve(size, 0)
                 # NEW: receive directly into the buffer
-                # First two entries are the times, see above
-                self.__comm_receiver.Recv([self.__databuffer[2:], MPI.DOUBLE], source=status_.Get_source(), tag=0, status=status_)
-                # Mark as 'ready to do analysis'
-                self.__databuffer[-1] = 0
-                self.__databuffer[-2] = size # info about size of data array
-            elif status_.Get_tag() == 1:
+                self.__comm_receiver.Recv([slot[:size], MPI.DOUBLE], source=status_.Get_source(), tag=MessageStatus.DATA)
+                # Mark as 'ready to do analysis' and wake up the sender
+                self.__buffer.end_writing(size)
+            elif status_.Get_tag() == MessageStatus.OVERSIZE:
+                # fallback: the header alone, then the rates
+                self.__comm_receiver.Recv([header, MPI.DOUBLE], source=status_.Get_source(), tag=MessageStatus.OVERSIZE)
+                size = Header.SIZE + int(header[Header.COUNT])
+                self.__buffer.wait_for_writing()
+                slot = self.__buffer.reserve(size, 0)
+                slot[:Header.SIZE] = header
+                self.__comm_receiver.Recv([slot[Header.SIZE:size], MPI.DOUBLE], source=status_.Get_source(), tag=MessageStatus.OVERSIZE)
+                self.__buffer.end_writing(size)
+            elif status_.Get_tag() == MessageStatus.END:
                 # NOTE: simulation ended
+                self.__comm_receiver.Recv([header, MPI.DOUBLE], source=status_.Get_source(), tag=MessageStatus.END)
                 break
             else:
                 raise Exception("bad mpi tag"+str(status_.Get_tag()))
+        for request in requests:
+            request.Free()
         
         # logger.info('TVB_to_NEST: End of receive function')
 
@@ -326,52 +441,57 @@ class TvbNestPivot:
         '''
         status_ = MPI.Status()
         # NOTE: hardcoded...
-        check = np.empty(1,dtype='b')
-        size_list = np.empty(1, dtype='i')
+        checks = np.empty(self.__num_receiving, dtype='b')
+        size_lists = np.empty(self.__num_receiving, dtype='i') # number of spike generators of each nest rank
+        statuses = [MPI.Status() for _ in range(self.__num_receiving)]
         id_first_spike_detector = self.__param['id_first_spike_detector']
+        # the partners and shapes of these messages are the same every step:
+        # persistent requests, set up once and restarted each step
+        check_requests = [self.__comm_sender.Recv_init([checks[rank:rank + 1], MPI.CXX_BOOL],
+                                                       source=rank, tag=MPI.ANY_TAG)
+                          for rank in range(self.__num_receiving)]
+        size_list_requests = [self.__comm_sender.Recv_init([size_lists[rank:rank + 1], MPI.INT],
+                                                           source=rank, tag=0)
+                              for rank in range(self.__num_receiving)]
         while True:
-            # TODO: This is still not correct. We only check for the Tag of the last rank.
-            # IF all ranks send always the same tag in one iteration (simulation step)
-            # then this works. But it should be handled differently!!!!
-            for rank in range(self.__num_receiving):
-                self.__comm_sender.Recv([check, 1, MPI.CXX_BOOL], source=rank, tag=MPI.ANY_TAG, status=status_)
+            MPI.Prequest.Startall(check_requests)
+            MPI.Request.Waitall(check_requests, statuses)
+            status_ = statuses[0]
+            for status_rank in statuses[1:]:
+                if status_.Get_tag() != status_rank.Get_tag():
+                    raise Exception('Abnormal state : the state of Nest is different between rank')
             if status_.Get_tag() == 0:
-                # wait until the receiver has cleared the buffer, i.e. filled with new data
-                while self.__databuffer[-1] != 0: # TODO: use MPI, remove the sleep
-                    time.sleep(0.001)
-                    pass
+                # start the transformation of the step on the other workers
+                self.__worker_comm.bcast(True, root=0)
+                # wait until the receiver has filled a slot with new data
+                slot, head_ = self.__buffer.wait_for_reading()
 
                 # TODO: All science/generate here. Move to a proper place.
-                spikes_times = self._transform()
+                # spike trains of the step in CSR layout: flat times and offsets per spike generator
+                spikes, offsets = self._transform(slot, head_)
                 # Mark as 'ready to receive next simulation step'
-                self.__databuffer[-1] = 1
+                self.__buffer.end_reading()
                 
                 ### OLD code, kept the communication and science as it is for now
                 # NOTE: Receive from status_.Get_source() and rank
                 # Send to status_.Get_source() and rank
                 # why?
                 # a second status_ object is used, should not be named the same
+                MPI.Prequest.Startall(size_list_requests)
                 for rank in range(self.__num_receiving):
                     # NOTE: hardcoded 10 in simulation mocks
-                    self.__comm_sender.Recv([size_list, 1, MPI.INT], source=rank, tag=0, status=status_)
+                    size_list_requests[rank].Wait(status_)
+                    size_list = size_lists[rank:rank + 1]
                     if size_list[0] != 0:
                         list_id = np.empty(size_list, dtype='i')
                         # NOTE: hardcoded np.arange(0,10,1) in simulation mocks
                         self.__comm_sender.Recv([list_id, size_list, MPI.INT], source=status_.Get_source(), tag=0, status=status_)
-                        # Select the good spike train and send it
-                        # TODO: create lists, append to lists, nested loops
-                        # this is slow and will be a bottleneck when we scale up.
-                        data = []
-                        shape = []
-                        for i in list_id:
-                            shape += [spikes_times[i-id_first_spike_detector].shape[0]]
-                            data += [spikes_times[i-id_first_spike_detector]]
-                        send_shape = np.array(np.concatenate(([np.sum(shape)],shape)), dtype='i')
+                        # Select the good spike trains and send them
+                        send_shape, data = self._select(spikes, offsets, list_id - id_first_spike_detector)
                         # firstly send the size of the spikes train
                         # self.__logger.info("sending size of train")
                         self.__comm_sender.Send([send_shape, MPI.INT], dest=status_.Get_source(), tag=list_id[0])
                         # secondly send the spikes train
-                        data = np.concatenate(data).astype('d')
                         # self.__logger.info("sending train")
                         self.__comm_sender.Send([data, MPI.DOUBLE], dest=rank, tag=list_id[0])
                 ### OLD code end
@@ -380,26 +500,97 @@ class TvbNestPivot:
                 continue
             elif status_.Get_tag() == 2:
                 # NOTE: simulation ended
+                self.__worker_comm.bcast(False, root=0)
                 break
             else:
                 raise Exception("bad mpi tag : "+str(status_.Get_tag()))
+        for request in check_requests + size_list_requests:
+            request.Free()
+
+
+    def _work(self):
+        '''
+        Generate the spike trains of the spike generators of this worker, rank 2-x.
+        The spike trains are gathered on the sender, which sends them to NEST.
+        '''
+        # the sender starts each step, False at the end of the simulation
+        while self.__worker_comm.bcast(None, root=0):
+            slot, head_ = self.__buffer.wait_for_reading()
+            self._transform(slot, head_)
+            self.__buffer.end_reading()
         
 
-    def _transform(self):
+    def _transform(self, slot, head_):
         '''
         This step contains some pivoting, transformation and analysis.
         TODO: encapsulate
+        Each worker generates the spike trains (or the rates) of its spike generators.
+        :param slot: buffer slot which contains the data of the step
+        :param head_: first slot index WITHOUT data
+        :return spikes, offsets: spike trains (or (time, rate) pairs) of all spike generators in CSR layout
+                                 (on the sender), the train of generator i is spikes[offsets[i]:offsets[i+1]]
         '''
-        generator = generate_data(self.__param)
         # NOTE: count is a hardcoded '0'. Why?
-        # time_step are the first two doubles in the buffer
-        # rate is a double array, which size is stored in the second to last index
-        if int(self.__databuffer[-2]) == 0:
-            spikes_times = generator.generate_spike(0,
-                                                self.__databuffer[:2],
-                                                self.__databuffer[2:])
-        else:
-            spikes_times = generator.generate_spike(0,
-                                                self.__databuffer[:2],
-                                                self.__databuffer[2:int(self.__databuffer[-2])])
-        return spikes_times
+        # the slot starts with the header of the message, which contains the times
+        # rate is a double array after the header, which ends at the head of the slot,
+        # block (time step x region) of the rates of all the regions
+        spikes, offsets = self.__generate(0,
+                                          slot[Header.TIME_START:Header.TIME_END + 1],
+                                          slot[Header.SIZE:head_])
+        if self.__worker_comm.Get_size() == 1:
+            return spikes, offsets
+        return self._gather(spikes, offsets)
+
+
+    def _gather(self, spikes, offsets):
+        '''
+        Gather the spike trains of all workers on the sender,
+        in the order of the spike generators.
+        :param spikes: spike trains of the spike generators of this worker, concatenated
+        :param offsets: offsets of the spike trains of this worker in spikes
+        :return spikes, offsets: spike trains of all spike generators in CSR layout (on the sender),
+                                 None, None otherwise
+        '''
+        root = self.__worker_comm.Get_rank() == 0
+        # 1) number of spikes of each spike generator
+        nb_spikes = np.ascontiguousarray(np.diff(offsets), dtype='i')
+        recvbuf = None
+        if root:
+            all_nb_spikes = np.empty(np.sum(self.__nb_generators_worker), dtype='i')
+            recvbuf = [all_nb_spikes, self.__nb_generators_worker, self.__first_generator_worker, MPI.INT]
+        self.__worker_comm.Gatherv([nb_spikes, MPI.INT], recvbuf, root=0)
+        # 2) the spike trains (time steps) or the rates, concatenated
+        datatype = MPI.INT64_T if spikes.dtype == np.int64 else MPI.DOUBLE
+        recvbuf = None
+        if root:
+            all_offsets = np.concatenate(([0], np.cumsum(all_nb_spikes)))
+            displacements = all_offsets[self.__first_generator_worker]
+            counts = all_offsets[self.__first_generator_worker + self.__nb_generators_worker] - displacements
+            all_spikes = np.empty(all_offsets[-1], dtype=spikes.dtype)
+            recvbuf = [all_spikes, counts, displacements, datatype]
+        self.__worker_comm.Gatherv([spikes, datatype], recvbuf, root=0)
+        if not root:
+            return None, None
+        return all_spikes, all_offsets
+
+
+    def _select(self, spikes, offsets, index):
+        '''
+        Select the spike trains of some spike generators, without loop over the generators.
+        :param spikes: spike trains of all spike generators, concatenated
+        :param offsets: offsets of the spike trains in spikes
+        :param index: index of the spike generators, in the order of the message
+        :return send_shape, data: [total number of spikes, number of spikes of each generator]
+                                  and the selected spike trains concatenated, in ms for NEST
+        '''
+        starts = offsets[index]
+        sizes = offsets[index + 1] - starts
+        ends = np.cumsum(sizes)
+        total = ends[-1] if len(ends) > 0 else 0
+        send_shape = np.empty(len(sizes) + 1, dtype='i')
+        send_shape[0] = total
+        send_shape[1:] = sizes
+        # position in spikes of each selected spike: shift of the train plus the rank in the message
+        positions = np.arange(total) + np.repeat(starts - (ends - sizes), sizes)
+        data = np.multiply(spikes[positions], self.__to_nest, dtype='d')
+        return send_shape, data
@@ -0,0 +1,252 @@
+# ------------------------------------------------------------------------------
+#  Copyright 2020 Forschungszentrum Jülich GmbH
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor
+#  license agreements; and to You under the Apache License, Version 2.0. "
+#
+# Forschungszentrum Jülich
+#  Institute: Institute for Advanced Simulation (IAS)
+#    Section: Jülich Supercomputing Centre (JSC)
+#   Division: High Performance Computing in Neuroscience
+# Laboratory: Simulation Laboratory Neuroscience
+#       Team: Multi-scale Simulation and Design
+#
+# ------------------------------------------------------------------------------
+from mpi4py import MPI
+from enum import IntEnum
+import numpy as np
+
+
+class Header(IntEnum):
+    '''
+    Layout of the header of the messages between TVB and the InterscaleHub.
+    One message per exchange: the header followed by the payload (doubles).
+    The receiver gets the size of the message from the MPI status.
+    '''
+    STEP = 0  # index of the simulation step
+    TIME_START = 1  # starting time of the step
+    TIME_END = 2  # ending time of the step
+    STATUS = 3  # MessageStatus, the same as the MPI tag of the message
+    COUNT = 4  # number of doubles of the payload
+    SIZE = 5  # number of doubles of the header, the payload follows
+
+
+class MessageStatus(IntEnum):
+    '''
+    Status of a message, also used as MPI tag.
+    '''
+    DATA = 0  # the payload contains the data of the step
+    END = 1  # end of the simulation, no payload
+    OVERSIZE = 2  # the payload does not fit, it follows in a second message
+
+
+def pack(step, times, data, status=MessageStatus.DATA):
+    '''
+    Build the message of one exchange.
+
+    :param step: index of the simulation step
+    :param times: starting and ending time of the step
+    :param data: payload, converted to doubles
+    :param status: MessageStatus of the message
+    :return: header and payload in one contiguous array of doubles
+    '''
+    data = np.ravel(data)
+    message = np.empty(Header.SIZE + data.shape[0], dtype='d')
+    message[Header.STEP] = step
+    message[Header.TIME_START:Header.TIME_END + 1] = times
+    message[Header.STATUS] = status
+    message[Header.COUNT] = data.shape[0]
+    message[Header.SIZE:] = data
+    return message
+
+
+class MessageSender:
+    '''
+    Sender side of the exchange of packed messages, with persistent requests.
+
+    The requests and the message buffer are set up once. Each step, the
+    receiver asks for the next message and announces the capacity of its
+    buffer (in doubles). A message which does not fit is sent with the
+    OVERSIZE fallback: the header alone, then the payload.
+    '''
+    def __init__(self, comm, capacity, source=MPI.ANY_SOURCE):
+        '''
+        :param comm: INTER communicator to the receiver
+        :param capacity: expected number of doubles of the payload
+        :param source: rank of the receiver which asks for the messages
+        '''
+        self.__comm = comm
+        self.__status = MPI.Status()
+        # capacity of the buffer of the receiver
+        self.__request = np.zeros(1, dtype='i')
+        self.__recv_request = comm.Recv_init([self.__request, MPI.INT], source=source, tag=MPI.ANY_TAG)
+        self.__message = np.empty(Header.SIZE + capacity, dtype='d')
+        # created at the first message, again if the destination or the size change
+        self.__send_request = None
+        self.__dest = None
+        self.__size = None
+        self.__is_request_posted = False  # the next request of the receiver is expected
+        self.__is_send_pending = False  # the last message is not completed
+
+    def post_request(self):
+        '''
+        Start to wait for the next request of the receiver, without blocking.
+        '''
+        if not self.__is_request_posted:
+            self.__recv_request.Start()
+            self.__is_request_posted = True
+
+    def wait_request(self):
+        '''
+        Block until the receiver asks for the next message.
+
+        :return: MessageStatus of the request, END if the receiver stops
+        '''
+        self.post_request()
+        self.__recv_request.Wait(self.__status)
+        self.__is_request_posted = False
+        return self.__status.Get_tag()
+
+    def wait(self):
+        '''
+        Complete the last message sent without blocking, before the reuse of the message buffer.
+        '''
+        if self.__is_send_pending:
+            self.__send_request.Wait()
+            self.__is_send_pending = False
+
+    def payload(self, count):
+        '''
+        Payload of the message buffer, to write the data in place before send.
+
+        :param count: number of doubles of the payload
+        :return: view of the message buffer, None if the payload does not fit
+        '''
+        self.wait()
+        if Header.SIZE + count > self.__message.shape[0]:
+            return None
+        return self.__message[Header.SIZE:Header.SIZE + count]
+
+    def send(self, step, times, data, blocking=True):
+        '''
+        Send the message of one step to the receiver which asked for it.
+
+        :param step: index of the simulation step
+        :param times: starting and ending time of the step
+        :param data: payload, it is not copied if it is the view given by payload
+        :param blocking: if False, the message is completed by wait or by the next message
+        '''
+        self.wait()
+        dest = self.__status.Get_source()
+        data = np.ravel(data)
+        size = Header.SIZE + data.shape[0]
+        if size > self.__message.shape[0] or size > self.__request[0]:
+            # fallback: the payload does not fit in the buffers
+            header = pack(step, times, [], status=MessageStatus.OVERSIZE)
+            header[Header.COUNT] = data.shape[0]
+            self.__comm.Send([header, MPI.DOUBLE], dest=dest, tag=MessageStatus.OVERSIZE)
+            self.__comm.Send([np.ascontiguousarray(data, dtype='d'), MPI.DOUBLE],
+                             dest=dest, tag=MessageStatus.OVERSIZE)
+            return
+        self.__message[Header.STEP] = step
+        self.__message[Header.TIME_START:Header.TIME_END + 1] = times
+        self.__message[Header.STATUS] = MessageStatus.DATA
+        self.__message[Header.COUNT] = data.shape[0]
+        if not np.shares_memory(data, self.__message):
+            self.__message[Header.SIZE:size] = data
+        if self.__send_request is None or dest != self.__dest or size != self.__size:
+            if self.__send_request is not None:
+                self.__send_request.Free()
+            self.__send_request = self.__comm.Send_init([self.__message[:size], MPI.DOUBLE],
+                                                        dest=dest, tag=MessageStatus.DATA)
+            self.__dest = dest
+            self.__size = size
+        self.__send_request.Start()
+        if blocking:
+            self.__send_request.Wait()
+        else:
+            self.__is_send_pending = True
+
+    def send_end(self):
+        '''
+        Send the end of the simulation to the receiver which asked for a message.
+        '''
+        self.wait()
+        header = pack(-1, [0., 0.], [], status=MessageStatus.END)
+        self.__comm.Send([header, MPI.DOUBLE], dest=self.__status.Get_source(), tag=MessageStatus.END)
+
+    def free(self):
+        '''
+        Free the persistent requests, before the disconnection.
+        '''
+        self.wait()
+        self.__recv_request.Free()
+        if self.__send_request is not None:
+            self.__send_request.Free()
+            self.__send_request = None
+
+
+class MessageReceiver:
+    '''
+    Receiver side of the exchange of packed messages, with persistent requests.
+
+    The requests and the receive buffer are set up once, each step asks for
+    the next message and receives it. The returned arrays are views of the
+    receive buffer, valid until the next call of receive.
+    '''
+    def __init__(self, comm, capacity, source=0):
+        '''
+        :param comm: INTER communicator to the sender
+        :param capacity: expected number of doubles of the payload
+        :param source: rank of the sender
+        '''
+        self.__comm = comm
+        self.__source = source
+        self.__status = MPI.Status()
+        self.__request = np.array([Header.SIZE + capacity], dtype='i')
+        self.__send_request = comm.Send_init([self.__request, MPI.INT], dest=source, tag=MessageStatus.DATA)
+        self.__message = np.empty(Header.SIZE + capacity, dtype='d')
+        self.__recv_request = comm.Recv_init([self.__message, MPI.DOUBLE], source=source, tag=MPI.ANY_TAG)
+        self.__is_posted = False  # the next message is asked
+
+    def post(self):
+        '''
+        Ask the sender for the next message, without waiting for it.
+        '''
+        if not self.__is_posted:
+            self.__recv_request.Start()
+            self.__send_request.Start()
+            self.__is_posted = True
+
+    def receive(self):
+        '''
+        Ask the sender for the next message, if it is not done by post, and receive it.
+
+        :return status, header, payload: MessageStatus, header and payload of the message
+        '''
+        self.post()
+        self.__send_request.Wait()
+        self.__recv_request.Wait(self.__status)
+        self.__is_posted = False
+        status = self.__status.Get_tag()
+        header = self.__message[:Header.SIZE]
+        if status == MessageStatus.OVERSIZE:
+            # fallback: the payload follows in a second message
+            payload = np.empty(int(header[Header.COUNT]), dtype='d')
+            self.__comm.Recv([payload, MPI.DOUBLE], source=self.__source, tag=MessageStatus.OVERSIZE)
+            status = MessageStatus.DATA
+        else:
+            payload = self.__message[Header.SIZE:self.__status.Get_count(MPI.DOUBLE)]
+        return status, header, payload
+
+    def end(self):
+        '''
+        Tell the sender that no more message is expected.
+        '''
+        self.__comm.Send([self.__request, MPI.INT], dest=self.__source, tag=MessageStatus.END)
+
+    def free(self):
+        '''
+        Free the persistent requests, before the disconnection.
+        '''
+        self.__send_request.Free()
+        self.__recv_request.Free()
@@ -17,90 +17,268 @@
 # implement properly as elephant science part
 # use both methods as Elephant plugin example!
 
-from elephant.spike_train_generation import homogeneous_poisson_process, inhomogeneous_poisson_process
-from elephant.statistics import mean_firing_rate
 import numpy as np
-from neo import AnalogSignal
-from quantities import Hz
+from quantities import Hz, ms
 
-def rates_to_spikes( rates, t_start, t_stop, variation=False):
+
+def _magnitude(value, units):
+    """
+    Remove the units of a quantity
+    :param value: quantity, or number(s) already in the units
+    :param units: units of the result
+    :return: array of the value in the units
+    """
+    if hasattr(value, 'rescale'):
+        return np.asarray(value.rescale(units).magnitude, dtype='d')
+    return np.asarray(value, dtype='d')
+
+
+def _sort_trains(spikes, nb_spikes):
+    """
+    Sort the spikes inside each spike train of a flat layout
+    :param spikes: spike times of all the spike trains concatenated
+    :param nb_spikes: number of spikes of each spike train
+    :return: the sorted spikes
+    """
+    trains = np.repeat(np.arange(nb_spikes.shape[0]), nb_spikes)
+    return spikes[np.lexsort((spikes, trains))]
+
+
+def region_generator(seed, region, step, stream=0):
+    """
+    Random generator of the draws of all the spike trains of a region at one step.
+    The stream is derived from the root seed with (region, step, stream): the draws of a step are
+    done in one block for all the spike trains of the region and each rank keeps its spike trains,
+    so the spike trains do not depend on the distribution of the spike trains between ranks.
+    :param seed: root seed
+    :param region: index of the region
+    :param step: index of the step, e.g. its first time step
+    :param stream: index of the stream of the step
+    :return: numpy.random.Generator
+    """
+    return np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=(region, step, stream))))
+
+
+def _poisson(rng, lam):
+    """
+    Poisson counts of each spike train
+    :param rng: random generator
+    :param lam: array (number of spike trains, ...) of expected number of spikes
+    :return: counts, with the shape of lam
+    """
+    return rng.poisson(lam)
+
+
+def _uniform(rng, nb_spikes):
+    """
+    Uniform numbers in [0, 1) for the spikes of each spike train
+    :param rng: random generator
+    :param nb_spikes: number of spikes of each spike train
+    :return: the numbers of all the spike trains concatenated
+    """
+    return rng.random(np.sum(nb_spikes))
+
+
+def _integers(rng, nb_spikes, high):
+    """
+    Uniform integers in [0, high) for the spikes of each spike train
+    :param rng: random generator
+    :param nb_spikes: number of spikes of each spike train
+    :param high: upper bound (excluded)
+    :return: the integers of all the spike trains concatenated
+    """
+    draw = rng.integers if hasattr(rng, 'integers') else rng.randint
+    return draw(0, high, np.sum(nb_spikes))
+
+
+def inhomogeneous_poisson_batch(rates, t_start, sampling_period, rng=np.random, resolution=None):
+    """
+    Generate the spike trains of multiple inhomogeneous Poisson processes in one pass.
+    The rates are constant during each sampling period, as for an AnalogSignal in elephant:
+    the number of spikes of each bin follows a Poisson law and the spikes are uniform in the bin.
+    :param rates: array (number of spike trains, number of bins) or (number of bins) of rates in Hz
+    :param t_start: time of the beginning of the first bin in ms
+    :param sampling_period: duration of one bin in ms
+    :param rng: random generator, numpy.random or a numpy.random.Generator
+    :param resolution: None for times in ms, otherwise the times are integer time steps of this
+                       resolution in ms: t_start and sampling_period are in time steps and the
+                       spikes are the time steps of the spikes (no rounding of the times)
+    :return spikes, offsets: spike times of all the spike trains concatenated, sorted in each train,
+                             the spike train i is spikes[offsets[i]:offsets[i+1]]
+    """
+    rates = np.atleast_2d(rates)
+    nb_trains, nb_bins = rates.shape
+    duration = sampling_period if resolution is None else sampling_period * resolution
+    counts = _poisson(rng, rates * (duration * 1e-3))
+    nb_spikes = counts.sum(axis=1)
+    offsets = np.zeros(nb_trains + 1, dtype=np.int64)
+    np.cumsum(nb_spikes, out=offsets[1:])
+    # bin of each spike, the spikes are ordered by train then by bin
+    bins = np.repeat(np.tile(np.arange(nb_bins, dtype=np.int64), nb_trains), counts.ravel())
+    if resolution is None:
+        spikes = t_start + (bins + _uniform(rng, nb_spikes)) * sampling_period
+    elif sampling_period == 1:
+        # one time step by bin: the spikes are the time steps of the bins, already sorted
+        return t_start + bins, offsets
+    else:
+        spikes = t_start + bins * sampling_period + _integers(rng, nb_spikes, sampling_period)
+    return _sort_trains(spikes, nb_spikes), offsets
+
+
+def shared_poisson_batch(rate, nb_trains, t_start, sampling_period, percentage_shared, rng=np.random, rng_shared=None,
+                         resolution=None, copy_probability=0.5):
+    """
+    Generate spike trains with a shared component, for a population which receives the same rate.
+    The shared part of the rate follows a multiple interaction process: one mother spike train of
+    rate rate * percentage_shared / copy_probability is thinned independently for each spike train,
+    each spike of the mother spike train is kept with the probability copy_probability.
+    Each spike train adds its private spikes with the rest of the rate.
+    :param rate: rates of the population in Hz, one per bin
+    :param nb_trains: number of spike trains
+    :param t_start: time of the beginning of the first bin in ms
+    :param sampling_period: duration of one bin in ms
+    :param percentage_shared: part of the rate of the shared spike train, in [0, 1]
+    :param rng: random generator of the private spike trains and of the thinning (see inhomogeneous_poisson_batch)
+    :param rng_shared: random generator of the mother spike train, rng if None
+    :param resolution: None for times in ms, otherwise times in time steps (see inhomogeneous_poisson_batch)
+    :param copy_probability: probability to keep a spike of the mother spike train, in (0, 1]
+    :return spikes, offsets: spike times of all the spike trains concatenated, sorted in each train,
+                             the spike train i is spikes[offsets[i]:offsets[i+1]]
+    """
+    if not 0.0 <= percentage_shared <= 1.0:
+        raise Exception('percentage of shared rate must be in [0, 1] : ' + str(percentage_shared))
+    if not 0.0 < copy_probability <= 1.0:
+        raise Exception('copy probability must be in (0, 1] : ' + str(copy_probability))
+    rate = np.ravel(rate)
+    if rng_shared is None:
+        rng_shared = rng
+    # private spike trains
+    private, offsets = inhomogeneous_poisson_batch(
+        np.broadcast_to(rate * (1.0 - percentage_shared), (nb_trains, rate.shape[0])),
+        t_start, sampling_period, rng, resolution)
+    if percentage_shared == 0.0:
+        return private, offsets
+    # mother spike train, thinned for each spike train
+    mother, _ = inhomogeneous_poisson_batch(rate * (percentage_shared / copy_probability), t_start, sampling_period,
+                                            rng_shared, resolution)
+    kept = rng.random((nb_trains, mother.shape[0])) < copy_probability
+    nb_copies = kept.sum(axis=1)
+    copies = np.broadcast_to(mother, kept.shape)[kept]  # ordered by train
+    nb_spikes = np.diff(offsets) + nb_copies
+    spikes = np.concatenate((copies, private))
+    trains = np.concatenate((np.repeat(np.arange(nb_trains), nb_copies),
+                             np.repeat(np.arange(nb_trains), np.diff(offsets))))
+    spikes = spikes[np.lexsort((spikes, trains))]
+    offsets = np.zeros(nb_trains + 1, dtype=np.int64)
+    np.cumsum(nb_spikes, out=offsets[1:])
+    return spikes, offsets
+
+
+def region_poisson_trains(rate, nb_trains, first, last, t_start, sampling_period, resolution, seed, region,
+                          percentage_shared=0.0, copy_probability=0.5):
+    """
+    Spike trains of the spike generators [first, last) of a region which receives the same rate.
+    The spike trains of all the spike generators of the region are drawn in one pass with the
+    streams of (seed, region, step), see region_generator, and the range is selected: the spike
+    trains are the same for any distribution of the spike generators between ranks.
+    :param rate: rates of the region in Hz, one per bin
+    :param nb_trains: number of spike generators of the region
+    :param first: first spike generator, in the region
+    :param last: last spike generator (excluded), in the region
+    :param t_start: first time step of the first bin, it identifies the step
+    :param sampling_period: number of time steps of one bin
+    :param resolution: duration of a time step in ms
+    :param seed: root seed
+    :param region: index of the region
+    :param percentage_shared: part of the rate of the shared spike train, see shared_poisson_batch
+    :param copy_probability: probability to keep a spike of the mother spike train, see shared_poisson_batch
+    :return spikes, offsets: time steps of the spikes of the spike generators [first, last) concatenated,
+                             the spike train i is spikes[offsets[i]:offsets[i+1]]
+    """
+    spikes, offsets = shared_poisson_batch(rate, nb_trains, t_start, sampling_period, percentage_shared,
+                                           rng=region_generator(seed, region, int(t_start), 0),
+                                           rng_shared=region_generator(seed, region, int(t_start), 1),
+                                           resolution=resolution, copy_probability=copy_probability)
+    if first == 0 and last == nb_trains:
+        return spikes, offsets
+    return spikes[offsets[first]:offsets[last]], offsets[first:last + 1] - offsets[first]
+
+
+def rates_to_spikes(rates, t_start, t_stop, variation=False, rng=np.random):
     """
     Generate spike train with homogenous or inhomogenous Poisson generator
-    :param rates: an array or a float of quantities
-    :param t_start: time to start spike train
-    :param t_stop: time where the spike train stop
+    :param rates: an array or a float of quantities (or numbers in Hz)
+        without variation: one rate per spike train
+        with variation: the rates of one spike train (1D) or of multiple spike trains (2D),
+        the last axis is the time
+    :param t_start: time to start spike train (quantity or number in ms)
+    :param t_stop: time where the spike train stop (quantity or number in ms)
     :param variation: Boolean for variation of rate
-    :return: one or multiple spike train
+    :param rng: random generator, numpy.random or a numpy.random.Generator
+    :return spikes, offsets: spike times in ms of all the spike trains concatenated, sorted in each train,
+                             the spike train i is spikes[offsets[i]:offsets[i+1]]
     """
+    rates = _magnitude(rates, Hz)
+    t_start = float(_magnitude(t_start, ms))
+    t_stop = float(_magnitude(t_stop, ms))
     if variation:
         # the case where the variation of the rate is include
-        # We generate the inhomogenous poisson
-        if len(rates.shape) == 1:
-            # the case where we have only one rate
-            signal = AnalogSignal(rates, t_start=t_start, sampling_period=(t_stop-t_start)/rates.shape[-1])
-            result = [inhomogeneous_poisson_process(signal,as_array=True)]
-            return np.array(result)
-        else :
-            # the case where we have multiple rates
-            result = []
-            for rate in rates:
-                signal = AnalogSignal(rate, t_start=t_start, sampling_period=(t_stop - t_start) / rates.shape[-1])
-                result.append(inhomogeneous_poisson_process(signal,as_array=True))
-            return np.array(result)
-    else:
-        # the case we have only the rate
-        # We generate the homogenous poisson
-        if len(rates.shape) ==0:
-            # the case where we have only one rate
-            result = np.array([homogeneous_poisson_process(rate=rates, t_start=t_start, t_stop=t_stop, as_array=True)])
-        else:
-            # the case where we have multiple rates
-            result = []
-            for rate in rates:
-                result.append(homogeneous_poisson_process(rate=rate, t_start=t_start, t_stop=t_stop, as_array=True))
-        return np.array(result)
-
-def spikes_to_rate( spikes,t_start,t_stop, windows=0.0):
-    """
-    #WARNING function unused but keep it for idea
-    Compute the rate of one spike train or multiple of spike trains
+        # We generate the inhomogenous poisson, rates constant on each bin
+        rates = np.atleast_2d(rates)
+        return inhomogeneous_poisson_batch(rates, t_start, (t_stop - t_start) / rates.shape[-1], rng)
+    # the case we have only the rate
+    # We generate the homogenous poisson: number of spikes, then uniform times
+    rates = np.atleast_1d(rates)
+    nb_spikes = _poisson(rng, rates * ((t_stop - t_start) * 1e-3))
+    offsets = np.zeros(rates.shape[0] + 1, dtype=np.int64)
+    np.cumsum(nb_spikes, out=offsets[1:])
+    spikes = t_start + _uniform(rng, nb_spikes) * (t_stop - t_start)
+    return _sort_trains(spikes, nb_spikes), offsets
 
-    #TODO : need to have add the overlapping of windows
-    :param spikes: one spike train or multiple spike train
+
+def spikes_to_rate(spikes, t_start, t_stop, windows=0.0, overlap=0.0):
+    """
+    Compute the rate of one spike train or multiple of spike trains
+    The spikes are counted in each window with the cumulative count of the sorted spikes,
+    a window contains the spikes from its start included to its end excluded.
+    :param spikes: one spike train or multiple spike train (quantities or numbers in ms)
     :param t_start: time to start to compute rate
     :param t_stop: time to stop to compute rate
     :param windows: the window for compute rate
-    # :param overlaps: FUTURE overlap of window
-    :return: rates or variation of rates
+    :param overlap: fraction of a window shared with the next window, in [0, 1)
+    :return: rates (one per spike train) or variation of rates (one row per window), in Hz
     """
-
+    t_start = float(_magnitude(t_start, ms))
+    t_stop = float(_magnitude(t_stop, ms))
+    windows = float(_magnitude(windows, ms))
+    if len(spikes) == 0 or np.ndim(spikes[0]) == 0:
+        # only one spike train
+        spikes = [spikes]
+    trains = [np.ravel(_magnitude(spike, ms)) for spike in spikes]
+    nb_spikes = np.array([train.shape[0] for train in trains], dtype=np.int64)
+    flat = np.concatenate(trains) if len(trains) > 0 else np.empty(0)
     if windows == 0.0:
-        #case without variation of rate
-        if len(spikes[0].shape) ==0:
-            # with only one rate
-            result = [mean_firing_rate(spiketrain=spikes,t_start=t_start,t_stop=t_stop).rescale(Hz)]
-        else:
-            # with multiple rate
-            result = []
-            for spike in spikes:
-                result.append(mean_firing_rate(spiketrain=spike,t_start=t_start,t_stop=t_stop).rescale(Hz))
-        return np.array(result)
+        # case without variation of rate
+        starts = np.array([t_start])
+        stops = np.array([t_stop])
     else:
-        # case with variation of rate
-        rate = []
-        for time in np.arange(t_start,t_stop,windows):
-            t_start_window = time*t_start.units
-            t_stop_window = t_start_window+windows
-            if len(spikes[0].shape) == 0:
-                # for only one spike train
-                result = [mean_firing_rate(spiketrain=spikes, t_start=t_start_window, t_stop=t_stop_window).rescale(Hz)]
-            else:
-                # for multiple spike train
-                result = []
-                for spike in spikes:
-                    result.append(mean_firing_rate(spiketrain=spike, t_start=t_start_window, t_stop=t_stop_window).rescale(Hz))
-            rate.append(result)
-        return np.array(rate)
+        # case with variation of rate, the windows can overlap
+        if not 0.0 <= overlap < 1.0:
+            raise Exception('overlap of the windows must be in [0, 1) : ' + str(overlap))
+        starts = np.arange(t_start, t_stop, windows * (1.0 - overlap))
+        stops = starts + windows
+    # the spikes are sorted by spike train then by time: each spike train is a contiguous
+    # block of increasing keys, the cumulative count at a time is given by searchsorted
+    ids = np.repeat(np.arange(nb_spikes.shape[0]), nb_spikes)
+    origin = min(np.min(flat, initial=t_start), t_start)
+    length = max(np.max(flat, initial=stops[-1]), stops[-1]) - origin + 1.0
+    keys = np.sort(ids * length + (flat - origin))
+    shift = np.arange(nb_spikes.shape[0])[np.newaxis, :] * length - origin
+    counts = np.searchsorted(keys, stops[:, np.newaxis] + shift) - np.searchsorted(keys, starts[:, np.newaxis] + shift)
+    rates = np.ascontiguousarray(counts / ((stops - starts)[:, np.newaxis] * 1e-3))
+    if windows == 0.0:
+        return rates[0]
+    return rates
 
 if __name__=='__main__':
     from quantities import ms,Hz
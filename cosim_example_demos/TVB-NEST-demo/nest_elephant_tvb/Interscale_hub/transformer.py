@@ -28,8 +28,10 @@
 # ------------------------------------------------------------------------------
 
 
+import numpy as np
 from EBRAINS_ConfigManager.global_configurations_manager.xml_parsers.default_directories_enum import DefaultDirectories
 from .backend import tvb_to_nest_init, nest_to_tvb_init
+from .science import region_poisson_trains
 
 
 class Transformer:
@@ -100,4 +102,261 @@ class Transformer:
             returns the spike trains from rate
         """
         # return self.__elephant_delegator.rate_to_spikes(time_step, data_buffer)
-        pass
\ No newline at end of file
+        pass
+
+
+# NOTE: the classes below are created once, when the pivot starts, and are used
+# for every synchronization step. They own their buffers and keep their state
+# between the steps.
+
+def neuron_regions(ids, first_neurons, nb_neurons):
+    '''
+    Region of each neuron id, the neurons of the region r are the ids
+    [first_neurons[r], first_neurons[r] + nb_neurons[r]).
+    :param ids: neuron ids
+    :param first_neurons: first neuron id of each region
+    :param nb_neurons: number of neurons of each region
+    :return region, offset: region of each id (-1 for the ids outside of the regions),
+                            position of each id in its region
+    '''
+    order = np.argsort(first_neurons, kind='stable')  # the regions in order of ids
+    position = np.searchsorted(first_neurons[order], ids, side='right') - 1
+    region = order[np.maximum(position, 0)]
+    offset = ids - first_neurons[region]
+    region[(position < 0) | (offset >= nb_neurons[region])] = -1
+    return region, offset
+
+
+class store_data:
+    '''
+    Histogram of the spike events of one synchronization step, for each region.
+    The neurons of the region r are the ids [id_first_neurons[r], id_first_neurons[r] + nb_neurons[r]).
+    '''
+    def __init__(self, param, logger=None):
+        '''
+        :param param: parameters of the transformation
+        :param logger: optional logger for the spike events outside of the step
+        '''
+        self.__logger = logger
+        self.synch = param['time_synchronization']  # time of synchronization between 2 run
+        self.dt = param['resolution']  # the resolution of the integrator
+        self.nb_bins = int(np.rint(self.synch / self.dt))  # one bin per time step
+        self.first_neurons = np.asarray(param['id_first_neurons'], dtype=np.int64)  # first neuron id of each region
+        self.nb_neurons = np.asarray(param['nb_neurons'], dtype=np.int64)  # number of neurons of each region
+        self.nb_regions = self.first_neurons.shape[0]
+        # two histograms (time step x region): one is returned while the other is filled
+        self.__hist = np.zeros((self.nb_bins, self.nb_regions), dtype='d')
+        self.__hist_return = np.zeros((self.nb_bins, self.nb_regions), dtype='d')
+
+    def add_spikes(self, count, ticks, ids):
+        '''
+        Add the spike events to the histogram of the step.
+        :param count: index of the synchronization step
+        :param ticks: time of each event, in time steps of NEST
+        :param ids: neuron id of each event
+        '''
+        # NEST stamps the spikes of the step count in (t0, t0 + synch]:
+        # the ticks count * nb_bins + 1 to (count + 1) * nb_bins are the bins 0 to nb_bins - 1
+        index = ticks - (count * self.nb_bins + 1)
+        in_step = (index >= 0) & (index < self.nb_bins)
+        if self.__logger is not None and not np.all(in_step):
+            self.__logger.warning('step ' + str(count) + ': ' + str(np.count_nonzero(~in_step))
+                                  + ' spike events outside of the step are dropped')
+        # bin of the time step and of the region of the neuron,
+        # the spikes of the neurons outside of the regions are dropped
+        region, _ = neuron_regions(ids, self.first_neurons, self.nb_neurons)
+        inside = in_step & (region >= 0)
+        index = index[inside] * self.nb_regions + region[inside]
+        self.__hist += np.bincount(index, minlength=self.__hist.size).reshape(self.__hist.shape)
+
+    def return_data(self):
+        '''
+        Return the histogram of the step and start the next one.
+        :return: histogram, valid until the next call
+        '''
+        self.__hist, self.__hist_return = self.__hist_return, self.__hist
+        self.__hist[:] = 0.0
+        return self.__hist_return
+
+
+class analyse_data:
+    '''
+    Mean firing rate of the population of each region with a sliding window over the histogram.
+    The end of the histogram of a step is kept for the window of the next step.
+    '''
+    def __init__(self, param):
+        '''
+        :param param: parameters of the transformation
+        '''
+        self.dt = param['resolution']  # the resolution of the integrator
+        self.nb_bins = int(np.rint(param['time_synchronization'] / self.dt))  # time steps of a step
+        self.width = max(int(param['width'] / param['resolution']), 1)  # the window of the average in time
+        nb_neurons = np.asarray(param['nb_neurons'], dtype='d')  # number of neurons of each region
+        self.nb_regions = nb_neurons.shape[0]
+        # the rate is linear in the spikes, the partial rates of several workers can be summed
+        self.coeff = 1 / (nb_neurons * param['resolution'] * self.width)  # mean firing rate in KHz
+        # previous bins (the state of the window) followed by the histogram of the step
+        self.__window = np.zeros((self.width + self.nb_bins, self.nb_regions), dtype='d')
+        self.__cumsum = np.zeros((self.width + self.nb_bins + 1, self.nb_regions), dtype='d')
+
+    def analyse(self, count, hist, out=None):
+        '''
+        Compute the rate of the step.
+        :param count: index of the synchronization step
+        :param hist: histogram of the step (time step x region)
+        :param out: optional array of the size of the histogram for the rates, e.g. a send buffer
+        :return times, rate: starting and ending time of the step, rate of each time step and region,
+                             flat (time step x region) block
+        '''
+        self.__window[self.width:] = hist
+        np.cumsum(self.__window, axis=0, out=self.__cumsum[1:])
+        if out is None:
+            out = np.empty(self.nb_bins * self.nb_regions, dtype='d')
+        rate = out.reshape(self.nb_bins, self.nb_regions)
+        # sum of the width bins which end at each time step of the step
+        np.subtract(self.__cumsum[self.width + 1:], self.__cumsum[1:self.nb_bins + 1], out=rate)
+        rate *= self.coeff
+        # keep the last bins for the next step
+        self.__window[:self.width] = self.__window[-self.width:]
+        # time steps of the step, in ms only for the message
+        times = np.array([count * self.nb_bins, (count + 1) * self.nb_bins], dtype='d') * self.dt
+        return times, out
+
+
+class spiketorate:
+    '''
+    Transformation of the spike events of NEST into the rate for TVB:
+    histogram of the step, then sliding window.
+    '''
+    def __init__(self, param, logger=None):
+        '''
+        :param param: parameters of the transformation
+        :param logger: optional logger for the spike events outside of the step
+        '''
+        self.__store = store_data(param, logger)
+        self.__analyse = analyse_data(param)
+
+    def spike_to_rate(self, count, ticks, ids, out=None):
+        '''
+        :param count: index of the synchronization step
+        :param ticks: time of each spike, in time steps of NEST
+        :param ids: neuron id of each spike
+        :param out: optional array for the rates, e.g. a send buffer
+        :return times, rate: starting and ending time of the step, rate of each time step and region
+        '''
+        self.__store.add_spikes(count, ticks, ids)
+        return self.__analyse.analyse(count, self.__store.return_data(), out)
+
+
+class generate_data:
+    '''
+    Transformation of the rate of TVB into spike trains for the spike generators of NEST.
+    The rate of TVB is a (time step x region) block, the spike generators of the region r
+    receive the rate of the column r.
+    '''
+    def __init__(self, param):
+        '''
+        :param param: parameters of the transformation
+        '''
+        self.nb_spike_generator = param['nb_spike_generator']  # number of spike generators
+        self.id_first_spike_generator = param.get('id_first_spike_generator', 0)
+        self.nb_synapse = param['nb_brain_synapses']  # number of synapses by neurons
+        self.dt = param['resolution']  # the resolution of NEST
+        # number of spike generators of each region, all the spike generators in one region by default
+        nb_region_generators = param.get('nb_spike_generator_region',
+                                         [self.id_first_spike_generator + self.nb_spike_generator])
+        self.nb_regions = len(nb_region_generators)
+        # the spike generators of this object in each region: (region, first, last, number of spike
+        # generators of the region) with first and last relative to the first spike generator of the region
+        bounds = np.concatenate(([0], np.cumsum(nb_region_generators)))
+        first_id, last_id = self.id_first_spike_generator, self.id_first_spike_generator + self.nb_spike_generator
+        self.__regions = [(region, max(first_id, bounds[region]) - bounds[region],
+                           min(last_id, bounds[region + 1]) - bounds[region], nb_region_generators[region])
+                          for region in range(self.nb_regions)
+                          if min(last_id, bounds[region + 1]) > max(first_id, bounds[region])]
+        # the random streams are derived from the root seed by region and step,
+        # the spike trains are the same for any number of ranks (see region_poisson_trains)
+        self.seed = param['seed']
+        # shared component of the spike trains (multiple interaction process)
+        self.percentage_shared = param['percentage_shared']  # percentage of shared rate between neurons
+        self.copy_probability = param['copy_probability']  # probability to keep a spike of the shared spike train
+        # the rate is read from the shared buffer, it is scaled in this array
+        self.__rate = np.empty((0, self.nb_regions), dtype='d')
+        # (time, rate) pairs of the step, for the transport of the rates
+        self.__pairs = np.empty(0, dtype='d')
+
+    def _time_steps(self, time_step, nb_rates):
+        '''
+        Start and duration of the bins of the rate, in time steps of NEST.
+        :param time_step: starting and ending time of the step
+        :param nb_rates: number of rates (bins) of the step
+        :return start, bin_steps: first time step after the start of the step, time steps by bin
+        '''
+        start = int(np.rint(time_step[0] / self.dt)) + 1
+        bin_steps = max(int(np.rint((time_step[1] - time_step[0]) / self.dt / nb_rates)), 1)
+        return start, bin_steps
+
+    def generate_spike(self, count, time_step, rate):
+        '''
+        :param count: index of the synchronization step
+        :param time_step: starting and ending time of the step
+        :param rate: rate of each time step and region, flat (time step x region) block
+        :return spikes, offsets: spike trains of the spike generators in CSR layout, in time steps of NEST,
+                                 the train of generator i is spikes[offsets[i]:offsets[i+1]]
+        '''
+        rate = rate.reshape(-1, self.nb_regions)
+        if self.__rate.shape != rate.shape:
+            self.__rate = np.empty(rate.shape, dtype='d')
+        # rate of poisson generator ( due property of poisson process)
+        np.multiply(rate, self.nb_synapse, out=self.__rate)
+        np.abs(self.__rate, out=self.__rate)
+        self.__rate += 1e-12  # avoid rate equals to zeros
+        # the spike times are integer time steps of NEST, converted in ms only for NEST
+        start, bin_steps = self._time_steps(time_step, rate.shape[0])
+        # the same rate for all the spike generators of a region, generated in one pass by region
+        trains = [region_poisson_trains(self.__rate[:, region], nb_region, first, last, start, bin_steps,
+                                        self.dt, self.seed, region, self.percentage_shared, self.copy_probability)
+                  for region, first, last, nb_region in self.__regions]
+        if len(trains) == 1:
+            return trains[0]
+        return self._concatenate(trains)
+
+    def _concatenate(self, trains):
+        '''
+        Concatenate the CSR layouts of consecutive groups of spike generators.
+        :param trains: list of (data, offsets) of each group
+        :return data, offsets: data of all the spike generators in CSR layout
+        '''
+        data = np.concatenate([group for group, _ in trains])
+        starts = np.cumsum([0] + [offsets[-1] for _, offsets in trains[:-1]])
+        offsets = np.concatenate([[0]] + [offsets[1:] + start for (_, offsets), start in zip(trains, starts)])
+        return data, offsets.astype(np.int64)
+
+    def generate_rate(self, count, time_step, rate):
+        '''
+        Rate of the step for the inhomogeneous Poisson generators of NEST, which generate
+        the spikes locally: an independent spike train for each target of a generator.
+        The data of a generator are the (time, rate) pairs of the time steps, their size
+        depends on the number of time steps and not on the number of spikes.
+        :param count: index of the synchronization step
+        :param time_step: starting and ending time of the step
+        :param rate: rate of each time step and region, flat (time step x region) block
+        :return data, offsets: data of the generators in CSR layout,
+                               the data of generator i is data[offsets[i]:offsets[i+1]]
+        '''
+        rate = rate.reshape(-1, self.nb_regions)
+        nb_rates = rate.shape[0]
+        if self.__pairs.shape != (self.nb_regions, 2 * nb_rates):
+            self.__pairs = np.empty((self.nb_regions, 2 * nb_rates), dtype='d')
+        # times of the changes of rate, from the time steps of NEST
+        start, bin_steps = self._time_steps(time_step, nb_rates)
+        self.__pairs[:, 0::2] = (start + np.arange(nb_rates) * bin_steps) * self.dt
+        # rate of poisson generator ( due property of poisson process)
+        np.multiply(rate.T, self.nb_synapse, out=self.__pairs[:, 1::2])
+        np.abs(self.__pairs[:, 1::2], out=self.__pairs[:, 1::2])
+        # the pairs of the region of each spike generator
+        regions = np.repeat([region for region, _, _, _ in self.__regions],
+                            [last - first for _, first, last, _ in self.__regions])
+        data = self.__pairs[regions].ravel()
+        offsets = np.arange(self.nb_spike_generator + 1, dtype=np.int64) * (2 * nb_rates)
+        return data, offsets
@@ -8,13 +8,16 @@ from nest_elephant_tvb.utils import create_logger
 from nest_elephant_tvb.nest.utils_function import wait_transformation_modules, get_data
 
 
-def configure(simulator, co_simulation, nb_neurons=10000):
+def configure(simulator, co_simulation, nb_neurons=10000, transport_to_nest='spikes'):
     """
     configure NEST before the simulation
     modify example of https://simulator.simulator.readthedocs.io/en/stable/_downloads/482ad6e1da8dc084323e0a9fe6b2c7d1/brunel_alpha_simulator.py
     :param simulator: nest simulator
     :param co_simulation: boolean for checking if the co-simulation is active or not
     :param nb_neurons: number of neurons
+    :param transport_to_nest: 'spikes': one spike generator by neuron receives its spike train
+                              'rates': one inhomogeneous Poisson generator receives the rate of the region
+                              and generates an independent spike train for each neuron
     :return:
     """
     # create the neurons and the devices
@@ -40,14 +43,24 @@ def configure(simulator, co_simulation, nb_neurons=10000):
     simulator.Connect(nodes_in, nodes_ex + nodes_in, conn_params_in, "inhibitory")
     # Cosimulation devices
     if co_simulation:
-        input_to_simulator = simulator.Create("spike_generator", nb_neurons,
-                                              params={'stimulus_source': 'mpi',
-                                                      'label': '/../transformation/spike_generator'})
+        if transport_to_nest == 'spikes':
+            input_to_simulator = simulator.Create("spike_generator", nb_neurons,
+                                                  params={'stimulus_source': 'mpi',
+                                                          'label': '/../transformation/spike_generator'})
+            simulator.Connect(input_to_simulator, nodes_ex, {'rule': 'one_to_one'},
+                              {"weight": 20.68015524367846, "delay": 0.1})
+        elif transport_to_nest == 'rates':
+            # the size of the data does not depend on the number of neurons
+            input_to_simulator = simulator.Create("inhomogeneous_poisson_generator", 1,
+                                                  params={'stimulus_source': 'mpi',
+                                                          'label': '/../transformation/spike_generator'})
+            simulator.Connect(input_to_simulator, nodes_ex, {'rule': 'all_to_all'},
+                              {"weight": 20.68015524367846, "delay": 0.1})
+        else:
+            raise Exception('bad transport to NEST : ' + str(transport_to_nest))
         output_from_simulator = simulator.Create("spike_recorder",
                                                  params={"record_to": "mpi",
                                                          'label': '/../transformation/spike_detector'})
-        simulator.Connect(input_to_simulator, nodes_ex, {'rule': 'one_to_one'},
-                          {"weight": 20.68015524367846, "delay": 0.1})
         simulator.Connect(nodes_ex, output_from_simulator, {'rule': 'all_to_all'},
                           {"weight": 1.0, "delay": 0.1})
         return espikes, input_to_simulator, output_from_simulator
@@ -55,7 +68,8 @@ def configure(simulator, co_simulation, nb_neurons=10000):
         return espikes, None, None
 
 
-def run_example(co_simulation, path, time_synch=0.1, simtime=1000.0, level_log=1, resolution=0.1, nb_neurons=10000):
+def run_example(co_simulation, path, time_synch=0.1, simtime=1000.0, level_log=1, resolution=0.1, nb_neurons=10000,
+                transport_to_nest='spikes'):
     """
     run the example for NEST
     :param co_simulation: boolean for checking if the co-simulation is active or not
@@ -66,6 +80,7 @@ def run_example(co_simulation, path, time_synch=0.1, simtime=1000.0, level_log=1
     :param level_log: level of the log
     :param resolution: resolution of the simulation
     :param nb_neurons: number of neurons
+    :param transport_to_nest: data sent to NEST, 'spikes' or 'rates' (the same as in the InterscaleHub)
     :return:
     """
     logger = create_logger(path, 'nest', level_log)
@@ -76,7 +91,7 @@ def run_example(co_simulation, path, time_synch=0.1, simtime=1000.0, level_log=1
         {"data_path": path + '/nest/', "overwrite_files": True, "print_time": True, "resolution": resolution})
 
     logger.info("configure the network")
-    espikes, input_to_simulator, output_from_simulator = configure(nest, co_simulation, nb_neurons)
+    espikes, input_to_simulator, output_from_simulator = configure(nest, co_simulation, nb_neurons, transport_to_nest)
 
     logger.info("start the simulation")
     if not co_simulation:
@@ -116,9 +131,12 @@ if __name__ == "__main__":
             parameters = json.load(f)
         if "time_synchronization" not in parameters.keys():
             parameters['time_synchronization'] = -1
+        if "transport_to_nest" not in parameters.keys():
+            parameters['transport_to_nest'] = 'spikes'
         run_example(parameters['co_simulation'], parameters['path'], simtime=parameters['simulation_time'],
                     level_log=parameters['level_log'], resolution=parameters['resolution'],
-                    time_synch=parameters['time_synchronization'], nb_neurons=parameters['nb_neurons'][0])
+                    time_synch=parameters['time_synchronization'], nb_neurons=parameters['nb_neurons'][0],
+                    transport_to_nest=parameters['transport_to_nest'])
     elif len(sys.argv) == 6:  # run with parameter in command line
         run_example(bool(int(sys.argv[1])), sys.argv[2], time_synch=float(sys.argv[3]),
                     simtime=float(sys.argv[4]), level_log=int(sys.argv[5]))
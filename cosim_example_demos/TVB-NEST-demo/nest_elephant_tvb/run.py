@@ -174,6 +174,8 @@ if __name__ == "__main__":
         'id_first_neurons': [1],
         "save_spikes": True,
         "save_rate": True,
+        # data sent to NEST, the same as in Interscale_hub/parameter.py
+        "transport_to_nest": 'spikes',
     })
     run(parameter_co_simulation)
 
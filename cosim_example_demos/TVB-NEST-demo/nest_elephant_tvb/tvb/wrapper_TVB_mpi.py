@@ -6,6 +6,8 @@ import numpy as np
 from mpi4py import MPI
 import os
 import time
+from nest_elephant_tvb.Interscale_hub.protocol import Header, MessageStatus, MessageSender, MessageReceiver
+from nest_elephant_tvb.tvb.coupling import initial_coupling
 
 
 def run_mpi(simulator, path, logger):
@@ -33,45 +35,43 @@ def run_mpi(simulator, path, logger):
     for i in range(nb_monitor):  # the input output monitor
         save_result.append([])
 
-    # init MPI :
-    comm_receive = []
-    for i in id_proxy:
-        comm_receive.append(init_mpi(path_send + str(i) + ".txt", logger))
-    comm_send = []
-    for i in id_proxy:
-        comm_send.append(init_mpi(path_receive + str(i) + ".txt", logger))
+    # init MPI : one connection by direction for all the proxy nodes, the port is in the file of the first one
+    nb_proxy = len(id_proxy)
+    comm_receive = init_mpi(path_send + str(id_proxy[0]) + ".txt", logger)
+    comm_send = init_mpi(path_receive + str(id_proxy[0]) + ".txt", logger)
+    # persistent requests and buffers for the exchanges, one rate per time step and proxy node
+    receiver = MessageReceiver(comm_receive, time_synch_n * nb_proxy)
+    sender = MessageSender(comm_send, time_synch_n * nb_proxy, source=0)
 
     logger.info("send initialisation of TVB : prepare data")
-    initialisation_data = []
-    for i in np.arange(0, time_synch_n, 1, dtype=np.int):
-        initialisation_data.append(simulator._loop_compute_node_coupling(i)[:, id_proxy, :])
-    initialisation_data = np.concatenate(initialisation_data)
+    # block (time x proxy node) in one message, written in the payload of the message when it fits
+    size = time_synch_n * simulator.history.n_cvar * simulator.history.n_mode * nb_proxy
+    initialisation_data = sender.payload(size)
+    if initialisation_data is None:
+        initialisation_data = np.empty(size, dtype='d')
+    initial_coupling(simulator, id_proxy, time_synch_n, initialisation_data)
+    initialisation_data *= 1e3
     time_init = [0, time_synch]
     logger.info("send initialisation of TVB : send data")
-    for index, comm in enumerate(comm_send):
-        send_mpi(comm, time_init, initialisation_data[:, index] * 1e3, logger)
+    send_mpi(sender, 0, time_init, initialisation_data, logger)
 
     # the loop of the simulation
     count = 0
     while count * time_synch < end:  # FAT END POINT
         logger.info(" TVB receive data start")
         # receive MPI data
-        data_value = []
-        for comm in comm_receive:
-            receive = receive_mpi(comm, logger)
-            time_data = receive[0]
-            data_value.append(receive[1])
+        receive = receive_mpi(receiver, logger)
+        step = receive[0]
         logger.info(" TVB receive data values")
         data = np.empty((2,), dtype=object)
-        nb_step = np.rint((time_data[1] - time_data[0]) / dt)
-        nb_step_0 = np.rint(time_data[0] / dt) + 1  # start at the first time step not at 0.0
-        time_data = np.arange(nb_step_0, nb_step_0 + nb_step, 1) * dt
-        data_value = np.swapaxes(np.array(data_value), 0, 1)[:, :]
-        data_value = np.expand_dims(data_value, axis=(1, 3))
-        if data_value.shape[0] != time_data.shape[0]:
-            print(nb_step)
-            print(dt, time_data, receive)
-            raise (Exception('Bad shape of data ' + str(data_value.shape[0]) + " " + str(time_data.shape[0])))
+        # integer time steps of the step, the time in ms only for TVB
+        nb_step_0 = step * time_synch_n + 1  # start at the first time step not at 0.0
+        time_data = (nb_step_0 + np.arange(time_synch_n)) * dt
+        # block (time x proxy node) of the rates
+        if receive[2].shape[0] != time_data.shape[0] * nb_proxy:
+            print(step, receive)
+            raise (Exception('Bad shape of data ' + str(receive[2].shape[0]) + " " + str(time_data.shape[0] * nb_proxy)))
+        data_value = np.expand_dims(np.array(receive[2]).reshape(-1, nb_proxy), axis=(1, 3))
         data[:] = [time_data, data_value]
 
         logger.info(" TVB start simulation " + str(count * time_synch))
@@ -86,19 +86,16 @@ def run_mpi(simulator, path, logger):
         nest_data = simulator.loop_cosim_monitor_output(n_steps=time_synch_n)[0]
         times = [nest_data[0][0], nest_data[0][-1]]
         rate = np.concatenate(nest_data[1][:, 0, [id_proxy], 0])
-        for index, comm in enumerate(comm_send):
-            send_mpi(comm, times, rate[:, index] * 1e3, logger)
+        send_mpi(sender, count + 1, times, rate * 1e3, logger)
 
         # increment of the loop
         count += 1
     # save the last part
     logger.info(" TVB finish")
-    for index, comm in enumerate(comm_send):
-        logger.info('end comm send')
-        end_mpi(comm, path + "/transformation/receive_from_tvb/" + str(id_proxy[index]) + ".txt", True, logger)
-    for index, comm in enumerate(comm_receive):
-        logger.info('end comm receive')
-        end_mpi(comm, path + "/transformation/send_to_tvb/" + str(id_proxy[index]) + ".txt", False, logger)
+    logger.info('end comm send')
+    end_mpi(comm_send, sender, path_receive + str(id_proxy[0]) + ".txt", True, logger)
+    logger.info('end comm receive')
+    end_mpi(comm_receive, receiver, path_send + str(id_proxy[0]) + ".txt", False, logger)
     MPI.Finalize()  # ending with MPI
     logger.info(" TVB exit")
     return reshape_result(save_result)
@@ -126,66 +123,49 @@ def init_mpi(path, logger):
     return comm
 
 
-def send_mpi(comm, times, data, logger):
+def send_mpi(sender, step, times, data, logger):
     """
-    send mpi data
-    :param comm: MPI communicator
+    send mpi data, one message: header (step, times, status, size) and the data
+    :param sender: MessageSender of the MPI communicator
+    :param step: index of the simulation step
     :param times: times of values
     :param data: rates inputs
     :param logger: logger of the modules
     :return:nothing
     """
     logger.info("start send")
-    status_ = MPI.Status()
     # wait until the transformer accept the connections
-    accept = False
-    while not accept:
-        req = comm.irecv(source=0, tag=0)
-        accept = req.wait(status_)
-        logger.info("send accept")
-    source = status_.Get_source()  # the id of the excepted source
-    logger.info("get source")
-    data = np.ascontiguousarray(data, dtype='d')  # format the rate for sending
-    shape = np.array(data.shape[0], dtype='i')  # size of data
-    times = np.array(times, dtype='d')  # time of starting and ending step
-    comm.Send([times, MPI.DOUBLE], dest=source, tag=0)
-    comm.Send([shape, MPI.INT], dest=source, tag=0)
-    comm.Send([data, MPI.DOUBLE], dest=source, tag=0)
+    sender.wait_request()
+    logger.info("send accept")
+    sender.send(step, times, data)
     logger.info("end send")
 
 
-def receive_mpi(comm, logger):
+def receive_mpi(receiver, logger):
     """
         receive proxy values the
-    :param comm: MPI communicator
+    :param receiver: MessageReceiver of the MPI communicator
     :param logger: logger of the modules
-    :return: rate of all proxy
+    :return: index of the step, times and rate of all proxy
     """
     logger.info("start receive")
-    status_ = MPI.Status()
     # send to the transformer : I want the next part
-    req = comm.isend(True, dest=0, tag=0)
-    req.wait()
-    time_step = np.empty(2, dtype='d')
-    comm.Recv([time_step, 2, MPI.DOUBLE], source=0, tag=MPI.ANY_TAG, status=status_)
-    # get the size of the rate
-    size = np.empty(1, dtype='i')
-    comm.Recv([size, MPI.INT], source=0, tag=0)
-    # get the rate
-    rates = np.empty(size, dtype='d')
-    comm.Recv([rates, size, MPI.DOUBLE], source=0, tag=MPI.ANY_TAG, status=status_)
+    # one message: header (step, times, status, size) and the rates
+    status, header, rates = receiver.receive()
+    time_step = header[Header.TIME_START:Header.TIME_END + 1]
     logger.info("end receive " + str(time_step))
     # print the summary of the data
-    if status_.Get_tag() == 0:
-        return time_step, rates
+    if status == MessageStatus.DATA:
+        return int(header[Header.STEP]), time_step, rates
     else:
         return None
 
 
-def end_mpi(comm, path, sending, logger):
+def end_mpi(comm, exchange, path, sending, logger):
     """
     ending the communication
     :param comm: MPI communicator
+    :param exchange: MessageSender or MessageReceiver of the MPI communicator
     :param path: for the close the port
     :param sending: if the transformer is for sending or receiving data
     :param logger: logger of the module
@@ -200,22 +180,16 @@ def end_mpi(comm, path, sending, logger):
     if sending:
         logger.info("TVB close connection send " + port)
         sys.stdout.flush()
-        status_ = MPI.Status()
         # wait until the transformer accept the connections
         logger.info("TVB send check")
-        accept = False
-        while not accept:
-            req = comm.irecv(source=0, tag=0)
-            accept = req.wait(status_)
+        exchange.wait_request()
         logger.info("TVB send end simulation")
-        source = status_.Get_source()  # the id of the excepted source
-        times = np.array([0., 0.], dtype='d')  # time of starting and ending step
-        comm.Send([times, MPI.DOUBLE], dest=source, tag=1)
+        exchange.send_end()  # header only
     else:
         logger.info("TVB close connection receive " + port)
-        # send to the transformer : I want the next part
-        req = comm.isend(True, dest=0, tag=1)
-        req.wait()
+        # send to the transformer : I do not want a next part
+        exchange.end()
+    exchange.free()
     # closing the connection at this end
     logger.info("TVB disconnect communication")
     comm.Disconnect()
@@ -0,0 +1,501 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+
+import os
+import sys
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import wait
+from nest_elephant_tvb.transformation.communication.internal import CommunicationInternAbstract
+
+# index of the control variables of the ring
+_HEAD = 0     # number of slots written, only changed by the writer
+_TAIL = 1     # number of slots read, only changed by the reader
+_CLOSED = 2   # the writer ends the communication
+_STOPPED = 3  # the reader ends the communication
+_NB_CONTROL = 4
+
+# environment variables of a process launched by mpirun or srun (Open MPI, PMIx, PMI)
+_LAUNCHER_VARIABLES = ('OMPI_COMM_WORLD_SIZE', 'PMIX_RANK', 'PMI_RANK')
+
+
+def max_events(parameters, nb_sources, rate_factor=1.0):
+    """
+    expected maximum number of events of one synchronization step, the same estimate as the InterscaleHub:
+    number of sources * expected firing rate * time of synchronization, multiplied by a safety factor
+    :param parameters: parameters of the simulation
+    :param nb_sources: number of neurons or of spike generators
+    :param rate_factor: factor of the expected firing rate, e.g. the number of synapses for the spike generators
+    :return: number of events which fit in one slot
+    """
+    rate = parameters.get('expected_firing_rate', 50.0) * rate_factor * 1e-3  # spikes per ms
+    expected = nb_sources * rate * parameters['time_synchronization']
+    nb_events = int(np.ceil(expected * parameters.get('buffer_safety_factor', 4.0)))
+    return max(nb_events, parameters.get('buffer_min_events', 1000))
+
+
+def _attach(name):
+    """
+    attach to an existing shared memory segment without tracking it,
+    the segment is destroyed only by the process which creates it
+    :param name: name of the segment
+    :return: SharedMemory
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # the spawned processes share the resource tracker of the parent process: an unregistration
+    # after the attachment removes the registration of the creator, the registration is skipped
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedMemoryRing:
+    """
+    Ring of buffers in a shared memory segment between a writing process and a reading process
+
+    The segment contains the control variables, the shape and the data of each slot.
+    Only the writer moves the head and only the reader moves the tail, the indices don't need a lock.
+    The processes wait on semaphores (number of free slots and number of written slots),
+    they don't use CPU during the waiting.
+    The ring is created by the parent process before the creation of the processes and
+    it's given in the arguments of the processes, they attach to the segment with its name.
+    """
+
+    def __init__(self, context, data_size, shape_size=1, nb_slots=2):
+        """
+        creation of the shared memory segment
+        :param context: multiprocessing context of the processes
+        :param data_size: number of doubles of each slot
+        :param shape_size: maximum number of values of the shape of the data of a slot
+        :param nb_slots: number of slots, the writer can be this number - 1 steps ahead
+        """
+        if nb_slots < 1:
+            raise Exception('Process Internal : the number of slots need to be positive')
+        self.data_size = data_size
+        self.shape_size = shape_size
+        self.nb_slots = nb_slots
+        self.free = context.Semaphore(nb_slots)  # number of slots ready to be written
+        self.full = context.Semaphore(0)  # number of slots ready to be read
+        self.memory = shared_memory.SharedMemory(create=True, size=self._nb_bytes())
+        self._map()
+        self.control[:] = 0
+
+    def _nb_bytes(self):
+        """
+        size of the segment : control, shapes (integers) and data (doubles)
+        """
+        return (_NB_CONTROL + self.nb_slots * (self.shape_size + 1)) * np.dtype(np.int64).itemsize \
+            + self.nb_slots * self.data_size * np.dtype('d').itemsize
+
+    def _map(self):
+        """
+        arrays on the shared memory segment
+        """
+        buf = self.memory.buf
+        self.control = np.ndarray((_NB_CONTROL,), dtype=np.int64, buffer=buf)
+        offset = self.control.nbytes
+        # first value: number of values of the shape, the shape follows
+        self.shapes = np.ndarray((self.nb_slots, self.shape_size + 1), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self.shapes.nbytes
+        self.data = np.ndarray((self.nb_slots, self.data_size), dtype='d', buffer=buf, offset=offset)
+
+    def __getstate__(self):
+        """
+        only the name of the segment and the semaphores are given to the processes
+        """
+        state = self.__dict__.copy()
+        state['memory'] = self.memory.name
+        del state['control'], state['shapes'], state['data']
+        return state
+
+    def __setstate__(self, state):
+        """
+        attach the process to the segment, without tracking it
+        """
+        self.__dict__.update(state)
+        self.memory = _attach(state['memory'])
+        self._map()
+
+    def reserve(self):
+        """
+        wait for a free slot
+        :return: index of the slot or None if the reader ends the communication
+        """
+        self.free.acquire()
+        if self.control[_STOPPED]:
+            self.free.release()  # the next call ends also
+            return None
+        return int(self.control[_HEAD] % self.nb_slots)
+
+    def commit(self, slot, shape):
+        """
+        give the written slot to the reader
+        :param slot: index of the slot
+        :param shape: shape of the data in the slot
+        """
+        if len(shape) > self.shape_size:
+            raise Exception('Process Internal : shape of the data too long for the ring '
+                            + str(len(shape)) + ' ' + str(self.shape_size))
+        self.shapes[slot, 0] = len(shape)
+        self.shapes[slot, 1:len(shape) + 1] = shape
+        self.control[_HEAD] += 1
+        self.full.release()
+
+    def acquire(self):
+        """
+        wait for a written slot, the slots written before the end are still read
+        :return: index of the slot or None if the writer ends the communication
+        """
+        self.full.acquire()
+        if self.control[_TAIL] == self.control[_HEAD]:  # wake up by the end of the writer
+            self.full.release()  # the next call ends also
+            return None
+        return int(self.control[_TAIL] % self.nb_slots)
+
+    def shape(self, slot):
+        """
+        shape of the data of a slot
+        :param slot: index of the slot
+        :return: list of the values of the shape
+        """
+        return self.shapes[slot, 1:self.shapes[slot, 0] + 1].tolist()
+
+    def release(self, slot):
+        """
+        give back the read slot to the writer
+        :param slot: index of the slot
+        """
+        self.control[_TAIL] += 1
+        self.free.release()
+
+    def close(self):
+        """
+        the writer ends the communication
+        """
+        self.control[_CLOSED] = 1
+        self.full.release()
+
+    def stop(self):
+        """
+        the reader ends the communication
+        """
+        self.control[_STOPPED] = 1
+        self.free.release()
+
+    def detach(self):
+        """
+        detach the process from the segment
+        """
+        del self.control, self.shapes, self.data  # release the views before the closing
+        self.memory.close()
+
+    def unlink(self):
+        """
+        destroy the segment, only by the process which creates it after the end of the other processes
+        """
+        self.memory.unlink()
+
+
+def check_launcher():
+    """
+    the processes are spawned by multiprocessing and each one initialises MPI as a singleton,
+    it's possible only when the parent process is not launched by mpirun or srun: the spawned
+    processes inherit the environment of the launcher and their initialisation of MPI aborts or hangs
+    """
+    launcher = [name for name in _LAUNCHER_VARIABLES if name in os.environ]
+    if launcher:
+        raise Exception('Process Internal : the processes can not initialise MPI under mpirun or srun ('
+                        + ', '.join(launcher) + '), start the transformer with python or use the threads')
+
+
+def run_processes(processes, buffers, timeout=10.0):
+    """
+    start the processes and wait for their end, the rings are destroyed at the end
+    When a process fails, the rings are ended for waking up the other processes,
+    the processes still running after the timeout are terminated and an exception is raised.
+    :param processes: processes of the modules
+    :param buffers: SharedMemoryRing between the processes
+    :param timeout: time given to the other processes to end after a failure
+    """
+    for process in processes:
+        process.start()
+    running = list(processes)
+    failed = []
+    while running and not failed:
+        wait([process.sentinel for process in running])
+        for process in [process for process in running if not process.is_alive()]:
+            process.join()
+            running.remove(process)
+            if process.exitcode != 0:
+                failed.append(process)
+    if failed:
+        for buffer in buffers:
+            buffer.stop()  # wake up the writer
+            buffer.close()  # wake up the reader
+        for process in running:
+            process.join(timeout)
+            if process.is_alive():  # waiting outside the rings, e.g. for MPI
+                process.terminate()
+                process.join()
+    for buffer in buffers:
+        buffer.detach()
+        buffer.unlink()
+    if failed:
+        raise Exception('Process Internal : end of the processes with an error '
+                        + ', '.join(process.name + ' ' + str(process.exitcode) for process in failed))
+
+
+def run_process(module, args, karg, path_connection):
+    """
+    entry point of the processes : creation of the module and run it
+    :param module: class of the module
+    :param args: parameters of the module
+    :param karg: other parameters of the module
+    :param path_connection: path for the connection of the module
+    """
+    module(*args, **karg).run(path_connection)
+
+
+class ProcessCommunication(CommunicationInternAbstract):
+    """
+    Class for using processes and shared memory for the internal communication
+    Each module is a process of its own MPI world, the buffers are SharedMemoryRing.
+
+    state of the status of the reader:
+        >= 0 : shape of the buffer
+        -1 : close connection
+    """
+
+    def __init__(self, logger=None, buffer_write=None, buffer_read=None):
+        """
+        initialisation of the communication
+        :param logger: logger for the communication
+        :param buffer_write: SharedMemoryRing for writing
+        :param buffer_read: SharedMemoryRing for reading
+        """
+        super().__init__(logger=logger)
+        self.buffer_write = buffer_write
+        self.slot_write = None  # index of the slot in writing
+        if buffer_write is not None:
+            self.logger.info('Process Internal : write buffer')
+            self.shape_buffer = [0]  # dimension of the data
+        self.buffer_read = buffer_read
+        self.slot_read = None  # index of the slot in reading
+        if buffer_read is not None:
+            self.logger.info('Process Internal : read buffer')
+        self.logger.info('Process Internal : end Process init')
+
+    def finalise(self):
+        """
+        see super class
+        """
+        self.logger.info('Process Internal : finalize')
+        self.databuffer = None
+        for buffer in [self.buffer_write, self.buffer_read]:
+            if buffer is not None:
+                buffer.detach()
+        return True  # each process has its own MPI
+
+    # Management of internal writing buffer
+    def ready_write_buffer(self):
+        """
+        wait until it's ready to write in the buffer
+        :return if the communication is ending
+        """
+        self.logger.info('Process Internal : write(ready) : wait')
+        self.slot_write = self.buffer_write.reserve()
+        self.logger.info('Process Internal : write(ready) : end wait '+str(self.slot_write))
+        if self.slot_write is None:
+            return True
+        self.databuffer = self.buffer_write.data[self.slot_write]
+        self.shape_buffer = [0]  # reinitialise the buffer shape
+        return False
+
+    def end_write_buffer(self):
+        """
+        end to write in the buffer
+        """
+        self.logger.info('Process Internal : write(end) : begin')
+        self.buffer_write.commit(self.slot_write, self.shape_buffer)
+        self.slot_write = None
+        self.logger.info('Process Internal : write(end) : end')
+
+    def release_write_buffer(self):
+        """
+        release writing buffer and send the end of the communication
+        """
+        self.logger.info('Process Internal : write(release) : write buffer')
+        self.buffer_write.close()
+        self.logger.info('Process Internal : write(release) : write buffer end')
+
+    # Management of internal reading buffer
+    def ready_to_read(self):
+        """
+        wait until it's ready to read in the buffer
+        :return: status of the buffer : the shape of the data or [-1] for the ending
+        """
+        self.logger.info('Process Internal : read(ready) : buffer wait')
+        self.slot_read = self.buffer_read.acquire()
+        self.logger.info('Process Internal : read(ready) : buffer end '+str(self.slot_read))
+        if self.slot_read is None:
+            return [-1]
+        self.databuffer = self.buffer_read.data[self.slot_read]
+        return self.buffer_read.shape(self.slot_read)
+
+    def end_read(self):
+        """
+        end to read in the buffer
+        """
+        self.logger.info('Process Internal : read(end) : begin '+str(self.slot_read))
+        if self.slot_read is not None:
+            self.buffer_read.release(self.slot_read)
+            self.slot_read = None
+        self.logger.info('Process Internal : read(end) : end')
+
+    def release_read_buffer(self):
+        """
+        release reading buffer and send the end of the communication
+        """
+        self.logger.info('Process Internal : read(release): buffer')
+        self.buffer_read.stop()
+        self.logger.info('Process Internal : read(release): end')
+
+    # Section 1 : spike trains exchange
+    def send_spikes_ready(self):
+        """
+        see super class
+        """
+        self.logger.info("Process Internal : spike(send) : ready send spikes")
+        self.send_spike_exit = self.ready_write_buffer()
+
+    def send_spikes(self):
+        """
+        see super class
+        """
+        self.logger.info("Process Internal : spike(send) : spike send")
+        self.end_write_buffer()
+
+    def send_spikes_trains(self, spike_trains):
+        """
+        see super class
+        """
+        self.logger.info('Process Internal : spike(send) : begin')
+        self.send_spike_exit = self.ready_write_buffer()
+        if self.send_spike_exit:
+            self.logger.info('Process Internal : spike(send) : receive end ')
+            return
+        # create continue data with all spike trains
+        self.shape_buffer = [len(spike_train) for spike_train in spike_trains]
+        data = np.concatenate(spike_trains)
+        if data.shape[0] > self.databuffer.shape[0]:
+            raise Exception('Process Internal : too much spikes for the buffer ' + str(data.shape[0]))
+        self.databuffer[:data.shape[0]] = data
+        self.logger.info('Process Internal : spike(send) : data write')
+        self.end_write_buffer()
+        self.logger.info('Process Internal : spike(send) : end')
+
+    def send_spikes_end(self):
+        """
+        see super class
+        """
+        self.logger.info("Process Internal : spike(end) : end send")
+        self.release_write_buffer()
+
+    def get_spikes(self):
+        """
+        see super class
+        """
+        self.logger.info('Process Internal : spike(get) : begin ')
+        # wait until the data are ready to use
+        self.shape_buffer = self.ready_to_read()
+        if self.shape_buffer[0] == -1:
+            self.logger.info('Process Internal : spike(get) : receive end ')
+            return None
+        # spike trains are views of the shared buffer, valid until the release
+        offsets = np.concatenate(([0], np.cumsum(self.shape_buffer)))
+        return [self.databuffer[offsets[i]:offsets[i + 1]] for i in range(len(self.shape_buffer))]
+
+    def get_spikes_ready(self):
+        """
+        see super class
+        """
+        self.logger.info('Process Internal : spike(ready) : ready get spikes')
+        self.shape_buffer = self.ready_to_read()
+        self.logger.info('Process Internal : spike(ready) : ready to write : ' + str(self.shape_buffer))
+
+    def get_spikes_release(self):
+        """
+        see super class
+        """
+        self.logger.info('Process Internal : spike(release)')
+        self.end_read()
+
+    def get_spikes_end(self):
+        """
+        see super class
+        """
+        self.logger.info('Process Internal : spike(end) : begin')
+        self.release_read_buffer()
+
+    # Section 2 : rate and time exchange
+    def get_time_rate(self):
+        """
+        see super class
+        """
+        self.logger.info("Process Internal : rate(get) : get time rate")
+        self.shape_buffer = self.ready_to_read()
+        if self.shape_buffer[0] == -1:
+            self.logger.info("Process Internal : rate(get) : get exit")
+            self.get_time_rate_exit = True
+            return [self.shape_buffer], None
+        # copy because the rate can be used after the release of the buffer
+        times = np.copy(self.databuffer[:2])
+        rate = np.copy(self.databuffer[2:2 + int(np.prod(self.shape_buffer))]).reshape(self.shape_buffer)
+        self.logger.info("Process Internal : rate(get) : end time :"+str(times))
+        return times, rate
+
+    def get_time_rate_release(self):
+        """
+        see super class
+        """
+        self.logger.info('Process Internal : rate(release)')
+        self.end_read()
+
+    def get_time_rate_end(self):
+        """
+        see super class
+        """
+        self.logger.info('Process Internal : rate(end) : begin')
+        self.release_read_buffer()
+
+    def send_time_rate(self, time_step, rate):
+        """
+        see super class
+        """
+        self.logger.info('Process Internal : rate(send) : begin')
+        self.send_time_rate_exit = self.ready_write_buffer()
+        if self.send_time_rate_exit:
+            self.logger.info('Process Internal : rate(send) : receive end ')
+            return
+        rate = np.asarray(rate)
+        if 2 + rate.size > self.databuffer.shape[0]:
+            raise Exception('Process Internal : too much rates for the buffer ' + str(rate.size))
+        self.shape_buffer = list(rate.shape)
+        self.databuffer[:2] = time_step
+        self.databuffer[2:2 + rate.size] = rate.ravel()
+        self.logger.info('Process Internal : rate(send) : time :'+str(time_step))
+        self.end_write_buffer()
+        self.logger.info('Process Internal : rate(send) : end')
+
+    def send_time_rate_end(self):
+        """
+        see super class
+        """
+        self.logger.info("Process Internal : rate(end) : begin "+str(not self.send_time_rate_exit))
+        if not self.send_time_rate_exit:
+            self.release_write_buffer()
+        self.logger.info("Process Internal : rate(end) : end")
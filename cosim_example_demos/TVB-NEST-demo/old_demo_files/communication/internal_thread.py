@@ -2,57 +2,136 @@
 # "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
 
 import numpy as np
-import time
-from threading import Lock, BoundedSemaphore
+from collections import deque
+from threading import Condition, BoundedSemaphore
 from nest_elephant_tvb.transformation.communication.internal import CommunicationInternAbstract
 
 _final_barrier = BoundedSemaphore(2)  # n-1 thread # improvement be include in the class
 
 
+class ThreadBuffer:
+    """
+    Bounded queue of buffers between a writing thread and a reading thread
+
+    The threads wait on a condition variable, they don't use CPU during the waiting.
+    The writer can fill a slot when the reader reads another one, the writer can be
+    (number of slots - 1) steps ahead of the reader.
+    """
+
+    def __init__(self, shape, dtype, nb_slots=2):
+        """
+        initialisation of the slots
+        :param shape: shape of the buffer of each slot
+        :param dtype: datatype of the buffers
+        :param nb_slots: number of slots of the queue
+        """
+        if nb_slots < 1:
+            raise Exception('Thread Internal : the number of slots need to be positive')
+        self.data = [np.empty(shape, dtype=dtype) for i in range(nb_slots)]  # data of each slot
+        self.shape = [None] * nb_slots  # dimension of the data of each slot
+        self.free = deque(range(nb_slots))  # slots ready to be written
+        self.full = deque()  # slots ready to be read, in the order of writing
+        self.closed = False  # the writer ends the communication
+        self.stopped = False  # the reader ends the communication
+        self.condition = Condition()
+
+    def reserve(self):
+        """
+        wait for a free slot
+        :return: index of the slot or None if the reader ends the communication
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.free or self.stopped)
+            if self.stopped:
+                return None
+            return self.free.popleft()
+
+    def commit(self, slot, shape):
+        """
+        give a written slot to the reader
+        :param slot: index of the slot
+        :param shape: dimension of the data in the slot
+        """
+        with self.condition:
+            self.shape[slot] = shape
+            if self.stopped:
+                self.free.append(slot)  # nobody to read it
+            else:
+                self.full.append(slot)
+            self.condition.notify_all()
+
+    def acquire(self):
+        """
+        wait for a written slot, the slots written before the end are still read
+        :return: index of the slot or None if the writer ends the communication
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.full or self.closed)
+            if self.full:
+                return self.full.popleft()
+            return None
+
+    def release(self, slot):
+        """
+        give back a read slot to the writer
+        :param slot: index of the slot
+        """
+        with self.condition:
+            self.free.append(slot)
+            self.condition.notify_all()
+
+    def close(self):
+        """
+        the writer ends the communication
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def stop(self):
+        """
+        the reader ends the communication
+        """
+        with self.condition:
+            self.stopped = True
+            self.full.clear()
+            self.condition.notify_all()
+
+
 class ThreadCommunication(CommunicationInternAbstract):
     """
     Class for using thread for the internal communication
 
-    state of the status:
+    The buffers are shared with a ThreadBuffer : the writer creates it and
+    the reader gets it from the writer.
+    state of the status of the reader:
         >= 0 : shape of the buffer
         -1 : close connection
-        -2 : end to read buffer
     """
-    # can be improve with condition and semaphore or event :
-    # https://hackernoon.com/synchronization-primitives-in-python-564f89fee732
 
     def __init__(self, logger=None,
-                 buffer_write_shape=None, buffer_write_type=np.float, buffer_write_status=None,
-                 buffer_read=None, status_read=None, lock_read=None):
+                 buffer_write_shape=None, buffer_write_type=float, buffer_write_slots=2,
+                 buffer_read=None):
         """
         initialisation of the thread
         :param logger: logger for the communication
         :param buffer_write_shape: shape of the buffer
         :param buffer_write_type: datatype of buffer
-        :param buffer_write_status: initialisation of the status of buffer
-        :param buffer_read: variable of the shared writing buffer
-        :param status_read: status of a writing buffer
-        :param lock_read: locker of a writing buffer
+        :param buffer_write_slots: number of buffers, the writer can be this number - 1 steps ahead
+        :param buffer_read: ThreadBuffer of the writer of the reading buffer
         """
         super().__init__(logger=logger)
         # set variable if reading buffer is used
-        if buffer_read is not None and status_read is not None and lock_read is not None:
+        if buffer_read is not None:
             self.logger.info('Thread Internal : read buffer')
-            self.buffer_read_data = buffer_read  # variable contains reading buffer
-            self.status_read = status_read       # status of read buffer and it can contain the dimension of the data
-            self.lock_read = lock_read           # lock for write in the status
-        elif buffer_read is not None or status_read is not None or lock_read is not None:
-            raise Exception('Thread Internal : missing parameter for using reading buffer')
+            self.buffer_read = buffer_read  # shared buffer with the writer
+            self.slot_read = None           # index of the slot in reading
         # set variable if writing buffer is used
-        if buffer_write_shape is not None and buffer_write_status is not None:
+        if buffer_write_shape is not None:
             self.logger.info('Thread Internal : write buffer')
-            self.databuffer = np.empty(buffer_write_shape, dtype=buffer_write_type)  # create buffer
-            self.buffer_write_data = [self.databuffer]  # variable for shared buffer
-            self.status_write = [buffer_write_status]   # status of buffer and contains the dimension of the data
-            self.lock_write = Lock()                    # lock for write in the status
-            self.shape_buffer = [0]                     # dimension of the data
-        elif buffer_write_shape is not None or buffer_write_status is not None:
-            raise Exception('missing parameter for using writing buffer')
+            self.buffer_write = ThreadBuffer(buffer_write_shape, buffer_write_type, buffer_write_slots)
+            self.slot_write = None  # index of the slot in writing
+            self.shape_buffer = [0]  # dimension of the data
         self.logger.info('Thread Internal : end Thread init')
 
     def finalise(self):
@@ -69,70 +148,64 @@ class ThreadCommunication(CommunicationInternAbstract):
         wait until it's ready to write in the buffer
         :return if the communication is ending
         """
-        self.logger.info('Thread Internal : write(ready) : wait '+str(self.status_write[0][0]))
-        while self.status_write[0][0] >= 0:  # wait to write
-            time.sleep(0.001)
-        self.logger.info('Thread Internal : write(ready) : end wait '+str(self.shape_buffer))
+        self.logger.info('Thread Internal : write(ready) : wait')
+        self.slot_write = self.buffer_write.reserve()
+        self.logger.info('Thread Internal : write(ready) : end wait '+str(self.slot_write))
+        if self.slot_write is None:
+            return True
+        self.databuffer = self.buffer_write.data[self.slot_write]
         self.shape_buffer = [0]  # reinitialise the buffer shape
-        return self.status_write[0][0] == -1
+        return False
 
     def end_write_buffer(self):
         """
         end to write in the buffer
         """
         self.logger.info('Thread Internal : write(end) : begin')
-        self.buffer_write_data[0] = self.databuffer  # pass the buffer in the shared variable
-        with self.lock_write:
-            if self.status_write[0][0] != -1:
-                self.status_write[0] = self.shape_buffer  # pass the dimension of the buffer
-            else:
-                self.logger('Thread Internal : write(end) : finish')
+        self.buffer_write.data[self.slot_write] = self.databuffer  # pass the buffer in the shared variable
+        self.buffer_write.commit(self.slot_write, self.shape_buffer)  # pass the dimension of the buffer
+        self.slot_write = None
         self.logger.info('Thread Internal : write(end) : end')
 
     def release_write_buffer(self):
         """
         release writing buffer and send the end of the communication
         """
-        self.logger.info('Thread Internal : write(release) : write buffer '+str(self.status_write[0][0]))
-        while self.status_write[0][0] >= 0:  # wait before change the buffer
-            time.sleep(0.001)
-        with self.lock_write:
-            self.status_write[0][0] = -1  # Close connection
-        self.logger.info('Thread Internal : write(release) : write buffer end '+str(self.status_write[0][0]))
+        self.logger.info('Thread Internal : write(release) : write buffer')
+        self.buffer_write.close()  # Close connection
+        self.logger.info('Thread Internal : write(release) : write buffer end')
 
     # Management of internal reading buffer
     def ready_to_read(self):
         """
         wait until it's ready to read in the buffer
-        :return: if the communication is ending
-        """
-        self.logger.info('Thread Internal : read(ready) : buffer wait '+str(self.status_read[0][0]))
-        while self.status_read[0][0] == -2:  # wait the end of reading buffer
-            time.sleep(0.001)
-        self.logger.info('Thread Internal : read(ready) : buffer end '+str(self.status_read[0][0]))
-        self.databuffer = self.buffer_read_data[0]  # write in the buffer
-        return self.status_read[0]  # return status
+        :return: status of the buffer : the shape of the data or [-1] for the ending
+        """
+        self.logger.info('Thread Internal : read(ready) : buffer wait')
+        self.slot_read = self.buffer_read.acquire()
+        self.logger.info('Thread Internal : read(ready) : buffer end '+str(self.slot_read))
+        if self.slot_read is None:
+            return [-1]
+        self.databuffer = self.buffer_read.data[self.slot_read]  # read in the buffer
+        return self.buffer_read.shape[self.slot_read]  # return status
 
     def end_read(self):
         """
         end to read in the buffer
         """
-        self.logger.info('Thread Internal : read(end) : begin '+str(self.status_read[0][0]))
-        with self.lock_read:
-            if self.status_read[0][0] != -1:
-                self.status_read[0][0] = -2  # end the reading of the buffer
-        self.logger.info('Thread Internal : read(end) : buffer end '+str(self.status_read[0][0]))
+        self.logger.info('Thread Internal : read(end) : begin '+str(self.slot_read))
+        if self.slot_read is not None:
+            self.buffer_read.release(self.slot_read)  # end the reading of the buffer
+            self.slot_read = None
+        self.logger.info('Thread Internal : read(end) : buffer end')
 
     def release_read_buffer(self):
         """
         release reading buffer and send the end of the communication
         """
-        self.logger.info('Thread Internal : read(release): buffer '+str(self.status_read[0][0]))
-        while self.status_read[0][0] == -2:  # wait until the written is ending
-            time.sleep(0.001)
-        with self.lock_read:
-            self.status_read[0][0] = -1  # close the connection
-        self.logger.info('Thread Internal : read(release): read buffer unlock '+str(self.status_read[0][0]))
+        self.logger.info('Thread Internal : read(release): buffer')
+        self.buffer_read.stop()  # close the connection
+        self.logger.info('Thread Internal : read(release): read buffer unlock')
 
     # Section 1 : spike trains exchange
     def send_spikes_ready(self):
@@ -169,7 +242,7 @@ class ThreadCommunication(CommunicationInternAbstract):
         self.shape_buffer = data_shape
         # special case for empty data
         if len(data) != 0:
-            self.databuffer[:data.shape[0]] = data
+            self.databuffer.reshape(-1)[:data.shape[0]] = data
         self.logger.info('Thread Internal : spike(send) : data write')
         self.end_write_buffer()
         self.logger.info('Thread Internal : spike(send) : end')
@@ -238,9 +311,9 @@ class ThreadCommunication(CommunicationInternAbstract):
             self.logger.info("Thread Internal : rate(get) : get exit")
             self.get_time_rate_exit = True
             return [self.shape_buffer], None
-        times = self.buffer_read_data[0][0]
+        times = self.databuffer[0]
         self.logger.info("Thread Internal : rate(get) : data request : time :"+str(times))
-        rate = self.buffer_read_data[0][1]
+        rate = self.databuffer[1]
         self.logger.info("Thread Internal : rate(get) : end")
         return times, rate
 
@@ -272,7 +345,6 @@ class ThreadCommunication(CommunicationInternAbstract):
             return
         self.shape_buffer = [time_step.shape[0]]
         self.logger.info('Thread Internal : rate(send) : time :'+str(time_step))
-        self.logger.info('Thread Internal : rate(send) : buffer :'+str(np.array(self.databuffer).shape))
         self.databuffer = [time_step, rate]
         self.logger.info('Thread Internal : rate(send) : data write')
         self.end_write_buffer()
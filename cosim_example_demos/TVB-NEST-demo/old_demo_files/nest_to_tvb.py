@@ -70,15 +70,48 @@ if __name__ == "__main__":
             transformation.run(None)
         else:
             raise Exception('too much rank')
+    elif MPI.COMM_WORLD.Get_size() == 1 and parameters.get('internal_communication', 'thread') == 'process':
+        # Process internal communication : shared memory between processes
+        import multiprocessing
+        from nest_elephant_tvb.transformation.communication.internal_process import \
+            ProcessCommunication, SharedMemoryRing, run_process, run_processes, check_launcher, max_events
+
+        # each process has its own MPI, only when the transformer is not launched by mpirun
+        check_launcher()
+        context = multiprocessing.get_context('spawn')
+        # buffer for the spikes from Nest and buffer for the times and rates to TVB,
+        # [id_device, id_neuron, time] of each spike
+        buffer_spikes = SharedMemoryRing(context, 3 * max_events(parameters, parameters['nb_neurons'][id_transformer]))
+        buffer_rate = SharedMemoryRing(
+            context, 2 + int(parameters['time_synchronization'] / parameters['resolution']) + 1, shape_size=2)
+        path_to_files_receive = [path + file_spike_detector]
+        path_to_files_send = [path + TVB_recev_file]
+
+        # creation of the processes and run them
+        processes = [
+            context.Process(target=run_process, args=(
+                ConsumerNestData, ('nest_to_tvb_receive' + str(id_spike_detector), path, level_log),
+                {'communication_intern': ProcessCommunication, 'buffer_write': buffer_spikes},
+                path_to_files_receive)),
+            context.Process(target=run_process, args=(
+                TransformationSpikeRate, (id_transformer, parameters,
+                                          'nest_to_tvb_transform' + str(id_spike_detector), path, level_log),
+                {'communication_intern': ProcessCommunication,
+                 'buffer_read': buffer_spikes, 'buffer_write': buffer_rate},
+                None)),
+            context.Process(target=run_process, args=(
+                ProducerTVBData, ('nest_to_tvb_send' + str(id_spike_detector), path, level_log),
+                {'communication_intern': ProcessCommunication, 'buffer_read': buffer_rate},
+                path_to_files_send)),
+        ]
+        run_processes(processes, [buffer_spikes, buffer_rate])
     elif MPI.COMM_WORLD.Get_size() == 1:  # Thread internal communication
         from threading import Thread
-        import numpy as np
 
         # creation of the object for Nest communication
         receive_data_from_nest = ConsumerNestData(
             'nest_to_tvb_receive' + str(id_spike_detector), path, level_log,
             communication_intern=ThreadCommunication,
-            buffer_write_status=np.ones((1, 1), dtype=int) * -2,
             buffer_write_shape=(1000000 * 3, 1),
         )
         path_to_files_receive = [path + file_spike_detector]
@@ -87,19 +120,14 @@ if __name__ == "__main__":
             id_transformer, parameters,
             'nest_to_tvb_transform' + str(id_spike_detector), path, level_log,
             communication_intern=ThreadCommunication,
-            buffer_write_status=np.ones(1) * -2,
             buffer_write_shape=(2, int(parameters['time_synchronization'] / parameters['resolution'])),
-            buffer_read=receive_data_from_nest.communication_internal.buffer_write_data,
-            status_read=receive_data_from_nest.communication_internal.status_write,
-            lock_read=receive_data_from_nest.communication_internal.lock_write
+            buffer_read=receive_data_from_nest.communication_internal.buffer_write
         )
         # creation of the object for TVB communication
         send_data_to_TVB = ProducerTVBData(
             'nest_to_tvb_send' + str(id_spike_detector), path, level_log,
             communication_intern=ThreadCommunication,
-            buffer_read=transformation.communication_internal.buffer_write_data,
-            status_read=transformation.communication_internal.status_write,
-            lock_read=transformation.communication_internal.lock_write
+            buffer_read=transformation.communication_internal.buffer_write
         )
         path_to_files_send = [path + TVB_recev_file]
 
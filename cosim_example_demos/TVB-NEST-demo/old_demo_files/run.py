@@ -191,5 +191,8 @@ if __name__ == "__main__":
         'id_first_neurons': [1],
         "save_spikes": True,
         "save_rate": True,
+        # internal communication of the transformers on 1 rank : 'thread' or 'process' (shared memory),
+        # 'process' only for a transformer started with python, not with mpirun or srun
+        "internal_communication": 'thread',
     })
     run(parameter_co_simulation)
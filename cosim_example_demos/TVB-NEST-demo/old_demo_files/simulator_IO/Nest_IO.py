@@ -20,7 +20,8 @@ class ConsumerNestData(MPICommunicationExtern):
         status_ = MPI.Status()
         num_sending = self.port_comms[0].Get_remote_size()  # The total number of the rank in Nest MPI_COMM_WORLD
         check = np.empty(1, dtype='b')  # variable to get the state of Nest
-        shape = np.empty(1, dtype='i')  # variable to receive the shape of the data
+        ready = np.array(True, dtype='b')  # variable to send the state of the consumer
+        shapes = np.empty(num_sending, dtype='i')  # variable to receive the shape of the data of each rank
         count = 0  # count the number of run
         while True:
             self.logger.info("Consumer Nest : loop start : wait all")
@@ -41,16 +42,28 @@ class ConsumerNestData(MPICommunicationExtern):
                     break
 
                 self.logger.info("Consumer Nest : start get data")
+                # send 'ready' to all the nest ranks and receive the package sizes at once
+                requests = []
                 for source in range(num_sending):
-                    # send 'ready' to the nest rank
-                    self.port_comms[0].Send([np.array(True, dtype='b'), MPI.BOOL], dest=source, tag=0)
-                    # receive package size info
-                    self.port_comms[0].Recv([shape, 1, MPI.INT], source=source, tag=0, status=status_)
-                    self.logger.info("Consumer Nest : shape : "+str(self.communication_internal.shape_buffer))
-                    # Add data in the buffer
-                    self.port_comms[0].Recv([self.communication_internal.databuffer[self.communication_internal.shape_buffer[0]:], MPI.DOUBLE],
-                                            source=source, tag=0, status=status_)
-                    self.communication_internal.shape_buffer[0] += shape[0]  # move head
+                    requests.append(self.port_comms[0].Isend([ready, MPI.BOOL], dest=source, tag=0))
+                    requests.append(self.port_comms[0].Irecv([shapes[source:source + 1], MPI.INT], source=source, tag=0))
+                MPI.Request.Waitall(requests)
+                # offset of the data of each rank in the buffer
+                offsets = self.communication_internal.shape_buffer[0] + np.concatenate(([0], np.cumsum(shapes)))
+                self.logger.info("Consumer Nest : shape : " + str(offsets[-1]))
+                # the buffer is sized from the expected rate, the spikes of the step need to fit in it
+                if offsets[-1] > self.communication_internal.databuffer.shape[0]:
+                    raise Exception('Consumer Nest : too much spikes for the buffer ' + str(offsets[-1]) + ' > '
+                                    + str(self.communication_internal.databuffer.shape[0])
+                                    + ', increase buffer_safety_factor or buffer_min_events of the parameters')
+                # Add data in the buffer, all the ranks concurrently
+                requests = []
+                for source in range(num_sending):
+                    requests.append(self.port_comms[0].Irecv(
+                        [self.communication_internal.databuffer[offsets[source]:offsets[source + 1]], MPI.DOUBLE],
+                        source=source, tag=0))
+                MPI.Request.Waitall(requests)
+                self.communication_internal.shape_buffer[0] = offsets[-1]  # move head
                 self.logger.info("Consumer Nest : end receive data")
 
                 # INTERNAL : end to write in the buffer
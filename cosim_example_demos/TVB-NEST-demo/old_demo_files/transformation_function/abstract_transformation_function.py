@@ -3,6 +3,7 @@
 
 import numpy as np
 from nest_elephant_tvb.transformation.communication.mpi_io_external import MPICommunicationExtern
+from nest_elephant_tvb.transformation.transformation_function.recorder import Recorder
 
 
 class AbstractTransformationSpikeRate(MPICommunicationExtern):
@@ -23,13 +24,13 @@ class AbstractTransformationSpikeRate(MPICommunicationExtern):
         self.time_synch = param['time_synchronization']  # time of synchronization between 2 run
         self.dt = param['resolution']  # the resolution of the integrator
         self.path = param['path'] + "/transformation/"
-        # variable for saving values:
+        # variable for saving values: written on disk during the simulation
         self.save_spikes = bool(param['save_spikes'])
         if self.save_spikes:
-            self.save_spikes_buf = None
+            self.save_spikes_buf = Recorder(self.path + '/spikes_' + str(self.id) + '.npy')
         self.save_rate = bool(param['save_rate'])
         if self.save_rate:
-            self.save_rate_buf = None
+            self.save_rate_buf = Recorder(self.path + '/rates_' + str(self.id) + '.npy')
 
     def simulation_time(self):
         """
@@ -58,14 +59,8 @@ class AbstractTransformationSpikeRate(MPICommunicationExtern):
 
             # optional : save spikes
             if self.save_spikes:
-                if self.save_spikes_buf is None:
-                    self.save_spikes_buf = \
-                        np.copy(self.communication_internal.databuffer[:self.communication_internal.shape_buffer[0]])
-                else:
-                    self.save_spikes_buf = \
-                        np.concatenate((self.save_spikes_buf,
-                                        np.copy(self.communication_internal.databuffer[
-                                                :self.communication_internal.shape_buffer[0]])))
+                self.save_spikes_buf.record(
+                    self.communication_internal.databuffer[:self.communication_internal.shape_buffer[0]])
 
             # Step 2.1: take all data from buffer and compute rate
             self.logger.info('TSR : add spikes ' + str(self.communication_internal.shape_buffer[0]))
@@ -78,10 +73,7 @@ class AbstractTransformationSpikeRate(MPICommunicationExtern):
 
             # optional : save rate
             if self.save_rate:
-                if self.save_rate_buf is None:
-                    self.save_rate_buf = rate
-                else:
-                    self.save_rate_buf = np.concatenate((self.save_rate_buf, rate))
+                self.save_rate_buf.record(rate)
 
             # Step 3: INTERNAL: send rate and time
             self.logger.info('TSR : send data')
@@ -105,9 +97,9 @@ class AbstractTransformationSpikeRate(MPICommunicationExtern):
         super().finalise()
         # Save the ending part of the simulation
         if self.save_spikes:
-            np.save(self.path + '/spikes_' + str(self.id) + '.npy', self.save_spikes_buf)
+            self.save_spikes_buf.close()
         if self.save_rate:
-            np.save(self.path + '/rates_' + str(self.id) + '.npy', self.save_rate_buf)
+            self.save_rate_buf.close()
 
     def spike_to_rate(self, count, size_buffer, buffer_of_spikes):
         """
@@ -138,13 +130,14 @@ class AbstractTransformationRateSpike(MPICommunicationExtern):
         self.id = id_transformer
         self.nb_spike_generator = nb_spike_generator  # number of spike generator
         self.path = param['path'] + "/transformation/"
-        # variable for saving values:
+        # variable for saving values: written on disk during the simulation, one stream by spike generator
+        # in the same files
         self.save_spike = bool(param['save_spikes'])
         if self.save_spike:
-            self.save_spike_buf = None
+            self.save_spike_buf = Recorder(self.path + '/spike_' + str(self.id) + '.npy', nb_streams=nb_spike_generator)
         self.save_rate = bool(param['save_rate'])
         if self.save_rate:
-            self.save_rate_buf = None
+            self.save_rate_buf = Recorder(self.path + '/rate_' + str(self.id) + '.npy')
         self.logger.info('TRS : end init transformation')
 
     def simulation_time(self):
@@ -171,10 +164,7 @@ class AbstractTransformationRateSpike(MPICommunicationExtern):
 
             # optional :  save the rate
             if self.save_rate:
-                if self.save_rate_buf is None:
-                    self.save_rate_buf = rate
-                else:
-                    self.save_rate_buf = np.concatenate((self.save_rate_buf, rate))
+                self.save_rate_buf.record(rate)
 
             # Step 2: generate spike trains
             # improvement : we can generate other type of data but Nest communication need to be adapted for it
@@ -183,13 +173,7 @@ class AbstractTransformationRateSpike(MPICommunicationExtern):
 
             # optional : save spikes
             if self.save_spike:
-                if self.save_spike_buf is None:
-                    self.save_spike_buf = [spikes for spikes in spike_trains]
-                else:
-                    tmp = []
-                    for index, spikes in enumerate(spike_trains):
-                        tmp.append(np.concatenate((self.save_spike_buf[index], spikes)))
-                    self.save_spike_buf = tmp
+                self.save_spike_buf.record_streams(spike_trains)
 
             # Step 3: send spike trains to Nest
             self.logger.info('TRS : send spike train')
@@ -214,9 +198,9 @@ class AbstractTransformationRateSpike(MPICommunicationExtern):
         super().finalise()
         # Save the ending part of the simulation
         if self.save_rate:
-            np.save(self.path + '/rate_' + str(self.id) + '.npy', self.save_rate_buf)
+            self.save_rate_buf.close()
         if self.save_spike:
-            np.save(self.path + '/spike_' + str(self.id) + '.npy', self.save_spike_buf)
+            self.save_spike_buf.close()
 
     def rate_to_spike(self, count, time_step, rate):
         """
@@ -0,0 +1,153 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+
+import os
+import shutil
+import numpy as np
+from queue import Queue, Full
+from threading import Thread
+
+
+class Recorder:
+    """
+    Append-only recorder of the data of each step in a npy file
+
+    The blocks of data are appended to a temporary file by a background thread,
+    the memory and the cost of each step don't depend on the length of the simulation.
+    With multiple streams, the blocks of all the streams of a step are appended together
+    and their numbers of rows are appended to a second temporary file (compressed sparse rows),
+    the number of files doesn't depend on the number of streams.
+    At the end, the temporary files are converted in the npy file:
+        - 1 stream : concatenation of the blocks along the first axis
+        - multiple streams : array of objects with the concatenation of each stream
+    An error of the writing thread is raised by the next call of record or close.
+    """
+
+    def __init__(self, path, nb_streams=1, max_blocks=64, timeout=1.0):
+        """
+        initialisation of the recorder and start of the writing thread
+        :param path: path of the npy file
+        :param nb_streams: number of independent streams of data
+        :param max_blocks: maximum number of blocks waiting to be written
+        :param timeout: period of the check of the writing thread when the queue is full
+        """
+        self.path = path
+        self.nb_streams = nb_streams
+        self.path_data = path + '.data.tmp'
+        self.path_counts = path + '.counts.tmp'  # number of rows of each stream by step
+        self.dtype = None  # datatype of the data, from the first block
+        self.shape = None  # shape of the blocks without the first axis
+        self.nb_rows = 0  # length of the first axis of the data
+        self.queue = Queue(max_blocks)  # the step waits when the disk is too slow
+        self.timeout = timeout
+        self.error = None  # exception of the writing thread
+        self.thread = Thread(target=self._write, daemon=True)  # doesn't block the exit after an error
+        self.thread.start()
+
+    def record(self, block):
+        """
+        add a block of data at the end of the stream, only for 1 stream
+        :param block: data of the step, copied because the buffers of the communication are reused
+        """
+        if self.nb_streams != 1:
+            raise Exception('Recorder : ' + str(self.nb_streams) + ' streams, use record_streams')
+        self._put((self._format(np.array(block)), None))
+
+    def record_streams(self, blocks):
+        """
+        add a block of data at the end of each stream
+        :param blocks: data of the step, one block by stream
+        """
+        if len(blocks) != self.nb_streams:
+            raise Exception('Recorder : bad number of streams ' + str(len(blocks)) + ' ' + str(self.nb_streams))
+        counts = np.array([len(block) for block in blocks], dtype=np.int64)
+        self._put((self._format(np.concatenate(blocks)), counts))
+
+    def _format(self, block):
+        """
+        check the shape of a block and convert it in the datatype of the data
+        :param block: data of the step
+        :return: the block in the datatype of the data
+        """
+        if self.dtype is None:
+            self.dtype = block.dtype
+            self.shape = block.shape[1:]
+        elif block.shape[1:] != self.shape:
+            raise Exception('Recorder : bad shape of block ' + str(block.shape) + ' ' + str(self.shape))
+        self.nb_rows += block.shape[0]
+        return block.astype(self.dtype, copy=False)
+
+    def _put(self, item):
+        """
+        give an item to the writing thread, without waiting forever for a thread which is ended
+        :param item: item of the queue
+        """
+        while True:
+            self._check()
+            if not self.thread.is_alive():
+                raise Exception('Recorder : the writing thread of ' + self.path + ' is ended')
+            try:
+                self.queue.put(item, timeout=self.timeout)
+                return
+            except Full:
+                pass
+
+    def _check(self):
+        """
+        raise the error of the writing thread
+        """
+        if self.error is not None:
+            raise Exception('Recorder : error of the writing of ' + self.path) from self.error
+
+    def _write(self):
+        """
+        writing thread : append the blocks in the temporary files
+        """
+        files = []
+        try:
+            for path in (self.path_data, self.path_counts):
+                files.append(open(path, 'wb'))
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                block, counts = item
+                files[0].write(block.tobytes())
+                if counts is not None:
+                    files[1].write(counts.tobytes())
+        except BaseException as error:
+            self.error = error  # raised by the next call of record or close
+        finally:
+            for file in files:
+                file.close()
+
+    def close(self):
+        """
+        end of the recording : wait the writing thread and create the npy file
+        """
+        self._put(None)
+        self.thread.join()
+        self._check()
+        dtype = self.dtype if self.dtype is not None else np.dtype('d')
+        shape = (self.nb_rows,) + (self.shape if self.shape is not None else ())
+        if self.nb_streams == 1:
+            # npy header followed by the data, without loading the data in memory
+            with open(self.path, 'wb') as file:
+                np.lib.format.write_array_header_1_0(
+                    file, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape})
+                with open(self.path_data, 'rb') as data:
+                    shutil.copyfileobj(data, file)
+        else:
+            # rows of the blocks (step, stream) in order of stream, then of step
+            counts = np.fromfile(self.path_counts, dtype=np.int64).reshape(-1, self.nb_streams)
+            starts = (np.cumsum(counts) - counts.ravel()).reshape(counts.shape)
+            counts, starts = counts.T.ravel(), starts.T.ravel()
+            rows = np.arange(self.nb_rows) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+            values = np.fromfile(self.path_data, dtype=dtype).reshape(shape)[rows]
+            ends = np.cumsum(counts.reshape(self.nb_streams, -1).sum(axis=1))
+            data = np.empty(self.nb_streams, dtype=object)
+            for i, stream in enumerate(np.split(values, ends[:-1])):
+                data[i] = stream
+            np.save(self.path, data, allow_pickle=True)
+        for path in (self.path_data, self.path_counts):
+            os.remove(path)
@@ -1,13 +1,13 @@
 #  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
 # "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
 import numpy as np
-from neo.core import SpikeTrain, AnalogSignal
-from quantities import ms, Hz
-from elephant.spike_train_generation import inhomogeneous_poisson_process
+from neo.core import SpikeTrain
+from quantities import ms
 from elephant.statistics import instantaneous_rate
 from elephant.kernels import RectangularKernel
 from nest_elephant_tvb.transformation.transformation_function.abstract_transformation_function import \
     AbstractTransformationRateSpike, AbstractTransformationSpikeRate
+from nest_elephant_tvb.Interscale_hub.science import region_poisson_trains
 
 
 class TransformationSpikeRate(AbstractTransformationSpikeRate):
@@ -23,10 +23,43 @@ class TransformationSpikeRate(AbstractTransformationSpikeRate):
         super().__init__(id_transformer, param, *arg, **karg)
         self.nb_neurons = param['nb_neurons'][id_transformer]
         self.first_id = param['id_first_neurons'][id_transformer]
+        self.sampling_period = self.dt - 0.000001
+        # rectangular kernel of elephant: height 1/(2*sqrt(3)*sigma) on |t| < sqrt(3)*sigma
+        self.kernel_sigma = 1.0  # in ms
+        self.kernel_half_width = int(np.ceil(np.sqrt(3.0) * self.kernel_sigma / self.sampling_period)) - 1  # in bins
+        self.kernel_height = 1e3 / (2 * np.sqrt(3.0) * self.kernel_sigma)  # in Hz
 
     def spike_to_rate(self, count, size_buffer, buffer_of_spikes):
         """
         function for the transformation of the spike trains to rate
+        The binning and the rectangular kernel are the ones of elephant.statistics.instantaneous_rate
+        (see spike_to_rate_elephant), computed with NumPy on the histogram of the population:
+        the mean of the rates of the neurons is the rate of the histogram divided by the number of neurons.
+        :param count: counter of the number of time of the transformation (identify the timing of the simulation)
+        :param size_buffer: size of the data in the buffer
+        :param buffer_of_spikes: buffer contains spikes
+        :return: rate for the interval
+        """
+        t_start = np.around(count * self.time_synch, decimals=2)
+        t_stop = np.around((count + 1) * self.time_synch, decimals=2)
+        nb_bins = int((t_stop - t_start) / self.sampling_period)
+        # histogram of the spike times, the buffer contains [id_device, id_neuron, time] of each spike
+        spike_times = np.reshape(buffer_of_spikes[:int(np.rint(size_buffer / 3)) * 3], (-1, 3))[:, 2]
+        index = np.floor((spike_times - t_start) / self.sampling_period).astype(int)
+        index = index[(index >= 0) & (index < nb_bins)]
+        cumulative = np.zeros(nb_bins + 1)
+        np.cumsum(np.bincount(index, minlength=nb_bins), out=cumulative[1:])
+        # convolution with the rectangular kernel: sum of the bins in the support of the kernel
+        bins = np.arange(nb_bins)
+        window = cumulative[np.minimum(bins + self.kernel_half_width + 1, nb_bins)] \
+            - cumulative[np.maximum(bins - self.kernel_half_width, 0)]
+        rate = window * (self.kernel_height / self.nb_neurons / 10)  # the division by 10 ia an adaptation for the model of TVB
+        times = np.array([count * self.time_synch, (count + 1) * self.time_synch], dtype='d')
+        return times, rate
+
+    def spike_to_rate_elephant(self, count, size_buffer, buffer_of_spikes):
+        """
+        reference of the transformation of the spike trains to rate, with neo and elephant
         :param count: counter of the number of time of the transformation (identify the timing of the simulation)
         :param size_buffer: size of the data in the buffer
         :param buffer_of_spikes: buffer contains spikes
@@ -36,7 +69,7 @@ class TransformationSpikeRate(AbstractTransformationSpikeRate):
         rates = instantaneous_rate(spikes_neurons,
                                    t_start=np.around(count * self.time_synch, decimals=2) * ms,
                                    t_stop=np.around((count + 1) * self.time_synch, decimals=2) * ms,
-                                   sampling_period=(self.dt - 0.000001) * ms, kernel=RectangularKernel(1.0 * ms))
+                                   sampling_period=self.sampling_period * ms, kernel=RectangularKernel(self.kernel_sigma * ms))
         rate = np.mean(rates, axis=1) / 10  # the division by 10 ia an adaptation for the model of TVB
         times = np.array([count * self.time_synch, (count + 1) * self.time_synch], dtype='d')
         return times, rate
@@ -57,7 +90,7 @@ class TransformationSpikeRate(AbstractTransformationSpikeRate):
             spikes_neurons[id_neurons - self.first_id].append(time_step)
         for i in range(self.nb_neurons):
             if len(spikes_neurons[i]) != 0:
-                spikes_neurons[i] = SpikeTrain(np.concatenate(spikes_neurons[i]) * ms,
+                spikes_neurons[i] = SpikeTrain(np.hstack(spikes_neurons[i]) * ms,
                                                t_start=np.around(count * self.time_synch, decimals=2),
                                                t_stop=np.around((count + 1) * self.time_synch, decimals=2) + 0.0001)
             else:
@@ -74,6 +107,11 @@ class TransformationRateSpike(AbstractTransformationRateSpike):
     def __init__(self, id_translator, param, nb_spike_generator, *arg, **karg):
         super().__init__(id_translator, param, nb_spike_generator, *arg, **karg)
         self.nb_synapse = param["nb_brain_synapses"]
+        self.dt = param['resolution']  # the resolution of NEST
+        # the random streams are derived from the root seed by region and step, as in the InterscaleHub:
+        # the region of the transformer is its id (see region_poisson_trains)
+        self.seed = param.get("seed", 125)
+        self.region = id_translator
 
     def rate_to_spike(self, count, time_step, rate):
         """
@@ -86,12 +124,14 @@ class TransformationRateSpike(AbstractTransformationRateSpike):
         # Single Interaction Process Model
         # Compute the rate to spike trains
         rate *= self.nb_synapse  # rate of poisson generator ( due property of poisson process)
-        rate += 1e-12
-        rate = np.abs(rate)  # avoid rate equals to zeros
-        signal = AnalogSignal(rate * Hz, t_start=(time_step[0] + 0.1) * ms,
-                              sampling_period=(time_step[1] - time_step[0]) / rate.shape[-1] * ms)
-        spike_generate = []
-        for i in range(self.nb_spike_generator):
-            # generate individual spike trains
-            spike_generate.append(np.around(np.sort(inhomogeneous_poisson_process(signal, as_array=True)), decimals=1))
-        return spike_generate
+        rate = np.abs(rate)
+        rate += 1e-12  # avoid rate equals to zeros
+        # the spike trains of all the spike generators in one pass, in a flat layout,
+        # in integer time steps of NEST: the first time step after the start, time steps by bin
+        start = int(np.rint(time_step[0] / self.dt)) + 1
+        bin_steps = max(int(np.rint((time_step[1] - time_step[0]) / self.dt / rate.shape[-1])), 1)
+        ticks, offsets = region_poisson_trains(rate, self.nb_spike_generator, 0, self.nb_spike_generator,
+                                               start, bin_steps, self.dt, self.seed, self.region)
+        # individual spike trains in ms for NEST, views of the flat array
+        return np.split(ticks * self.dt, offsets[1:-1])
+
@@ -81,15 +81,56 @@ if __name__ == "__main__":
             transform_rate_to_spike.run(None)
         else:
             raise Exception('too much rank')
+    elif MPI.COMM_WORLD.Get_size() == 1 and parameters.get('internal_communication', 'thread') == 'process':
+        # Process internal communication : shared memory between processes
+        import multiprocessing
+        from nest_elephant_tvb.transformation.communication.internal_process import \
+            ProcessCommunication, SharedMemoryRing, run_process, run_processes, check_launcher, max_events
+
+        # each process has its own MPI, only when the transformer is not launched by mpirun
+        check_launcher()
+        context = multiprocessing.get_context('spawn')
+        # buffer for the times and rates from TVB and buffer for the spike trains to Nest
+        buffer_rate = SharedMemoryRing(
+            context, 2 + int(parameters['time_synchronization'] / parameters['resolution']) + 1, shape_size=2)
+        # the spike generators fire at the rate of TVB multiplied by the number of synapses
+        buffer_spikes = SharedMemoryRing(
+            context, max_events(parameters, nb_spike_generator, parameters['nb_brain_synapses']),
+            shape_size=nb_spike_generator)
+        path_to_files_receive = [path + "/transformation/receive_from_tvb/" + str(id_proxy[id_transformer]) + ".txt"]
+        path_to_files_sends = []
+        for i in range(nb_spike_generator):
+            # write file with port and unlock
+            path_to_files_send = os.path.join(path + "/transformation/spike_generator/",
+                                              str(id_first_spike_detector + i) + ".txt")
+            path_to_files_sends.append(path_to_files_send)
+
+        # creation of the processes and run them
+        processes = [
+            context.Process(target=run_process, args=(
+                ConsumerTVBData, ('tvb_to_nest_receiver' + str(id_first_spike_detector), path, level_log),
+                {'communication_intern': ProcessCommunication, 'buffer_write': buffer_rate},
+                path_to_files_receive)),
+            context.Process(target=run_process, args=(
+                TransformationRateSpike, (id_transformer, parameters, nb_spike_generator,
+                                          'tvb_to_nest_transform' + str(id_first_spike_detector), path, level_log),
+                {'communication_intern': ProcessCommunication,
+                 'buffer_read': buffer_rate, 'buffer_write': buffer_spikes},
+                None)),
+            context.Process(target=run_process, args=(
+                ProducerDataNest, (id_first_spike_detector,
+                                   'tvb_to_nest_sender' + str(id_first_spike_detector), path, level_log),
+                {'communication_intern': ProcessCommunication, 'buffer_read': buffer_spikes},
+                path_to_files_sends)),
+        ]
+        run_processes(processes, [buffer_rate, buffer_spikes])
     elif MPI.COMM_WORLD.Get_size() == 1:  # Thread internal communication
         from threading import Thread
-        import numpy as np
 
         # creation of the object for TVB communication
         receive_data_to_TVB = ConsumerTVBData(
             'tvb_to_nest_receiver' + str(id_first_spike_detector), path, level_log,
             communication_intern=ThreadCommunication,
-            buffer_write_status=np.ones(1) * -2,
             buffer_write_shape=(2, 2),
         )
         path_to_files_receive = [path + "/transformation/receive_from_tvb/" + str(id_proxy[id_transformer]) + ".txt"]
@@ -98,20 +139,15 @@ if __name__ == "__main__":
             id_transformer, parameters, nb_spike_generator,
             'tvb_to_nest_transform' + str(id_first_spike_detector), path, level_log,
             communication_intern=ThreadCommunication,
-            buffer_write_status=np.ones((1, 1), dtype=int) * -2,
             buffer_write_shape=(1000000 * 3, 1),
-            buffer_read=receive_data_to_TVB.communication_internal.buffer_write_data,
-            status_read=receive_data_to_TVB.communication_internal.status_write,
-            lock_read=receive_data_to_TVB.communication_internal.lock_write
+            buffer_read=receive_data_to_TVB.communication_internal.buffer_write
         )
         # creation of the object for Nest communication
         send_data_to_Nest = ProducerDataNest(
             id_first_spike_detector,
             'tvb_to_nest_sender' + str(id_first_spike_detector), path, level_log,
             communication_intern=ThreadCommunication,
-            buffer_read=transform_rate_to_spike.communication_internal.buffer_write_data,
-            status_read=transform_rate_to_spike.communication_internal.status_write,
-            lock_read=transform_rate_to_spike.communication_internal.lock_write
+            buffer_read=transform_rate_to_spike.communication_internal.buffer_write
         )
         path_to_files_sends = []
         for i in range(nb_spike_generator):
@@ -0,0 +1,22 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+import os
+import sys
+import types
+
+# the folder of the demo for the package nest_elephant_tvb, and the folder of the
+# package for the modules of the InterscaleHub which import each other as Interscale_hub.*,
+# the last one after the installed packages: its folder tvb is not the package of TVB
+PATH_DEMO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PATH_DEMO not in sys.path:
+    sys.path.insert(0, PATH_DEMO)
+if os.path.join(PATH_DEMO, 'nest_elephant_tvb') not in sys.path:
+    sys.path.append(os.path.join(PATH_DEMO, 'nest_elephant_tvb'))
+
+# the old demo imports itself as nest_elephant_tvb.transformation, the package of its folder
+import nest_elephant_tvb  # noqa: E402
+if 'nest_elephant_tvb.transformation' not in sys.modules:
+    transformation = types.ModuleType('nest_elephant_tvb.transformation')
+    transformation.__path__ = [os.path.join(PATH_DEMO, 'old_demo_files')]
+    sys.modules['nest_elephant_tvb.transformation'] = transformation
+    nest_elephant_tvb.transformation = transformation
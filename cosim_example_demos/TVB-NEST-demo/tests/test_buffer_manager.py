@@ -0,0 +1,70 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+import os
+import shutil
+import subprocess
+import sys
+import traceback
+import numpy as np
+import pytest
+
+# the handoff needs distinct ranks for the writer and the readers: this file is run with mpirun by the tests
+MPIRUN = shutil.which('mpirun')
+
+
+def _handoff(nb_slots, sizes):
+    """
+    one writer (rank 0) and 2 readers (ranks 1 and 2, the lead reader is rank 1),
+    a simulation step by size, the slots of 4 doubles grow for the larger steps
+    :param nb_slots: number of slots of the ring
+    :param sizes: number of doubles written at each step
+    """
+    from mpi4py import MPI
+    from Interscale_hub.BufferManager import BufferManager
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    buffer = BufferManager(comm, 4, writer_rank=0, reader_ranks=[1, 2], nb_slots=nb_slots)
+    readers = comm.Split(MPI.UNDEFINED if rank == 0 else 0, rank)
+    for step, size in enumerate(sizes):
+        if rank == 0:
+            buffer.wait_for_writing()
+            slot = buffer.reserve(size, 0)
+            slot[:size] = step
+            buffer.end_writing(size)
+        else:
+            slot, head = buffer.wait_for_reading()
+            assert head == size
+            assert np.all(slot[:head] == step)
+            # the lead reader clears the slot when all the readers are done
+            readers.Barrier()
+            buffer.end_reading()
+    assert buffer.slot_size >= max(sizes)
+    buffer.close()
+    comm.Barrier()
+    # no wakeup is left pending after the end of the handoff
+    assert not comm.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG)
+
+
+@pytest.mark.skipif(MPIRUN is None, reason='mpirun is not available')
+@pytest.mark.parametrize('nb_slots, sizes', [(1, [1, 2, 3, 4]),
+                                             (2, [3, 1, 4, 4, 2, 1, 3]),
+                                             (2, [2, 9, 1, 30, 4, 4, 2]),
+                                             (3, [4, 1, 2, 3, 4, 1, 2, 3, 4])])
+def test_handoff(nb_slots, sizes):
+    pytest.importorskip('mpi4py')
+    env = dict(os.environ, OMPI_ALLOW_RUN_AS_ROOT='1', OMPI_ALLOW_RUN_AS_ROOT_CONFIRM='1',
+               OMPI_MCA_rmaps_base_oversubscribe='1')
+    result = subprocess.run([MPIRUN, '-n', '3', sys.executable, os.path.abspath(__file__), str(nb_slots)]
+                            + [str(size) for size in sizes],
+                            env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nest_elephant_tvb'))
+    try:
+        _handoff(int(sys.argv[1]), [int(size) for size in sys.argv[2:]])
+    except BaseException:
+        traceback.print_exc()
+        from mpi4py import MPI
+        MPI.COMM_WORLD.Abort(1)
@@ -0,0 +1,70 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+import importlib.util
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('tvb.simulator.simulator')
+from tvb.datatypes.connectivity import Connectivity
+from tvb.simulator import coupling, integrators, models, monitors, simulator
+from nest_elephant_tvb.tvb import coupling as demo_coupling
+
+# the copy of the action adapters, imported by the wrapper as action_adapters_alphabrunel.tvb_simulator.coupling
+PATH_ADAPTER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))), 'action_adapters', 'tvb_simulator', 'coupling.py')
+
+
+def _adapter_coupling():
+    spec = importlib.util.spec_from_file_location('adapter_coupling', PATH_ADAPTER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class NodeMean(coupling.Linear):
+    """coupling with a post function which is not applied node by node"""
+    def post(self, gx):
+        return gx - gx.mean(axis=1, keepdims=True)
+
+
+def _simulator(coupling_function, model, nb_nodes=8, seed=1):
+    """simulator of a small connectivity with delays, and a random history"""
+    rng = np.random.default_rng(seed)
+    weights = rng.random((nb_nodes, nb_nodes)) * (rng.random((nb_nodes, nb_nodes)) < 0.5)
+    np.fill_diagonal(weights, 0.0)
+    connectivity = Connectivity(weights=weights, tract_lengths=rng.uniform(1.0, 30.0, (nb_nodes, nb_nodes)),
+                                region_labels=np.array([str(i) for i in range(nb_nodes)]),
+                                centres=rng.random((nb_nodes, 3)), speed=np.array([3.0]))
+    sim = simulator.Simulator(connectivity=connectivity, model=model, coupling=coupling_function,
+                              integrator=integrators.HeunDeterministic(dt=0.1),
+                              monitors=(monitors.Raw(),), simulation_length=1.0)
+    sim.configure()
+    sim.history.buffer[:] = rng.uniform(-1.0, 1.0, sim.history.buffer.shape)
+    return sim
+
+
+def _reference(sim, id_proxy, time_synch_n):
+    """coupling of the proxy nodes with the coupling function of the simulator, one time step at a time"""
+    steps = [np.swapaxes(sim._loop_compute_node_coupling(i)[:, id_proxy, :], 1, 2) for i in range(time_synch_n)]
+    return np.stack(steps).reshape(-1, len(id_proxy))
+
+
+@pytest.mark.parametrize('module', ['demo', 'adapter'])
+@pytest.mark.parametrize('coupling_function, is_post_by_node', [
+    (coupling.Linear(a=np.array([0.3]), b=np.array([0.1])), True),
+    (coupling.Difference(), True),
+    (coupling.Kuramoto(), True),
+    (coupling.Sigmoidal(), True),
+    (NodeMean(), False)])
+@pytest.mark.parametrize('model', [models.Generic2dOscillator, models.Epileptor, models.ReducedSetFitzHughNagumo])
+def test_initial_coupling(module, coupling_function, is_post_by_node, model):
+    module = demo_coupling if module == 'demo' else _adapter_coupling()
+    sim = _simulator(coupling_function, model())
+    id_proxy = np.array([5, 1, 3])
+    assert module._is_post_by_node(sim.coupling, sim.history, id_proxy) == is_post_by_node
+    # the vectorized path when the post function is applied node by node, otherwise the loop on the time steps
+    history = sim.history
+    out = np.empty((20 * history.n_cvar * history.n_mode, len(id_proxy)))
+    module.initial_coupling(sim, id_proxy, 20, out)
+    assert np.allclose(out, _reference(sim, id_proxy, 20))
@@ -0,0 +1,125 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+import multiprocessing
+import time
+import numpy as np
+import pytest
+
+# the spawned processes import this module: conftest gives them nest_elephant_tvb.transformation, the old demo
+import conftest  # noqa: F401
+from nest_elephant_tvb.transformation.communication.internal_process import SharedMemoryRing, check_launcher, \
+    run_processes
+
+
+@pytest.fixture
+def context():
+    return multiprocessing.get_context('spawn')
+
+
+@pytest.fixture
+def ring(context):
+    """ring of 2 slots of 6 doubles, destroyed at the end of the test"""
+    ring = SharedMemoryRing(context, 6, shape_size=2, nb_slots=2)
+    yield ring
+    ring.detach()
+    ring.unlink()
+
+
+def _write(ring, value, shape):
+    slot = ring.reserve()
+    ring.data[slot][:] = value
+    ring.commit(slot, shape)
+
+
+def test_order(ring):
+    for step, shape in enumerate([[3], [2, 3], []]):
+        _write(ring, step, shape)
+        slot = ring.acquire()
+        assert ring.shape(slot) == shape
+        assert np.all(ring.data[slot] == step)
+        ring.release(slot)
+    with pytest.raises(Exception, match='shape of the data too long'):
+        ring.commit(ring.reserve(), [1, 2, 3])
+
+
+def test_close_with_pending_slots(ring):
+    _write(ring, 1.0, [6])
+    _write(ring, 2.0, [6])
+    ring.close()
+    # the slots written before the end are still read, the end is given to each next call
+    for value in (1.0, 2.0):
+        slot = ring.acquire()
+        assert np.all(ring.data[slot] == value)
+        ring.release(slot)
+    assert ring.acquire() is None
+    assert ring.acquire() is None
+
+
+def test_stop(ring):
+    _write(ring, 1.0, [6])
+    ring.stop()
+    assert ring.reserve() is None
+    assert ring.reserve() is None
+
+
+def _writer(ring, nb_steps):
+    """process: write the steps, then end the communication"""
+    for step in range(nb_steps):
+        _write(ring, step, [step % 6 + 1])
+    ring.close()
+    ring.detach()
+
+
+def _reader(ring):
+    """process: read until the end of the communication"""
+    while True:
+        slot = ring.acquire()
+        if slot is None:
+            break
+        ring.release(slot)
+    ring.detach()
+
+
+def _fail():
+    """process: fail at the start"""
+    raise Exception('failure of the process')
+
+
+def _sleep():
+    """process: waiting outside the rings"""
+    time.sleep(60.0)
+
+
+def test_processes(context, ring):
+    # the writer is ahead of the reader by 1 step at most
+    writer = context.Process(target=_writer, args=(ring, 20))
+    writer.start()
+    for step in range(20):
+        slot = ring.acquire()
+        assert ring.shape(slot) == [step % 6 + 1]
+        assert np.all(ring.data[slot] == step)
+        ring.release(slot)
+    assert ring.acquire() is None
+    writer.join(timeout=10.0)
+    assert writer.exitcode == 0
+
+
+def test_run_processes_failure(context):
+    ring = SharedMemoryRing(context, 6)
+    reader = context.Process(target=_reader, args=(ring,), name='reader')
+    sleeper = context.Process(target=_sleep, name='sleeper')
+    failed = context.Process(target=_fail, name='failed')
+    with pytest.raises(Exception, match='failed 1'):
+        run_processes([reader, sleeper, failed], [ring], timeout=1.0)
+    # the reader is woken up by the end of the ring, the other one is terminated
+    assert reader.exitcode == 0
+    assert sleeper.exitcode != 0
+
+
+def test_check_launcher(monkeypatch):
+    for name in ('OMPI_COMM_WORLD_SIZE', 'PMIX_RANK', 'PMI_RANK'):
+        monkeypatch.delenv(name, raising=False)
+    check_launcher()
+    monkeypatch.setenv('PMI_RANK', '0')
+    with pytest.raises(Exception, match='PMI_RANK'):
+        check_launcher()
@@ -0,0 +1,66 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+from threading import Thread
+import numpy as np
+
+# the communication between the threads of the old demo, nest_elephant_tvb.transformation is its folder (see conftest)
+from nest_elephant_tvb.transformation.communication.internal_thread import ThreadBuffer
+
+
+def _write(buffer, value, shape=(2,)):
+    slot = buffer.reserve()
+    buffer.data[slot][:] = value
+    buffer.commit(slot, shape)
+    return slot
+
+
+def test_order():
+    buffer = ThreadBuffer((2,), 'd', nb_slots=3)
+    for value in range(3):
+        _write(buffer, value)
+    for value in range(3):
+        slot = buffer.acquire()
+        assert np.all(buffer.data[slot] == value) and buffer.shape[slot] == (2,)
+        buffer.release(slot)
+    assert len(buffer.free) == 3 and not buffer.full
+
+
+def test_close_with_pending_slots():
+    buffer = ThreadBuffer((2,), 'd', nb_slots=2)
+    _write(buffer, 1.0)
+    _write(buffer, 2.0)
+    buffer.close()
+    # the slots written before the end are still read
+    for value in (1.0, 2.0):
+        slot = buffer.acquire()
+        assert np.all(buffer.data[slot] == value)
+        buffer.release(slot)
+    assert buffer.acquire() is None
+
+
+def test_close_wakes_up_the_reader():
+    buffer = ThreadBuffer((2,), 'd')
+    result = []
+    reader = Thread(target=lambda: result.append(buffer.acquire()))
+    reader.start()
+    buffer.close()
+    reader.join(timeout=10.0)
+    assert not reader.is_alive() and result == [None]
+
+
+def test_stop_with_pending_slots():
+    buffer = ThreadBuffer((2,), 'd', nb_slots=2)
+    _write(buffer, 1.0)
+    slot = buffer.reserve()
+    # the writer is blocked: all the slots are used
+    result = []
+    writer = Thread(target=lambda: result.append(buffer.reserve()))
+    writer.start()
+    buffer.stop()
+    writer.join(timeout=10.0)
+    assert not writer.is_alive() and result == [None]
+    # the written slots are dropped and the slot committed after the stop goes back to the free slots
+    assert not buffer.full
+    buffer.commit(slot, (2,))
+    assert not buffer.full and slot in buffer.free
+    assert buffer.reserve() is None
@@ -0,0 +1,79 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+import importlib.util
+import os
+import numpy as np
+import pytest
+
+# the storage of the results of the monitors of the action adapters
+PATH_STORAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))), 'action_adapters', 'tvb_simulator', 'monitor_storage.py')
+
+
+@pytest.fixture(scope='module')
+def storage():
+    spec = importlib.util.spec_from_file_location('monitor_storage', PATH_STORAGE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _samples(nb_windows, nb_samples, shape, seed=1):
+    """(time, values) of the samples of each window"""
+    rng = np.random.default_rng(seed)
+    return [[(window * 2.0 + sample * 0.5, rng.random(shape)) for sample in range(nb_samples)]
+            for window in range(nb_windows)]
+
+
+def test_write_and_load(tmp_path, storage):
+    path = str(tmp_path)
+    windows = [_samples(7, 4, (2, 5, 1)), _samples(7, 1, (1, 5, 3), seed=2)]
+    writer = storage.MonitorWriter(path, 2, nb_windows=3)
+    flushes = []
+    flush = writer.flush
+    writer.flush = lambda: flushes.append(True) or flush()
+    for window in range(7):
+        for index_monitor in range(2):
+            for sample in windows[index_monitor][window]:
+                writer.append(index_monitor, sample)
+        writer.end_window()
+        # the samples are written every 3 windows
+        assert len(flushes) == (window + 1) // 3
+    writer.close()
+    results = storage.load_monitor_results(path, 2)
+    for index_monitor, (times, values) in enumerate(results):
+        samples = [sample for window in windows[index_monitor] for sample in window]
+        assert isinstance(values, np.memmap)
+        assert np.array_equal(times, [time for time, _ in samples])
+        assert np.array_equal(values, np.stack([value for _, value in samples]))
+
+
+def test_no_sample(tmp_path, storage):
+    storage.MonitorWriter(str(tmp_path), 1).close()
+    (times, values), = storage.load_monitor_results(str(tmp_path), 1)
+    assert times.shape == (0,) and values.shape == (0,)
+
+
+def test_close_on_exception(tmp_path, storage):
+    with pytest.raises(RuntimeError):
+        with storage.MonitorWriter(str(tmp_path), 1) as writer:
+            writer.append(0, (0.5, np.ones((2, 3, 1))))
+            writer.end_window()
+            raise RuntimeError('failure of the simulation')
+    # the samples before the failure are in the files
+    (times, values), = storage.load_monitor_results(str(tmp_path), 1)
+    assert np.array_equal(times, [0.5]) and np.array_equal(values, np.ones((1, 2, 3, 1)))
+    # only the first call of close has an effect
+    writer.close()
+
+
+def test_bad_shape(tmp_path, storage):
+    writer = storage.MonitorWriter(str(tmp_path), 1, nb_windows=1)
+    writer.append(0, (0.0, np.ones((2, 3, 1))))
+    writer.end_window()
+    writer.append(0, (0.5, np.ones((2, 4, 1))))
+    with pytest.raises(Exception, match='bad shape'):
+        writer.close()
+    # the headers are written even if the last samples can't be
+    (times, values), = storage.load_monitor_results(str(tmp_path), 1)
+    assert times.shape == (1,) and values.shape == (1, 2, 3, 1)
@@ -0,0 +1,96 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+import os
+import shutil
+import subprocess
+import sys
+import traceback
+import numpy as np
+import pytest
+
+# the exchange needs an INTER communicator: this file is run with mpirun by the tests
+MPIRUN = shutil.which('mpirun')
+
+# (receiver, size of the payload, in place): the first message, a change of destination,
+# a payload larger than the buffer of the receiver, then larger than the buffer of the sender,
+# a payload written in the message buffer and sent without blocking
+PLAN = [(0, 3, False), (1, 3, False), (1, 6, False), (0, 12, False), (0, 5, True)]
+
+
+def _data(step, size):
+    return np.arange(size, dtype='d') + 100.0 * step
+
+
+def _exchange():
+    """
+    one sender (rank 0) and 2 receivers (ranks 1 and 2) with buffers of 8 and 4 doubles,
+    the receivers take turns to ask for the messages of the plan
+    """
+    from mpi4py import MPI
+    from Interscale_hub.protocol import Header, MessageReceiver, MessageSender, MessageStatus
+    world = MPI.COMM_WORLD
+    rank = world.Get_rank()
+    local = world.Split(0 if rank == 0 else 1, rank)
+    comm = local.Create_intercomm(0, world, 1 if rank == 0 else 0)
+    if rank == 0:
+        sender = MessageSender(comm, 8, source=MPI.ANY_SOURCE)
+        for step, (_, size, in_place) in enumerate(PLAN):
+            assert sender.wait_request() == MessageStatus.DATA
+            times = [step * 2.0, (step + 1) * 2.0]
+            if in_place:
+                payload = sender.payload(size)
+                payload[:] = _data(step, size)
+                sender.send(step, times, payload, blocking=False)
+            else:
+                # the message buffer of the sender holds 8 doubles of payload
+                assert (sender.payload(size) is None) == (size > 8)
+                sender.send(step, times, _data(step, size))
+            world.Barrier()
+        # the end of the simulation for the first receiver, the second one stops by itself
+        assert sender.wait_request() == MessageStatus.DATA
+        sender.send_end()
+        assert sender.wait_request() == MessageStatus.END
+        sender.free()
+    else:
+        receiver_rank = comm.Get_rank()
+        receiver = MessageReceiver(comm, 8 if receiver_rank == 0 else 4)
+        for step, (dest, size, _) in enumerate(PLAN):
+            if dest == receiver_rank:
+                status, header, payload = receiver.receive()
+                assert status == MessageStatus.DATA
+                assert header[Header.STEP] == step
+                assert np.array_equal(header[Header.TIME_START:Header.TIME_END + 1], [step * 2.0, (step + 1) * 2.0])
+                assert header[Header.COUNT] == size
+                assert np.array_equal(payload, _data(step, size))
+            world.Barrier()
+        if receiver_rank == 0:
+            status, header, payload = receiver.receive()
+            assert status == MessageStatus.END
+            assert payload.shape == (0,)
+        else:
+            receiver.end()
+        receiver.free()
+    comm.Disconnect()
+    world.Barrier()
+    # no message is left pending after the end of the exchange
+    assert not world.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG)
+
+
+@pytest.mark.skipif(MPIRUN is None, reason='mpirun is not available')
+def test_exchange():
+    pytest.importorskip('mpi4py')
+    env = dict(os.environ, OMPI_ALLOW_RUN_AS_ROOT='1', OMPI_ALLOW_RUN_AS_ROOT_CONFIRM='1',
+               OMPI_MCA_rmaps_base_oversubscribe='1')
+    result = subprocess.run([MPIRUN, '-n', '3', sys.executable, os.path.abspath(__file__)],
+                            env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nest_elephant_tvb'))
+    try:
+        _exchange()
+    except BaseException:
+        traceback.print_exc()
+        from mpi4py import MPI
+        MPI.COMM_WORLD.Abort(1)
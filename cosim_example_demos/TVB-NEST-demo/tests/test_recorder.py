@@ -0,0 +1,63 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+import os
+import numpy as np
+import pytest
+
+# the recorder of the old demo, nest_elephant_tvb.transformation is its folder (see conftest)
+from nest_elephant_tvb.transformation.transformation_function.recorder import Recorder
+
+
+def test_one_stream(tmp_path):
+    rng = np.random.default_rng(1)
+    blocks = [rng.random((size, 3)) for size in (4, 0, 7, 1)]
+    path = str(tmp_path / 'rate.npy')
+    recorder = Recorder(path, max_blocks=2)
+    for block in blocks:
+        recorder.record(block)
+    recorder.close()
+    # the same file as the former np.save of the concatenation of the blocks
+    np.save(str(tmp_path / 'reference.npy'), np.concatenate(blocks))
+    with open(path, 'rb') as file, open(str(tmp_path / 'reference.npy'), 'rb') as reference:
+        assert file.read() == reference.read()
+    assert sorted(os.listdir(str(tmp_path))) == ['rate.npy', 'reference.npy']
+
+
+@pytest.mark.parametrize('sizes', [[[2, 0, 3], [1, 4, 0]], [[2, 2, 2], [2, 2, 2]], [[0, 0, 0]]])
+def test_streams(tmp_path, sizes):
+    rng = np.random.default_rng(2)
+    steps = [[rng.random(size) for size in step] for step in sizes]
+    path = str(tmp_path / 'spikes.npy')
+    recorder = Recorder(path, nb_streams=3)
+    for step in steps:
+        recorder.record_streams(step)
+    recorder.close()
+    # array of objects with the concatenation of each stream
+    data = np.load(path, allow_pickle=True)
+    assert data.dtype == object and data.shape == (3,)
+    for stream in range(3):
+        assert np.array_equal(data[stream], np.concatenate([step[stream] for step in steps]))
+    assert os.listdir(str(tmp_path)) == ['spikes.npy']
+
+
+def test_bad_blocks(tmp_path):
+    recorder = Recorder(str(tmp_path / 'rate.npy'))
+    recorder.record(np.zeros((2, 3)))
+    with pytest.raises(Exception, match='bad shape'):
+        recorder.record(np.zeros((2, 4)))
+    with pytest.raises(Exception, match='record_streams'):
+        Recorder(str(tmp_path / 'spikes.npy'), nb_streams=2).record(np.zeros(2))
+    with pytest.raises(Exception, match='bad number of streams'):
+        Recorder(str(tmp_path / 'spikes.npy'), nb_streams=2).record_streams([np.zeros(2)])
+
+
+def test_error_of_the_writing_thread(tmp_path):
+    # the folder of the file doesn't exist: the writing thread fails at the start
+    recorder = Recorder(str(tmp_path / 'missing' / 'rate.npy'), max_blocks=1, timeout=0.1)
+    recorder.thread.join(timeout=10.0)
+    with pytest.raises(Exception, match='Recorder') as error:
+        for _ in range(3):
+            recorder.record(np.zeros((1, 2)))
+    assert isinstance(error.value.__cause__, OSError)
+    with pytest.raises(Exception, match='Recorder'):
+        recorder.close()
@@ -0,0 +1,109 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+import numpy as np
+import pytest
+
+pytest.importorskip('quantities')
+from nest_elephant_tvb.Interscale_hub.science import inhomogeneous_poisson_batch, region_poisson_trains, \
+    rates_to_spikes, shared_poisson_batch, spikes_to_rate
+
+
+def _check_trains(spikes, offsets, nb_trains):
+    """the layout of the spike trains: offsets of each train and spikes sorted in each train"""
+    assert offsets.shape == (nb_trains + 1,)
+    assert offsets[0] == 0 and offsets[-1] == spikes.shape[0]
+    assert np.all(np.diff(offsets) >= 0)
+    for i in range(nb_trains):
+        assert np.all(np.diff(spikes[offsets[i]:offsets[i + 1]]) >= 0)
+
+
+def test_inhomogeneous_poisson_batch_times():
+    rates = np.array([[100.0, 0.0, 300.0], [0.0, 200.0, 0.0]])
+    spikes, offsets = inhomogeneous_poisson_batch(rates, 5.0, 10.0, np.random.default_rng(1))
+    _check_trains(spikes, offsets, 2)
+    # the spikes are in the bins of non null rate
+    bins = np.floor((spikes - 5.0) / 10.0).astype(int)
+    assert np.all(rates[np.repeat([0, 1], np.diff(offsets)), bins] > 0.0)
+
+
+def test_inhomogeneous_poisson_batch_time_steps():
+    rates = np.abs(np.random.default_rng(2).normal(500.0, 100.0, (4, 6)))
+    spikes, offsets = inhomogeneous_poisson_batch(rates, 21, 5, np.random.default_rng(3), resolution=0.1)
+    _check_trains(spikes, offsets, 4)
+    assert spikes.dtype.kind == 'i'
+    # the number of spikes of each bin is the first draw of the generator
+    counts = np.random.default_rng(3).poisson(rates * (5 * 0.1 * 1e-3))
+    trains = np.repeat(np.arange(4), np.diff(offsets))
+    bins = (spikes - 21) // 5
+    assert np.array_equal(np.bincount(trains * 6 + bins, minlength=24).reshape(4, 6), counts)
+
+
+def test_inhomogeneous_poisson_batch_rate():
+    rates = np.full((1000, 10), 50.0)
+    spikes, offsets = inhomogeneous_poisson_batch(rates, 0.0, 100.0, np.random.default_rng(4))
+    # 50 spikes by train in 1 s, the mean of 1000 trains is within 5 standard deviations
+    assert abs(np.mean(np.diff(offsets)) - 50.0) < 5 * np.sqrt(50.0 / 1000)
+
+
+def test_shared_poisson_batch_rate():
+    rate = np.full(10, 50.0)
+    for percentage_shared, copy_probability in ((0.0, 0.5), (0.5, 0.5), (0.5, 0.2), (1.0, 1.0)):
+        # the spike trains share the realisation of the mother spike train: mean over 50 realisations
+        nb_spikes = []
+        for seed in range(50):
+            spikes, offsets = shared_poisson_batch(rate, 200, 0.0, 100.0, percentage_shared,
+                                                   np.random.default_rng(seed), np.random.default_rng(seed + 50),
+                                                   copy_probability=copy_probability)
+            _check_trains(spikes, offsets, 200)
+            nb_spikes.append(np.mean(np.diff(offsets)))
+        assert abs(np.mean(nb_spikes) - 50.0) < 5 * np.sqrt(50.0 / 50)
+    # all the spikes are copied from the mother spike train
+    spikes, offsets = shared_poisson_batch(rate, 3, 0.0, 100.0, 1.0, np.random.default_rng(7), copy_probability=1.0)
+    assert np.array_equal(spikes[offsets[0]:offsets[1]], spikes[offsets[2]:offsets[3]])
+
+
+def test_shared_poisson_batch_parameters():
+    with pytest.raises(Exception):
+        shared_poisson_batch(np.ones(2), 3, 0.0, 1.0, 1.5)
+    with pytest.raises(Exception):
+        shared_poisson_batch(np.ones(2), 3, 0.0, 1.0, 0.5, copy_probability=0.0)
+
+
+def test_region_poisson_trains_ranks():
+    rate = np.full(20, 2000.0)
+    for percentage_shared in (0.0, 0.3):
+        spikes, offsets = region_poisson_trains(rate, 10, 0, 10, 41, 2, 0.1, 125, 3, percentage_shared)
+        _check_trains(spikes, offsets, 10)
+        # the same spike trains for any split of the spike generators between ranks
+        for first, last in ((0, 4), (4, 9), (9, 10)):
+            part, part_offsets = region_poisson_trains(rate, 10, first, last, 41, 2, 0.1, 125, 3, percentage_shared)
+            assert np.array_equal(part, spikes[offsets[first]:offsets[last]])
+            assert np.array_equal(part_offsets, offsets[first:last + 1] - offsets[first])
+    # other step or other region: other spike trains
+    other, _ = region_poisson_trains(rate, 10, 0, 10, 81, 2, 0.1, 125, 3)
+    assert not np.array_equal(other - 40, region_poisson_trains(rate, 10, 0, 10, 41, 2, 0.1, 125, 3)[0])
+    other, _ = region_poisson_trains(rate, 10, 0, 10, 41, 2, 0.1, 125, 4)
+    assert not np.array_equal(other, region_poisson_trains(rate, 10, 0, 10, 41, 2, 0.1, 125, 3)[0])
+
+
+def test_spikes_to_rate():
+    # one spike train: the spikes of [start, stop)
+    assert np.allclose(spikes_to_rate(np.array([1.0, 2.0, 3.0, 10.0]), 0.0, 10.0), [300.0])
+    rates = spikes_to_rate(np.array([1.0, 2.0, 3.0, 10.0]), 0.0, 10.0, windows=5.0)
+    assert np.allclose(rates, [[600.0], [0.0]])
+    # multiple spike trains, one column by train
+    trains = [np.array([0.0, 4.0, 6.0]), np.array([]), np.array([5.0, 9.5])]
+    rates = spikes_to_rate(trains, 0.0, 10.0, windows=5.0)
+    assert np.allclose(rates, [[400.0, 0.0, 0.0], [200.0, 0.0, 400.0]])
+    # overlap of the windows
+    rates = spikes_to_rate(trains, 0.0, 10.0, windows=4.0, overlap=0.5)
+    assert np.allclose(rates[:, 0], [250.0, 250.0, 500.0, 250.0, 0.0])
+    with pytest.raises(Exception):
+        spikes_to_rate(trains, 0.0, 10.0, windows=4.0, overlap=1.0)
+
+
+def test_rates_to_spikes_to_rate():
+    spikes, offsets = rates_to_spikes(np.full(500, 40.0), 0.0, 1000.0, rng=np.random.default_rng(8))
+    _check_trains(spikes, offsets, 500)
+    rates = spikes_to_rate(np.split(spikes, offsets[1:-1]), 0.0, 1000.0)
+    assert abs(np.mean(rates) - 40.0) < 5 * np.sqrt(40.0 / 500)
@@ -0,0 +1,40 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+import numpy as np
+import pytest
+
+pytest.importorskip('elephant')
+# the transformation function of the old demo, nest_elephant_tvb.transformation is its folder (see conftest)
+transformation = pytest.importorskip('nest_elephant_tvb.transformation.transformation_function.transformation_function')
+
+
+@pytest.fixture
+def transformer(monkeypatch):
+    """transformation spike to rate, without the communication with the other components"""
+    def init(self, id_transformer, param, *arg, **karg):
+        self.id = id_transformer
+        self.time_synch = param['time_synchronization']
+        self.dt = param['resolution']
+    monkeypatch.setattr(transformation.AbstractTransformationSpikeRate, '__init__', init)
+    param = {'time_synchronization': 2.0, 'resolution': 0.1, 'nb_neurons': [50], 'id_first_neurons': [11]}
+    return transformation.TransformationSpikeRate(0, param)
+
+
+def _buffer(count, nb_spikes, rng):
+    """buffer of NEST: [id device, id neuron, time] of each spike of the step"""
+    ids = rng.integers(11, 61, nb_spikes)
+    times = count * 2.0 + rng.integers(1, 21, nb_spikes) * 0.1
+    buffer = np.stack((np.full(nb_spikes, 7.0), ids, times), axis=1).ravel()
+    return buffer.shape[0], buffer
+
+
+@pytest.mark.parametrize('count, nb_spikes', [(0, 0), (0, 1), (1, 200), (5, 1000)])
+def test_spike_to_rate_elephant(transformer, count, nb_spikes):
+    size_buffer, buffer = _buffer(count, nb_spikes, np.random.default_rng(count + nb_spikes))
+    times, rate = transformer.spike_to_rate(count, size_buffer, buffer)
+    times_reference, rate_reference = transformer.spike_to_rate_elephant(count, size_buffer, buffer)
+    # the rates of elephant are a quantity in Hz
+    rate_reference = np.ravel(np.asarray(rate_reference))
+    assert np.array_equal(times, times_reference)
+    assert rate.shape == rate_reference.shape
+    assert np.allclose(rate, rate_reference)
@@ -0,0 +1,119 @@
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements; and to You under the Apache License, Version 2.0. "
+import numpy as np
+import pytest
+
+pytest.importorskip('quantities')
+pytest.importorskip('EBRAINS_ConfigManager')
+pytest.importorskip('tvb_multiscale')
+from nest_elephant_tvb.Interscale_hub.transformer import analyse_data, generate_data, neuron_regions, store_data
+
+
+class _Logger:
+    """logger which keeps the warnings"""
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+
+def _param(**param):
+    """parameters of the transformations: 2 ms of synchronization at 0.1 ms, 3 regions"""
+    default = {'time_synchronization': 2.0, 'resolution': 0.1, 'width': 0.5,
+               'id_first_neurons': [30, 10, 50], 'nb_neurons': [10, 20, 5]}
+    default.update(param)
+    return default
+
+
+def test_neuron_regions():
+    region, offset = neuron_regions(np.array([9, 10, 29, 30, 39, 40, 49, 50, 54, 55]),
+                                    np.array([30, 10, 50]), np.array([10, 20, 5]))
+    assert np.array_equal(region, [-1, 1, 1, 0, 0, -1, -1, 2, 2, -1])
+    assert np.array_equal(offset[region >= 0], [0, 19, 0, 9, 0, 4])
+
+
+def test_store_data_bins():
+    logger = _Logger()
+    store = store_data(_param(), logger)
+    assert store.nb_bins == 20
+    count = 3
+    # the ticks count * nb_bins + 1 to (count + 1) * nb_bins are the bins 0 to nb_bins - 1
+    ticks = np.array([61, 61, 80, 70, 70, 60, 81, 65])
+    ids = np.array([30, 12, 54, 39, 40, 31, 31, 55])
+    store.add_spikes(count, ticks, ids)
+    hist = store.return_data()
+    expected = np.zeros((20, 3))
+    expected[0, 0] = expected[0, 1] = expected[19, 2] = expected[9, 0] = 1.0
+    assert np.array_equal(hist, expected)
+    # the events of the ticks 60 and 81 are outside of the step, the neurons 40 and 55 outside of the regions
+    assert len(logger.warnings) == 1 and '2 spike events' in logger.warnings[0]
+
+
+def test_store_data_swap():
+    store = store_data(_param())
+    store.add_spikes(0, np.array([1, 2]), np.array([10, 10]))
+    first = store.return_data().copy()
+    # the histogram of the next step starts empty and the returned one is not modified by it
+    store.add_spikes(1, np.array([21]), np.array([50]))
+    assert np.array_equal(first[:2, 1], [1.0, 1.0]) and first.sum() == 2.0
+    second = store.return_data()
+    assert second[0, 2] == 1.0 and second.sum() == 1.0
+    assert store.return_data().sum() == 0.0
+
+
+def test_analyse_data_window():
+    param = _param()
+    analyse = analyse_data(param)
+    width = analyse.width
+    assert width == 5
+    rng = np.random.default_rng(1)
+    hists = [rng.poisson(2.0, (20, 3)).astype('d') for _ in range(3)]
+    # sliding window over the concatenation of the histograms, with the empty bins before the first step
+    spikes = np.concatenate([np.zeros((width, 3))] + hists)
+    cumsum = np.concatenate([np.zeros((1, 3)), np.cumsum(spikes, axis=0)])
+    expected = (cumsum[width:] - cumsum[:-width])[1:] / (np.array(param['nb_neurons']) * param['resolution'] * width)
+    for count, hist in enumerate(hists):
+        times, rate = analyse.analyse(count, hist)
+        assert np.allclose(times, [count * 2.0, (count + 1) * 2.0])
+        assert rate.shape == (60,)
+        assert np.allclose(rate.reshape(20, 3), expected[count * 20:(count + 1) * 20])
+
+
+def test_analyse_data_out():
+    analyse = analyse_data(_param())
+    out = np.full(60, -1.0)
+    hist = np.ones((20, 3))
+    _, rate = analyse.analyse(0, hist, out)
+    assert rate is out
+    assert np.allclose(out.reshape(20, 3)[-1], 1 / (np.array([10, 20, 5]) * 0.1))
+
+
+def _generate(**param):
+    default = {'nb_spike_generator': 6, 'nb_brain_synapses': 2, 'resolution': 0.1, 'seed': 1,
+               'percentage_shared': 0.0, 'copy_probability': 0.5, 'nb_spike_generator_region': [4, 2]}
+    default.update(param)
+    return generate_data(default)
+
+
+def test_generate_rate_layout():
+    generator = _generate()
+    rate = np.array([[1.0, -2.0], [3.0, 4.0], [-5.0, 6.0], [7.0, 8.0]])
+    data, offsets = generator.generate_rate(0, np.array([10.0, 12.0]), rate.ravel())
+    # 4 rates of 5 time steps, from the first time step after the start of the step
+    assert np.array_equal(offsets, np.arange(7) * 8)
+    pairs = data.reshape(6, 4, 2)
+    assert np.allclose(pairs[:, :, 0], (101 + np.arange(4) * 5) * 0.1)
+    regions = [0, 0, 0, 0, 1, 1]
+    assert np.allclose(pairs[:, :, 1], np.abs(rate.T[regions] * 2))
+
+
+def test_generate_rate_first_generator():
+    # the generators 3 to 4 of the regions of 4 and 2 generators: 1 in each region
+    generator = _generate(nb_spike_generator=2, id_first_spike_generator=3)
+    rate = np.array([[1.0, 2.0], [3.0, 4.0]])
+    data, offsets = generator.generate_rate(0, np.array([0.0, 1.0]), rate.ravel())
+    assert np.array_equal(offsets, [0, 4, 8])
+    pairs = data.reshape(2, 2, 2)
+    assert np.allclose(pairs[:, :, 0], [[0.1, 0.6], [0.1, 0.6]])
+    assert np.allclose(pairs[:, :, 1], [[2.0, 6.0], [4.0, 8.0]])